@@ -176,7 +176,7 @@ export default function FaceUploadPage() {
                     <tr key={face.id} className="border-b border-gray-100">
                       <td className="p-4">
                         <Avatar className="w-12 h-12">
-                          <AvatarImage src={face.face_image_path || "/placeholder.svg"} />
+                          <AvatarImage src={face.thumbnail_path || face.face_image_path || "/placeholder.svg"} />
                           <AvatarFallback>{face.face_name[0]}</AvatarFallback>
                         </Avatar>
                       </td>
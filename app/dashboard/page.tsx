@@ -9,7 +9,7 @@ import { Button } from "@/components/ui/button"
 import Link from "next/link"
 import { ProtectedRoute } from "@/components/protected-route"
 import { useAuthContext } from "@/components/auth-provider"
-import { api, Camera as CameraType, RegisteredFace, DetectionLog } from "@/lib/api"
+import { api, subscribeEvents, Camera as CameraType, RegisteredFace, DetectionLog } from "@/lib/api"
 
 export default function DashboardPage() {
   const [sidebarOpen, setSidebarOpen] = useState(false)
@@ -43,6 +43,32 @@ export default function DashboardPage() {
     }
 
     fetchData()
+
+    // Live updates replace polling; counts arrive as deltas
+    const addToCount = (value: string, delta: number) =>
+      String(Math.max(0, parseInt(value, 10) + delta)).padStart(2, "0")
+
+    return subscribeEvents({
+      onStats: (delta) => {
+        setStats((current) => ({
+          ...current,
+          total_alerts_today: addToCount(current.total_alerts_today, delta.alerts ?? 0),
+          total_registered_faces: addToCount(current.total_registered_faces, delta.active_faces ?? 0),
+        }))
+      },
+      onCamera: (change) => {
+        setCameras((current) =>
+          current.map((camera) =>
+            camera.id === change.camera_id
+              ? { ...camera, status: change.status, last_seen: change.last_seen ?? camera.last_seen }
+              : camera
+          )
+        )
+      },
+      onResync: () => {
+        api.getDashboardStats().then(setStats).catch(() => {})
+      },
+    })
   }, [])
 
   const statsDisplay = [
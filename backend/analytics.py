@@ -0,0 +1,340 @@
+"""Detection analytics aggregated in SQL with a per-tenant TTL cache
+
+Every aggregate is a GROUP BY over detection_logs bounded on
+(user_id, detected_at), so only the small grouped result reaches Python.
+Results are cached per (user, query, range). Ranges that end in the past
+barely change and are kept longer than ranges that reach the present.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import Integer, cast, desc, distinct, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import IS_SQLITE
+from models import Camera, RegisteredFace, DetectionLog
+
+load_dotenv()
+
+ANALYTICS_CACHE_TTL_SECONDS = float(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "60"))
+# Ranges ending this long ago are treated as settled and cached longer
+ANALYTICS_SETTLED_AFTER_SECONDS = 3600
+ANALYTICS_SETTLED_TTL_SECONDS = float(os.getenv("ANALYTICS_SETTLED_TTL_SECONDS", "3600"))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "10000"))
+ANALYTICS_DEFAULT_DAYS = 7
+ANALYTICS_MAX_BUCKETS = 10000
+
+INTERVALS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+_SQLITE_BUCKET_FORMATS = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d 00:00:00"}
+
+sightings = func.coalesce(func.sum(DetectionLog.hit_count), 0)
+
+
+def bucket_expression(interval: str):
+    """Start of the hour/day bucket a detection falls in"""
+    if IS_SQLITE:
+        return func.strftime(_SQLITE_BUCKET_FORMATS[interval], DetectionLog.detected_at)
+    return func.date_trunc(interval, DetectionLog.detected_at)
+
+
+def truncate(value: datetime, interval: str) -> datetime:
+    value = value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if interval == "day" else value
+
+
+def _as_datetime(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _in_range(user_id: int, start: datetime, end: datetime):
+    return (
+        DetectionLog.user_id == user_id,
+        DetectionLog.detected_at >= start,
+        DetectionLog.detected_at < end,
+    )
+
+
+async def detections_over_time(
+    db: AsyncSession, user_id: int, start: datetime, end: datetime, interval: str = "hour"
+) -> List[dict]:
+    """Detections and sightings per hour or day, with empty buckets filled in"""
+    bucket = bucket_expression(interval)
+    result = await db.execute(
+        select(bucket, func.count(DetectionLog.id), sightings).where(
+            *_in_range(user_id, start, end)
+        ).group_by(bucket)
+    )
+    counts = {_as_datetime(row_bucket): (count, hits) for row_bucket, count, hits in result.all()}
+
+    buckets = []
+    step = INTERVALS[interval]
+    current = truncate(start, interval)
+    while current < end:
+        count, hits = counts.get(current, (0, 0))
+        buckets.append({"bucket": current, "detections": count, "sightings": int(hits)})
+        current += step
+    return buckets
+
+
+async def detections_by_camera(db: AsyncSession, user_id: int, start: datetime, end: datetime) -> List[dict]:
+    grouped = select(
+        DetectionLog.camera_id,
+        func.count(DetectionLog.id).label("detections"),
+        sightings.label("sightings"),
+        func.max(DetectionLog.detected_at).label("last_detected_at"),
+    ).where(
+        *_in_range(user_id, start, end)
+    ).group_by(DetectionLog.camera_id).subquery()
+
+    # Names are joined after grouping so the aggregate only scans detection_logs
+    result = await db.execute(
+        select(grouped, Camera.camera_name).outerjoin(
+            Camera, Camera.id == grouped.c.camera_id
+        ).order_by(desc(grouped.c.detections))
+    )
+    return [
+        {
+            "camera_id": row.camera_id,
+            "camera_name": row.camera_name,
+            "detections": row.detections,
+            "sightings": int(row.sightings),
+            "last_detected_at": _as_datetime(row.last_detected_at),
+        }
+        for row in result.all()
+    ]
+
+
+async def detections_by_face(
+    db: AsyncSession,
+    user_id: int,
+    start: datetime,
+    end: datetime,
+    limit: Optional[int] = None,
+    known_only: bool = False,
+    by_visit_days: bool = False
+) -> List[dict]:
+    """Per-face detection counts; registered_face_id None is unknown visitors
+
+    by_visit_days ranks by the number of distinct days a face was seen,
+    which is what "top visitors" means, rather than by raw detections.
+    """
+    conditions = list(_in_range(user_id, start, end))
+    if known_only:
+        conditions.append(DetectionLog.registered_face_id.isnot(None))
+    visit_days = func.count(distinct(bucket_expression("day")))
+    grouped = select(
+        DetectionLog.registered_face_id,
+        func.count(DetectionLog.id).label("detections"),
+        sightings.label("sightings"),
+        visit_days.label("visit_days"),
+        func.min(DetectionLog.detected_at).label("first_seen"),
+        func.max(DetectionLog.detected_at).label("last_seen"),
+    ).where(*conditions).group_by(DetectionLog.registered_face_id)
+    if by_visit_days:
+        grouped = grouped.order_by(desc("visit_days"), desc("detections"))
+    else:
+        grouped = grouped.order_by(desc("detections"))
+    if limit is not None:
+        grouped = grouped.limit(limit)
+    grouped = grouped.subquery()
+
+    result = await db.execute(
+        select(grouped, RegisteredFace.face_name).outerjoin(
+            RegisteredFace, RegisteredFace.id == grouped.c.registered_face_id
+        ).order_by(
+            *((desc(grouped.c.visit_days),) if by_visit_days else ()), desc(grouped.c.detections)
+        )
+    )
+    return [
+        {
+            "registered_face_id": row.registered_face_id,
+            "face_name": row.face_name,
+            "detections": row.detections,
+            "sightings": int(row.sightings),
+            "visit_days": row.visit_days,
+            "first_seen": _as_datetime(row.first_seen),
+            "last_seen": _as_datetime(row.last_seen),
+        }
+        for row in result.all()
+    ]
+
+
+async def unknown_visitors(
+    db: AsyncSession,
+    user_id: int,
+    start: datetime,
+    end: datetime,
+    limit: Optional[int] = None,
+    min_visit_days: int = 1
+) -> List[dict]:
+    """Recurring unknown visitors, ranked like top visitors by days seen
+
+    Groups unknown detections by their visitor cluster, see
+    visitor_clusters.py. Promoted clusters drop out, since promotion labels
+    their detections with the new face.
+    """
+    visit_days = func.count(distinct(bucket_expression("day")))
+    query = select(
+        DetectionLog.visitor_cluster_id,
+        func.count(DetectionLog.id).label("detections"),
+        sightings.label("sightings"),
+        visit_days.label("visit_days"),
+        func.count(distinct(DetectionLog.camera_id)).label("cameras"),
+        func.min(DetectionLog.detected_at).label("first_seen"),
+        func.max(DetectionLog.detected_at).label("last_seen"),
+        # Any one of the visitor's snapshots, to show alongside
+        func.max(DetectionLog.detection_image_path).label("detection_image_path"),
+    ).where(
+        *_in_range(user_id, start, end),
+        DetectionLog.registered_face_id.is_(None),
+        DetectionLog.visitor_cluster_id.isnot(None)
+    ).group_by(DetectionLog.visitor_cluster_id).having(
+        visit_days >= min_visit_days
+    ).order_by(desc("visit_days"), desc("detections"))
+    if limit is not None:
+        query = query.limit(limit)
+
+    result = await db.execute(query)
+    return [
+        {
+            "visitor_cluster_id": row.visitor_cluster_id,
+            "detections": row.detections,
+            "sightings": int(row.sightings),
+            "visit_days": row.visit_days,
+            "cameras": row.cameras,
+            "first_seen": _as_datetime(row.first_seen),
+            "last_seen": _as_datetime(row.last_seen),
+            "detection_image_path": row.detection_image_path,
+        }
+        for row in result.all()
+    ]
+
+
+async def confidence_histogram(
+    db: AsyncSession, user_id: int, start: datetime, end: datetime, bins: int = 10
+) -> List[dict]:
+    """Detections per equal-width confidence bin over [0, 1]"""
+    scaled = DetectionLog.detection_confidence * bins
+    # PostgreSQL rounds numeric -> integer casts, SQLite truncates
+    bin_index = cast(scaled, Integer) if IS_SQLITE else cast(func.floor(scaled), Integer)
+    result = await db.execute(
+        select(bin_index, func.count(DetectionLog.id)).where(
+            *_in_range(user_id, start, end),
+            DetectionLog.detection_confidence.isnot(None)
+        ).group_by(bin_index)
+    )
+    counts = [0] * bins
+    for index, count in result.all():
+        # A confidence of exactly 1.0 belongs to the last bin
+        counts[min(max(int(index), 0), bins - 1)] += count
+    return [
+        {"lower": round(i / bins, 6), "upper": round((i + 1) / bins, 6), "count": count}
+        for i, count in enumerate(counts)
+    ]
+
+
+def resolve_range(
+    start: Optional[datetime], end: Optional[datetime], interval: Optional[str] = None
+) -> Tuple[datetime, datetime]:
+    """Default to the last ANALYTICS_DEFAULT_DAYS days and validate the range
+
+    An open end is rounded up to the next minute so repeated dashboard
+    requests share a cache entry. Raises ValueError for invalid ranges.
+    """
+    if end is None:
+        end = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    if start is None:
+        start = end - timedelta(days=ANALYTICS_DEFAULT_DAYS)
+    if start >= end:
+        raise ValueError("start must be before end")
+    if interval is not None and (end - start) / INTERVALS[interval] > ANALYTICS_MAX_BUCKETS:
+        raise ValueError(f"Range too large for {interval} buckets. Use a larger interval or a shorter range.")
+    return start, end
+
+
+class AnalyticsCache:
+    """Bounded LRU of analytics results keyed by (user_id, query, parameters)
+
+    Concurrent misses for the same key share a single query.
+    """
+
+    def __init__(
+        self,
+        ttl: float = ANALYTICS_CACHE_TTL_SECONDS,
+        settled_ttl: float = ANALYTICS_SETTLED_TTL_SECONDS,
+        max_entries: int = ANALYTICS_CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.settled_ttl = settled_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _ttl_for(self, end: datetime) -> float:
+        settled = datetime.utcnow() - end >= timedelta(seconds=ANALYTICS_SETTLED_AFTER_SECONDS)
+        return self.settled_ttl if settled else self.ttl
+
+    async def get_or_compute(self, key: tuple, end: datetime, compute: Callable[[], Awaitable]):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            pending = self._inflight.get(key)
+
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark retrieved so an unawaited failure is not logged
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl_for(end))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drop a user's results, e.g. after renaming or deleting a camera or face"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+analytics_cache = AnalyticsCache()
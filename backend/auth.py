@@ -1,15 +1,25 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 import os
 from dotenv import load_dotenv
 
 from database import get_db
 from models import User
+from user_cache import user_cache, UserSnapshot
+from metrics import tag_request
+from sessions import session_store
 
 load_dotenv()
 
@@ -18,6 +28,11 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-make-it-very-secure")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
+# bcrypt releases the GIL, so a small thread pool runs hashes in parallel
+# without blocking the event loop. 0 workers hashes inline on the loop.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "256"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
@@ -29,6 +44,76 @@ def get_password_hash(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
 
+class PasswordHashPool:
+    """Bounded thread pool for bcrypt work with queue-depth metrics"""
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt") if workers > 0 else None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+    
+    def _run(self, submitted_at: float, fn, *args):
+        started_at = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.wait_seconds += started_at - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+    
+    async def run(self, fn, *args):
+        """Run a hashing function off the event loop"""
+        if self._executor is None:
+            return fn(*args)
+        
+        with self._lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, time.monotonic(), fn, *args)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self.queued,
+                "active": self.active,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_seconds": self.wait_seconds / self.completed if self.completed else 0.0,
+            }
+
+password_hash_pool = PasswordHashPool()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the hashing pool"""
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the hashing pool"""
+    return await password_hash_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a new access token"""
     to_encode = data.copy()
@@ -37,7 +122,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # jti identifies the token's user_sessions row for revocation
+    to_encode["exp"] = expire
+    to_encode.setdefault("jti", uuid.uuid4().hex)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -49,11 +136,8 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get the current authenticated user"""
+async def authenticate_token(token: str, db: AsyncSession) -> UserSnapshot:
+    """Resolve a bearer token to its user, served from user_cache when possible"""
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -62,15 +146,37 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
+    # Logged-out tokens, checked against the in-memory revocation set
+    if session_store.is_revoked(payload.get("jti")):
+        raise credentials_exception
+    
+    cached = user_cache.get(email)
+    if cached is not None:
+        tag_request(cached.id)
+        return cached
+    
+    result = await db.execute(
+        select(User).options(joinedload(User.package)).where(User.email == email)
+    )
+    user = result.scalars().first()
     if user is None:
         raise credentials_exception
     
-    return user
\ No newline at end of file
+    snapshot = UserSnapshot.from_model(user)
+    user_cache.put(snapshot)
+    tag_request(snapshot.id)
+    return snapshot
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> UserSnapshot:
+    """Get the current authenticated user"""
+    return await authenticate_token(credentials.credentials, db)
@@ -0,0 +1,109 @@
+"""Time the analytics aggregates over a tenant's last 90 days, cold and cached
+
+Seeds one user with --rows detections spread over --days days across a
+few cameras and faces, then runs each /analytics query once against the
+database and once from analytics_cache. Run from the backend directory:
+
+    python -m benchmarks.analytics --rows 1000000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_analytics.db"))
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=90)
+    return parser.parse_args()
+
+
+async def seed(db, rows, days):
+    from sqlalchemy import func, insert, select
+    from models import Package, User, Camera, RegisteredFace, DetectionLog
+
+    email = "bench-analytics@example.com"
+    user = await db.scalar(select(User).where(User.email == email))
+    if user is not None:
+        existing = await db.scalar(select(func.count(DetectionLog.id)).where(DetectionLog.user_id == user.id))
+        if existing == rows:
+            return user.id
+        await db.delete(user)
+        await db.commit()
+
+    package = await db.scalar(select(Package).where(Package.name == "Bench Analytics")) or Package(
+        name="Bench Analytics", price=0, camera_limit=-1, max_registered_faces=-1
+    )
+    user = User(email=email, full_name="Bench", password_hash="x", package=package)
+    cameras = [Camera(user=user, camera_name=f"Camera {i}", camera_type="webcam") for i in range(8)]
+    faces = [RegisteredFace(user=user, face_name=f"Person {i}") for i in range(200)]
+    db.add_all([user, *cameras, *faces])
+    await db.commit()
+
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / rows
+    for offset in range(0, rows, 10000):
+        await db.execute(insert(DetectionLog), [
+            {
+                "user_id": user.id,
+                "camera_id": cameras[i % len(cameras)].id,
+                "registered_face_id": faces[(i * 7) % len(faces)].id if i % 4 else None,
+                "detection_confidence": (i % 1000) / 1000,
+                "detected_at": start + step * i,
+                "hit_count": 1 + i % 3,
+            }
+            for i in range(offset, min(offset + 10000, rows))
+        ])
+    await db.commit()
+    return user.id
+
+
+async def run(args):
+    from functools import partial
+    from database import Base, engine, SessionLocal
+    import analytics
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user_id = await seed(db, args.rows, args.days)
+
+    end = datetime.utcnow()
+    start = end - timedelta(days=args.days)
+    queries = {
+        "detections/hour": partial(analytics.detections_over_time, interval="hour"),
+        "detections/day": partial(analytics.detections_over_time, interval="day"),
+        "cameras": analytics.detections_by_camera,
+        "faces": partial(analytics.detections_by_face, limit=100),
+        "top-visitors": partial(analytics.detections_by_face, limit=10, known_only=True, by_visit_days=True),
+        "confidence": analytics.confidence_histogram,
+    }
+
+    print(f"{'query':<18}{'cold ms':>10}{'cached ms':>12}")
+    for name, compute in queries.items():
+        async def query():
+            async with SessionLocal() as db:
+                return await compute(db, user_id, start, end)
+
+        timings = []
+        for _ in range(2):
+            started = time.perf_counter()
+            await analytics.analytics_cache.get_or_compute((user_id, name, start, end), end, query)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{name:<18}{timings[0]:>10.1f}{timings[1]:>12.3f}")
+    await engine.dispose()
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Run the camera health monitor against local TCP stand-in cameras
+
+Starts listeners on localhost for the "live" cameras and reserves closed
+ports for the "dead" ones, registers cameras spread over them and lets the
+monitor probe for a while. Run from the backend directory:
+
+    python -m benchmarks.camera_probes --cameras 20000 --seconds 20
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_cameras.db"))
+    parser.add_argument("--cameras", type=int, default=5000)
+    parser.add_argument("--live-ports", type=int, default=100)
+    parser.add_argument("--dead-ports", type=int, default=100)
+    parser.add_argument("--dead-ratio", type=float, default=0.2, help="share of cameras on closed ports")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    return parser.parse_args()
+
+
+def closed_ports(count):
+    """Ports that were free a moment ago, so connecting is refused"""
+    ports = []
+    for _ in range(count):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            ports.append(sock.getsockname()[1])
+    return ports
+
+
+async def seed(db, cameras, live, dead, dead_ratio):
+    from sqlalchemy import delete, insert, select
+    from models import Package, User, Camera
+
+    user = await db.scalar(select(User).where(User.email == "bench-cameras@example.com"))
+    if user is None:
+        package = Package(name="Bench Cameras", price=0, camera_limit=-1, max_registered_faces=-1)
+        user = User(email="bench-cameras@example.com", full_name="Bench", password_hash="x", package=package)
+        db.add_all([package, user])
+        await db.commit()
+    await db.execute(delete(Camera).where(Camera.user_id == user.id))
+
+    dead_every = max(1, round(1 / dead_ratio)) if dead_ratio > 0 else 0
+    rows = []
+    for i in range(cameras):
+        is_dead = dead_every and i % dead_every == 0
+        port = dead[i % len(dead)] if is_dead else live[i % len(live)]
+        rows.append({
+            "user_id": user.id,
+            "camera_name": f"Bench {i}",
+            "camera_type": "ip_camera",
+            "ip_address": "127.0.0.1",
+            "port": port,
+            "status": "inactive",
+        })
+    await db.execute(insert(Camera), rows)
+    await db.commit()
+    return user.id
+
+
+async def run(args):
+    from sqlalchemy import func, select
+    from database import Base, engine, SessionLocal
+    from models import Camera
+    from camera_health import CameraHealthMonitor
+
+    async def accept(reader, writer):
+        writer.close()
+
+    servers = [await asyncio.start_server(accept, "127.0.0.1", 0) for _ in range(args.live_ports)]
+    live = [server.sockets[0].getsockname()[1] for server in servers]
+    dead = closed_ports(args.dead_ports)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user_id = await seed(db, args.cameras, live, dead, args.dead_ratio)
+
+    # The stand-in cameras listen on loopback, which is blocked by default
+    monitor = CameraHealthMonitor(
+        interval=args.interval, timeout=1.0, concurrency=args.concurrency, max_backoff=args.interval * 8,
+        blocked_networks=[]
+    )
+    started = time.perf_counter()
+    await monitor.start()
+    await asyncio.sleep(args.seconds)
+    await monitor.stop()
+    elapsed = time.perf_counter() - started
+
+    async with SessionLocal() as db:
+        by_status = dict((await db.execute(
+            select(Camera.status, func.count(Camera.id)).where(
+                Camera.user_id == user_id
+            ).group_by(Camera.status)
+        )).all())
+
+    for server in servers:
+        server.close()
+    await engine.dispose()
+
+    stats = monitor.stats()
+    print(f"cameras:          {stats['cameras']}")
+    print(f"probes/sec:       {stats['probes_done'] / elapsed:.0f}")
+    print(f"probes failed:    {stats['probes_failed']}")
+    print(f"rows written:     {stats['rows_written']}")
+    print(f"camera status:    {by_status}")
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Compare requests/sec of sync and async database access under concurrency
+
+Serves the same detections-page query from two minimal apps: one using a
+synchronous engine in a threadpool ``def`` handler (the previous setup) and
+one using the async engine from database.py. Run from the backend directory:
+
+    python -m benchmarks.db_throughput --clients 64
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file. SQLite has a
+single writer and a thread-backed async driver, so run against PostgreSQL
+for representative numbers.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_detections.db"))
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    return parser.parse_args()
+
+
+def build_sync_app(database_url, user_id):
+    from fastapi import FastAPI
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from pagination import detection_page_query, row_to_detection
+
+    sync_engine = create_engine(database_url)
+    SyncSession = sessionmaker(bind=sync_engine)
+    app = FastAPI()
+
+    @app.get("/detections")
+    def detections():
+        with SyncSession() as db:
+            rows = db.execute(detection_page_query(user_id, 50)).all()
+        return [row_to_detection(row) for row in rows]
+
+    return app, sync_engine
+
+
+def build_async_app(user_id):
+    from fastapi import FastAPI, Depends
+    from database import get_db
+    from pagination import get_detection_page
+
+    app = FastAPI()
+
+    @app.get("/detections")
+    async def detections(db=Depends(get_db)):
+        page, _ = await get_detection_page(db, user_id, 50)
+        return page
+
+    return app
+
+
+async def drive(app, clients, total):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/detections")
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                response = await client.get("/detections")
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        return total / (time.perf_counter() - started)
+
+
+async def run(args):
+    from database import Base, engine, SessionLocal
+    from benchmarks.detections_pagination import seed
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user_id = await seed(db, args.rows)
+
+    sync_app, sync_engine = build_sync_app(args.database_url, user_id)
+    sync_rps = await drive(sync_app, args.clients, args.requests)
+    sync_engine.dispose()
+
+    async_rps = await drive(build_async_app(user_id), args.clients, args.requests)
+    await engine.dispose()
+
+    print(f"clients:       {args.clients}")
+    print(f"sync req/s:    {sync_rps:.1f}")
+    print(f"async req/s:   {async_rps:.1f}")
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Compare OFFSET and keyset pagination latency of GET /detections by depth
+
+Run from the backend directory:
+
+    python -m benchmarks.detections_pagination --rows 500000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_detections.db"))
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depths", default="0,1000,10000,100000,190000")
+    parser.add_argument("--repeat", type=int, default=20)
+    return parser.parse_args()
+
+
+async def seed(db, rows):
+    from sqlalchemy import insert, select, func
+    from models import Package, User, Camera, RegisteredFace, DetectionLog
+
+    user = await db.scalar(select(User).where(User.email == "bench-pagination@example.com"))
+    if user and await db.scalar(
+        select(func.count(DetectionLog.id)).where(DetectionLog.user_id == user.id)
+    ) >= rows:
+        return user.id
+
+    package = Package(name="Bench Pagination", price=0, camera_limit=-1, max_registered_faces=-1)
+    user = User(email="bench-pagination@example.com", full_name="Bench", password_hash="x", package=package)
+    camera = Camera(user=user, camera_name="Bench Camera", camera_type="webcam")
+    face = RegisteredFace(user=user, face_name="Bench Face")
+    db.add_all([package, user, camera, face])
+    await db.commit()
+
+    start = datetime.utcnow() - timedelta(seconds=rows)
+    chunk = 10_000
+    for base in range(0, rows, chunk):
+        await db.execute(insert(DetectionLog), [
+            {
+                "user_id": user.id,
+                "camera_id": camera.id,
+                "registered_face_id": face.id if i % 3 else None,
+                "detection_confidence": 0.95,
+                "detection_image_path": None,
+                "detected_at": start + timedelta(seconds=i),
+                "created_at": start + timedelta(seconds=i),
+            }
+            for i in range(base, min(base + chunk, rows))
+        ])
+        await db.commit()
+    return user.id
+
+
+async def offset_page(db, user_id, limit, offset):
+    """The previous implementation: ORM entities, joinedloads and OFFSET"""
+    from sqlalchemy import select
+    from sqlalchemy.orm import joinedload
+    from models import DetectionLog
+
+    result = await db.execute(
+        select(DetectionLog).options(
+            joinedload(DetectionLog.camera),
+            joinedload(DetectionLog.registered_face)
+        ).where(
+            DetectionLog.user_id == user_id
+        ).order_by(DetectionLog.detected_at.desc()).offset(offset).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def run(args):
+    from database import Base, engine, SessionLocal
+    from pagination import get_detection_page, encode_cursor, detection_page_query
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    db = SessionLocal()
+    user_id = await seed(db, args.rows)
+
+    print(f"{'depth':>10} {'offset ms':>12} {'keyset ms':>12}")
+    for depth in (int(d) for d in args.depths.split(",")):
+        if depth >= args.rows:
+            continue
+        # Locate the cursor for this depth outside the timed section
+        cursor = None
+        if depth:
+            anchor = (await db.execute(detection_page_query(user_id, 1, offset=depth - 1))).first()
+            cursor = encode_cursor(anchor.detected_at, anchor.id)
+
+        offset_ms = await timed(lambda: offset_page(db, user_id, args.page_size, depth), args.repeat)
+        db.expunge_all()
+        keyset_ms = await timed(lambda: get_detection_page(db, user_id, args.page_size, cursor), args.repeat)
+        print(f"{depth:>10} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+    await db.close()
+    await engine.dispose()
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compare stored face encoding dtypes: size, index load time and match agreement
+
+Builds --faces random unit embeddings and, for each dtype, reports the
+bytes stored per face, the time FaceIndex.from_rows takes to load them and
+how often the best match of --probes noisy probes agrees with float32.
+Nothing is written to the database. Run from the backend directory:
+
+    python -m benchmarks.embedding_format --faces 100000
+"""
+import argparse
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--faces", type=int, default=50000)
+    parser.add_argument("--probes", type=int, default=1000)
+    parser.add_argument("--noise", type=float, default=0.03)
+    return parser.parse_args()
+
+
+def run(args):
+    import numpy as np
+    from embedding_format import DTYPES
+    from embedding_models import EMBEDDING_DIM, encode_embedding
+    from face_index import FaceIndex
+
+    rng = np.random.default_rng(7)
+    embeddings = rng.normal(size=(args.faces, EMBEDDING_DIM)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    targets = rng.integers(0, args.faces, args.probes)
+    probes = embeddings[targets] + rng.normal(scale=args.noise, size=(args.probes, EMBEDDING_DIM))
+
+    legacy = [(face_id, embedding.tobytes()) for face_id, embedding in enumerate(embeddings)]
+    variants = {"legacy": legacy}
+    for dtype in DTYPES:
+        variants[dtype] = [
+            (face_id, encode_embedding(embedding, dtype=dtype))
+            for face_id, embedding in enumerate(embeddings)
+        ]
+
+    reference = None
+    print(f"{'dtype':<10}{'bytes/face':>12}{'load ms':>10}{'agree %':>10}{'max |err|':>12}")
+    for name, rows in variants.items():
+        started = time.perf_counter()
+        index = FaceIndex.from_rows(rows)
+        load_ms = (time.perf_counter() - started) * 1000
+        best = [match.face_id if match else None for match in index.match(probes, tolerance=2.0)]
+        if reference is None:
+            reference = best
+        agree = 100 * sum(a == b for a, b in zip(best, reference)) / len(best)
+        error = float(np.abs(index._vectors[:len(index)] - embeddings).max())
+        print(f"{name:<10}{len(rows[0][1]):>12}{load_ms:>10.1f}{agree:>10.2f}{error:>12.5f}")
+
+
+def main():
+    args = parse_args()
+    # face_index imports the models, which need a DATABASE_URL to load
+    os.environ.setdefault("DATABASE_URL", "sqlite:///bench_embedding_format.db")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Stream a large detection export and report throughput and peak memory
+
+Seeds one user with --rows detections spread over a year, then runs the
+export the /detections/export endpoint serves, discarding the output.
+Peak traced memory should stay flat as --rows grows. Run from the
+backend directory:
+
+    python -m benchmarks.export --rows 1000000 --format parquet
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_export.db"))
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv")
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    return parser.parse_args()
+
+
+async def seed(db, rows):
+    from sqlalchemy import func, insert, select
+    from models import Package, User, Camera, RegisteredFace, DetectionLog
+
+    email = "bench-export@example.com"
+    user = await db.scalar(select(User).where(User.email == email))
+    if user is not None:
+        existing = await db.scalar(select(func.count(DetectionLog.id)).where(DetectionLog.user_id == user.id))
+        if existing == rows:
+            return user.id
+        await db.delete(user)
+        await db.commit()
+
+    package = await db.scalar(select(Package).where(Package.name == "Bench Export")) or Package(
+        name="Bench Export", price=0, camera_limit=-1, max_registered_faces=-1
+    )
+    user = User(email=email, full_name="Bench", password_hash="x", package=package)
+    cameras = [Camera(user=user, camera_name=f"Camera {i}", camera_type="webcam") for i in range(4)]
+    faces = [RegisteredFace(user=user, face_name=f"Person {i}") for i in range(50)]
+    db.add_all([user, *cameras, *faces])
+    await db.commit()
+
+    start = datetime.utcnow() - timedelta(days=365)
+    step = timedelta(days=365) / rows
+    for offset in range(0, rows, 10000):
+        await db.execute(insert(DetectionLog), [
+            {
+                "user_id": user.id,
+                "camera_id": cameras[i % len(cameras)].id,
+                "registered_face_id": faces[i % len(faces)].id if i % 3 else None,
+                "detection_confidence": 0.9,
+                "detected_at": start + step * i,
+                "hit_count": 1,
+            }
+            for i in range(offset, min(offset + 10000, rows))
+        ])
+    await db.commit()
+    return user.id
+
+
+async def run(args):
+    from database import Base, engine, SessionLocal
+    from export import export_detections
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user_id = await seed(db, args.rows)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = 0
+    async for chunk in export_detections(user_id, args.format, chunk_rows=args.chunk_rows):
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await engine.dispose()
+
+    print(f"rows exported:    {args.rows}")
+    print(f"output size:      {size / 2**20:.1f} MiB ({args.format})")
+    print(f"rows/sec:         {args.rows / elapsed:.0f}")
+    print(f"peak memory:      {peak / 2**20:.1f} MiB")
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,670 @@
+"""Load-test every API route with concurrent clients over synthetic tenants
+
+Generates (or reuses) the data set from benchmarks.tenants, then runs
+--clients virtual users for --duration seconds after a --warmup. Each
+client reads as one generated tenant and writes as a scratch Premium
+tenant of its own. Reads are dashboards, lists, analytics, exports,
+uploads and the event stream. Writes are camera and face lifecycles,
+detection batches, visitor promotion, logins, logouts and signups.
+--write-share sets the fraction of iterations that write. Scratch tenants
+are removed afterwards, so the generated data stays the same from run to
+run.
+
+Reports per route: requests, errors, p50/p95/p99 latency and the SQL
+statements per request, taken from the app's /metrics. Totals include
+throughput. Routes the run did not reach are listed. Run from the backend
+directory:
+
+    python -m benchmarks.load --clients 16 --duration 30
+    python -m benchmarks.load --save-baseline sqlite
+    python -m benchmarks.load --compare sqlite
+
+--compare exits with status 1 when the run regressed against a stored
+baseline in benchmarks/baselines:
+- more SQL statements per request;
+- a higher p95 latency (on routes with enough requests to tell), or lower
+  throughput, beyond --latency-tolerance;
+- errors where the baseline had none.
+Statement counts are stable across machines. Latency baselines are only
+comparable on the same hardware, database and settings.
+
+By default the app runs in-process over ASGI, so nothing listens on the
+network. --url drives a running server instead; DATABASE_URL must then
+point at that server's database. Background workers that need cameras or
+face models (encoding, camera health, recognition, retention) are off in
+the in-process app unless set in the environment. Uses DATABASE_URL when
+set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+import httpx
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.tenants import EMAIL_DOMAIN, TENANT_PASSWORD, add_arguments, png_image
+
+BASELINES_DIR = Path(__file__).with_name("baselines")
+SCRATCH_EMAIL = "load-{run}-{number}@" + EMAIL_DOMAIN
+RUN_ID = f"{os.getpid()}{int(time.time()) % 100000}"
+# Statements per request above the baseline that count as a regression
+QUERY_TOLERANCE = 0.5
+# p95 increases smaller than this are noise, whatever the ratio
+LATENCY_FLOOR_MS = 5.0
+# Routes with fewer requests in either run have too noisy a p95 to compare
+MIN_LATENCY_SAMPLES = 50
+
+_QUERY_SAMPLE = re.compile(
+    r'^app_http_request_db_queries_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)$'
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_load.db"))
+    parser.add_argument("--url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before the run")
+    parser.add_argument("--write-share", type=float, default=0.2, help="fraction of iterations that write")
+    parser.add_argument("--save-baseline", metavar="NAME", help="store the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare with benchmarks/baselines/NAME.json")
+    parser.add_argument("--latency-tolerance", type=float, default=1.5, help="allowed p95 and throughput ratio")
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def json_body(response) -> dict:
+    """The decoded JSON body, or {} for errors that are not JSON"""
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
+class Recorder:
+    """Client-side latency and errors per "METHOD /route/template" """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+        self.exercised = set()
+        self.measuring = False
+
+    def add(self, route: str, started: float, ok: bool, detail: str = ""):
+        elapsed = (time.perf_counter() - started) * 1000
+        self.exercised.add(route)
+        if not self.measuring:
+            return
+        self.latencies.setdefault(route, []).append(elapsed)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f"{route}: {detail}")
+
+
+@dataclass
+class Actor:
+    """One virtual user: a generated tenant to read as, a scratch tenant to write as"""
+    number: int
+    token: str
+    upload_key: Optional[str]
+    scratch_email: str
+    scratch_token: str
+    scratch_user_id: int
+    scratch_camera_id: int
+
+
+class LoadClient:
+    def __init__(self, http, recorder: Recorder, app=None):
+        self.http = http
+        self.recorder = recorder
+        # In-process app, for the event stream
+        self.app = app
+
+    async def call(self, method: str, route: str, url: Optional[str] = None, token: Optional[str] = None,
+                   expect: int = 200, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url or route, headers=headers, **kwargs)
+        except httpx.HTTPError as exc:
+            self.recorder.add(f"{method} {route}", started, False, repr(exc))
+            return httpx.Response(599, json={})
+        ok = response.status_code == expect
+        self.recorder.add(f"{method} {route}", started, ok, "" if ok else f"{response.status_code} {response.text[:200]}")
+        return response
+
+    async def first_event(self, route: str, url: str):
+        """Open an event stream, wait for its first message and disconnect"""
+        started = time.perf_counter()
+        try:
+            if self.app is None:
+                async with self.http.stream("GET", url) as response:
+                    async for _ in response.aiter_raw():
+                        break
+                    status_code = response.status_code
+            else:
+                status_code = await asgi_first_chunk(self.app, url)
+        except Exception as exc:
+            self.recorder.add(f"GET {route}", started, False, repr(exc))
+            return
+        ok = status_code == 200
+        self.recorder.add(f"GET {route}", started, ok, "" if ok else str(status_code))
+
+
+async def asgi_first_chunk(app, url: str) -> int:
+    """GET an endless ASGI response until its first body chunk
+
+    httpx's ASGITransport waits for the whole response, which an event
+    stream never finishes, so the stream is driven here directly.
+    """
+    path, _, query = url.partition("?")
+    received = asyncio.Event()
+    status_code = 0
+
+    async def receive():
+        await received.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            received.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    task = asyncio.create_task(app(scope, receive, send))
+    await received.wait()
+    await asyncio.wait_for(task, 10)
+    return status_code
+
+
+# Read scenarios, as one of the generated tenants
+
+async def read_me(client, actor, rng):
+    await client.call("GET", "/auth/me", token=actor.token)
+
+
+async def read_packages(client, actor, rng):
+    await client.call("GET", "/packages")
+
+
+async def read_cameras(client, actor, rng):
+    await client.call("GET", "/cameras", token=actor.token)
+
+
+async def read_faces(client, actor, rng):
+    await client.call("GET", "/faces", token=actor.token)
+
+
+async def read_encoding_status(client, actor, rng):
+    await client.call("GET", "/faces/encoding-status", token=actor.token)
+
+
+async def read_detections(client, actor, rng):
+    response = await client.call("GET", "/detections", url="/detections?limit=50", token=actor.token)
+    cursor = response.headers.get("x-next-cursor")
+    if cursor and rng.random() < 0.5:
+        await client.call(
+            "GET", "/detections", url="/detections?" + urlencode({"limit": 50, "cursor": cursor}), token=actor.token
+        )
+
+
+async def read_export(client, actor, rng):
+    start = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    await client.call(
+        "GET", "/detections/export", url="/detections/export?" + urlencode({"format": "csv", "start": start}),
+        token=actor.token
+    )
+
+
+async def read_dashboard(client, actor, rng):
+    await client.call("GET", "/dashboard/stats", token=actor.token)
+
+
+async def read_analytics(client, actor, rng):
+    route, query = rng.choice((
+        ("/analytics/detections", "?interval=day"),
+        ("/analytics/cameras", ""),
+        ("/analytics/faces", ""),
+        ("/analytics/top-visitors", ""),
+        ("/analytics/confidence", ""),
+    ))
+    await client.call("GET", route, url=route + query, token=actor.token)
+
+
+async def read_unknown_visitors(client, actor, rng):
+    await client.call("GET", "/visitors/unknown", token=actor.token)
+
+
+async def read_recognition_stats(client, actor, rng):
+    await client.call("GET", "/recognition/stats", token=actor.token)
+
+
+async def read_upload(client, actor, rng):
+    if actor.upload_key is None:
+        return
+    url = f"/uploads/{actor.upload_key}"
+    await client.call("GET", "/uploads/{key:path}", url=url)
+    await client.call("HEAD", "/uploads/{key:path}", url=url)
+
+
+async def read_event_stream(client, actor, rng):
+    ticket = json_body(await client.call("POST", "/events/ticket", token=actor.token)).get("ticket")
+    if ticket:
+        await client.first_event("/events/stream", "/events/stream?" + urlencode({"ticket": ticket}))
+
+
+async def read_metrics(client, actor, rng):
+    await client.call("GET", "/metrics", headers=metrics_headers())
+
+
+# Write scenarios, as the client's scratch tenant
+
+async def write_camera(client, actor, rng):
+    token = actor.scratch_token
+    camera = json_body(await client.call("POST", "/cameras", token=token, json={
+        "camera_name": "Load camera", "camera_brand": "Generic", "camera_type": "ip_camera",
+        # Nothing listens on the discard port, so the probe fails fast
+        "ip_address": "127.0.0.1", "port": 9, "username": "admin",
+    }))
+    if "id" not in camera:
+        return
+    url = f"/cameras/{camera['id']}"
+    await client.call("PUT", "/cameras/{camera_id}", url=url, token=token, json={"camera_name": "Load camera 2"})
+    await client.call("POST", "/cameras/{camera_id}/test", url=url + "/test", token=token)
+    await client.call("DELETE", "/cameras/{camera_id}", url=url, token=token)
+
+
+async def write_face(client, actor, rng):
+    token = actor.scratch_token
+    face = json_body(await client.call(
+        "POST", "/faces", token=token, data={"face_name": "Load face"},
+        files={"file": ("face.png", png_image(rng.randrange(64)), "image/png")}
+    ))
+    if "id" in face:
+        await client.call("DELETE", "/faces/{face_id}", url=f"/faces/{face['id']}", token=token)
+
+
+async def write_faces_bulk(client, actor, rng):
+    token = actor.scratch_token
+    files = [("files", (f"Load person {n}.png", png_image(rng.randrange(64)), "image/png")) for n in range(3)]
+    result = json_body(await client.call("POST", "/faces/bulk", token=token, files=files))
+    for item in result.get("results", []):
+        if item.get("face"):
+            await client.call("DELETE", "/faces/{face_id}", url=f"/faces/{item['face']['id']}", token=token)
+
+
+async def write_detections(client, actor, rng):
+    now = datetime.utcnow()
+    await client.call("POST", "/detections/batch", token=actor.scratch_token, json={"detections": [
+        {
+            "camera_id": actor.scratch_camera_id,
+            "detection_confidence": round(0.5 + rng.random() * 0.4999, 4),
+            "detected_at": (now - timedelta(seconds=rng.randrange(600))).isoformat(),
+        }
+        for _ in range(20)
+    ]})
+
+
+async def write_promote_visitor(client, actor, rng):
+    # Clusters are only created by the recognition pipeline, so one is
+    # written directly, as the pipeline would leave it
+    try:
+        cluster_id = await seed_visitor(actor, rng)
+    except OperationalError:
+        # SQLite's single writer is busy; try again next iteration
+        return
+    face = json_body(await client.call(
+        "POST", "/visitors/{cluster_id}/promote", url=f"/visitors/{cluster_id}/promote",
+        token=actor.scratch_token, data={"face_name": "Load visitor"}
+    ))
+    if "id" in face:
+        await client.call("DELETE", "/faces/{face_id}", url=f"/faces/{face['id']}", token=actor.scratch_token)
+
+
+async def write_session(client, actor, rng):
+    credentials = {"email": actor.scratch_email, "password": TENANT_PASSWORD}
+    token = json_body(await client.call("POST", "/auth/login", json=credentials)).get("access_token")
+    if token:
+        await client.call("POST", "/auth/logout", token=token)
+
+
+async def write_signup(client, actor, rng):
+    email = SCRATCH_EMAIL.format(run=RUN_ID, number=f"{actor.number}-{rng.getrandbits(32):08x}")
+    await client.call("POST", "/auth/register", json=registration(email))
+    token = json_body(await client.call(
+        "POST", "/auth/login", json={"email": email, "password": TENANT_PASSWORD}
+    )).get("access_token")
+    if token:
+        await client.call("POST", "/auth/logout-all", token=token)
+
+
+# (weight, scenario); weights are relative within each list
+READ_SCENARIOS = (
+    (5, read_me), (3, read_packages), (8, read_cameras), (8, read_faces), (2, read_encoding_status),
+    (15, read_detections), (1, read_export), (8, read_dashboard), (10, read_analytics),
+    (2, read_unknown_visitors), (1, read_recognition_stats), (4, read_upload), (2, read_event_stream),
+    (1, read_metrics),
+)
+WRITE_SCENARIOS = (
+    (2, write_camera), (2, write_face), (1, write_faces_bulk), (8, write_detections),
+    (0.5, write_promote_visitor), (1, write_session), (0.5, write_signup),
+)
+
+
+def metrics_headers() -> dict:
+    token = os.getenv("METRICS_TOKEN", "")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def registration(email: str) -> dict:
+    return {
+        "email": email, "full_name": "Load Test", "phone_number": None, "password": TENANT_PASSWORD,
+        "confirm_password": TENANT_PASSWORD, "selected_package": "Premium",
+    }
+
+
+async def seed_visitor(actor: Actor, rng: random.Random) -> int:
+    """A visitor cluster with a few sightings on the scratch camera"""
+    from sqlalchemy import insert
+    from database import SessionLocal
+    from embedding_models import EMBEDDING_DIM, encode_embedding
+    from face_index import FACE_EMBEDDING_MODEL
+    from models import DetectionLog, VisitorCluster
+    from visitor_clusters import CENTROID_DTYPE
+
+    now = datetime.utcnow()
+    centroid = [rng.gauss(0.0, 0.09) for _ in range(EMBEDDING_DIM)]
+    async with SessionLocal() as db:
+        cluster_id = (await db.execute(insert(VisitorCluster).returning(VisitorCluster.id), {
+            "user_id": actor.scratch_user_id,
+            "centroid": encode_embedding(centroid, model=FACE_EMBEDDING_MODEL, dtype=CENTROID_DTYPE),
+            "sighting_count": 3, "first_seen_at": now - timedelta(days=2), "last_seen_at": now,
+        })).scalar_one()
+        await db.execute(insert(DetectionLog), [
+            {
+                "user_id": actor.scratch_user_id, "camera_id": actor.scratch_camera_id,
+                "visitor_cluster_id": cluster_id, "detected_at": now - timedelta(days=days), "hit_count": 1,
+            }
+            for days in range(3)
+        ])
+        await db.commit()
+    return cluster_id
+
+
+async def login(http, email: str) -> str:
+    response = await http.post("/auth/login", json={"email": email, "password": TENANT_PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def setup_actor(http, number: int, tenant, tokens: Dict[str, str]) -> Actor:
+    """Log in as the tenant (once per tenant) and create the scratch tenant"""
+    if tenant.email not in tokens:
+        tokens[tenant.email] = await login(http, tenant.email)
+    token = tokens[tenant.email]
+    faces = (await http.get("/faces", headers={"Authorization": f"Bearer {token}"})).json()
+    path = next((face["face_image_path"] for face in faces if face.get("face_image_path")), None)
+    upload_key = path[len("uploads/"):] if path and path.startswith("uploads/") else None
+
+    email = SCRATCH_EMAIL.format(run=RUN_ID, number=number)
+    (await http.post("/auth/register", json=registration(email))).raise_for_status()
+    scratch_token = await login(http, email)
+    scratch_headers = {"Authorization": f"Bearer {scratch_token}"}
+    scratch_user = (await http.get("/auth/me", headers=scratch_headers)).json()
+    camera = await http.post("/cameras", headers=scratch_headers, json={
+        "camera_name": "Load webcam", "camera_brand": "Generic", "camera_type": "webcam",
+    })
+    camera.raise_for_status()
+    return Actor(number, token, upload_key, email, scratch_token, scratch_user["id"], camera.json()["id"])
+
+
+async def drive(client: LoadClient, actor: Actor, rng: random.Random, stop: asyncio.Event, write_share: float):
+    reads = [scenario for _, scenario in READ_SCENARIOS]
+    read_weights = [weight for weight, _ in READ_SCENARIOS]
+    writes = [scenario for _, scenario in WRITE_SCENARIOS]
+    write_weights = [weight for weight, _ in WRITE_SCENARIOS]
+    while not stop.is_set():
+        if rng.random() < write_share:
+            scenario = rng.choices(writes, write_weights)[0]
+        else:
+            scenario = rng.choices(reads, read_weights)[0]
+        await scenario(client, actor, rng)
+
+
+async def query_totals(http) -> Dict[str, List[float]]:
+    """route -> [statements, requests] from the app's /metrics"""
+    response = await http.get("/metrics", headers=metrics_headers())
+    totals: Dict[str, List[float]] = {}
+    if response.status_code != 200:
+        return totals
+    for line in response.text.splitlines():
+        match = _QUERY_SAMPLE.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            totals.setdefault(f"{method} {route}", [0.0, 0.0])[kind == "count"] += float(value)
+    return totals
+
+
+async def remove_scratch_tenants():
+    from sqlalchemy import delete
+    from database import SessionLocal
+    from models import User
+
+    async with SessionLocal() as db:
+        await db.execute(delete(User).where(User.email.like(f"load-%@{EMAIL_DOMAIN}")))
+        await db.commit()
+
+
+def app_routes(app) -> List[str]:
+    from fastapi.routing import APIRoute
+
+    return sorted(
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+    )
+
+
+def build_report(args, recorder: Recorder, before, after, elapsed: float, dialect: str) -> dict:
+    routes = {}
+    for route, samples in sorted(recorder.latencies.items()):
+        statements, requests = (
+            after.get(route, [0.0, 0.0])[i] - before.get(route, [0.0, 0.0])[i] for i in range(2)
+        )
+        routes[route] = {
+            "requests": len(samples),
+            "errors": recorder.errors.get(route, 0),
+            "p50_ms": round(percentile(samples, 50), 2),
+            "p95_ms": round(percentile(samples, 95), 2),
+            "p99_ms": round(percentile(samples, 99), 2),
+            "queries_per_request": round(statements / requests, 2) if requests else None,
+        }
+    every = [latency for samples in recorder.latencies.values() for latency in samples]
+    total = len(every)
+    return {
+        "created_at": datetime.utcnow().replace(microsecond=0).isoformat(),
+        "config": {
+            "mode": "http" if args.url else "asgi", "database": dialect, "clients": args.clients,
+            "duration": args.duration, "write_share": args.write_share, "tenants": args.tenants,
+            "mix": args.mix, "face_fill": args.face_fill, "unlimited_faces": args.unlimited_faces,
+            "detections": args.detections, "days": args.days, "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        },
+        "summary": {
+            "requests": total,
+            "errors": sum(recorder.errors.values()),
+            "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(every, 50), 2) if every else None,
+            "p95_ms": round(percentile(every, 95), 2) if every else None,
+            "p99_ms": round(percentile(every, 99), 2) if every else None,
+        },
+        "routes": routes,
+    }
+
+
+def print_report(report: dict):
+    print(f"\n{'route':<40}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}")
+    for route, stats in report["routes"].items():
+        queries = stats["queries_per_request"]
+        print(
+            f"{route:<40}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>9.1f}"
+            f"{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}{'-' if queries is None else f'{queries:.2f}':>9}"
+        )
+    summary = report["summary"]
+    if summary["requests"]:
+        print(
+            f"\n{summary['requests']} requests, {summary['errors']} errors, {summary['throughput_rps']} req/s, "
+            f"p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms"
+        )
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions of report against baseline, one line each"""
+    regressions = []
+    for key in sorted(set(report["config"]) | set(baseline["config"])):
+        if report["config"].get(key) != baseline["config"].get(key):
+            print(f"note: {key} is {report['config'].get(key)!r}, baseline used {baseline['config'].get(key)!r}")
+
+    for route, base in baseline["routes"].items():
+        current = report["routes"].get(route)
+        if current is None:
+            print(f"note: {route} was not exercised in this run")
+            continue
+        if base["queries_per_request"] is not None and current["queries_per_request"] is not None \
+                and current["queries_per_request"] > base["queries_per_request"] + QUERY_TOLERANCE:
+            regressions.append(
+                f"{route}: {current['queries_per_request']:.2f} statements per request, "
+                f"baseline {base['queries_per_request']:.2f}"
+            )
+        enough_samples = min(current["requests"], base["requests"]) >= MIN_LATENCY_SAMPLES
+        if enough_samples and current["p95_ms"] > base["p95_ms"] * tolerance \
+                and current["p95_ms"] - base["p95_ms"] > LATENCY_FLOOR_MS:
+            regressions.append(f"{route}: p95 {current['p95_ms']:.1f} ms, baseline {base['p95_ms']:.1f} ms")
+        if current["errors"] and not base["errors"]:
+            regressions.append(f"{route}: {current['errors']} errors, baseline had none")
+
+    throughput, base_throughput = report["summary"]["throughput_rps"], baseline["summary"]["throughput_rps"]
+    if throughput * tolerance < base_throughput:
+        regressions.append(f"throughput {throughput} req/s, baseline {base_throughput} req/s")
+    return regressions
+
+
+async def run(args) -> int:
+    from benchmarks.tenants import generate
+    from database import engine, IS_SQLITE
+    import main
+
+    tenants = await generate(args)
+    if not tenants:
+        raise SystemExit("--tenants must be at least 1")
+    await remove_scratch_tenants()
+
+    app = None if args.url else main.app
+    if app is not None:
+        await app.router.startup()
+    # App exceptions become 500 responses, as a server would send
+    transport = None if app is None else httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    recorder = Recorder()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=args.url or "http://bench", timeout=120) as http:
+            print(f"Setting up {args.clients} clients", flush=True)
+            tokens: Dict[str, str] = {}
+            actors = [
+                await setup_actor(http, number, tenants[number % len(tenants)], tokens)
+                for number in range(args.clients)
+            ]
+
+            stop = asyncio.Event()
+            drivers = [
+                asyncio.create_task(drive(
+                    LoadClient(http, recorder, app), actor, random.Random(args.seed * 1000 + actor.number),
+                    stop, args.write_share
+                ))
+                for actor in actors
+            ]
+            print(f"Warming up for {args.warmup:g}s, then measuring for {args.duration:g}s", flush=True)
+            await asyncio.sleep(args.warmup)
+            before = await query_totals(http)
+            recorder.measuring = True
+            started = time.perf_counter()
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.gather(*drivers)
+            elapsed = time.perf_counter() - started
+            after = await query_totals(http)
+    finally:
+        if app is not None:
+            await app.router.shutdown()
+        await remove_scratch_tenants()
+        await engine.dispose()
+
+    report = build_report(args, recorder, before, after, elapsed, "sqlite" if IS_SQLITE else "postgresql")
+    print_report(report)
+    for sample in recorder.error_samples:
+        print(f"error: {sample}")
+    missing = [route for route in app_routes(main.app) if route not in recorder.exercised]
+    if missing:
+        print("Not exercised: " + ", ".join(missing))
+
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        path = BASELINES_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline written to {path}")
+    if args.compare:
+        baseline = json.loads((BASELINES_DIR / f"{args.compare}.json").read_text())
+        regressions = compare(report, baseline, args.latency_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    if not args.url:
+        # Workers that need real cameras or face models stay off in-process
+        for name in ("FACE_ENCODING_ENABLED", "CAMERA_HEALTH_ENABLED", "RECOGNITION_ENABLED", "RETENTION_ENABLED"):
+            os.environ.setdefault(name, "false")
+        os.environ.setdefault("SLOW_REQUEST_SECONDS", "0")
+        # The scratch cameras point at loopback and are tested every iteration
+        os.environ.setdefault("CAMERA_BLOCKED_NETWORKS", "")
+        os.environ.setdefault("CAMERA_TEST_MIN_INTERVAL_SECONDS", "0")
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
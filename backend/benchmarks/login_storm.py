@@ -0,0 +1,98 @@
+"""Measure /auth/me latency while concurrent logins hash passwords
+
+Run from the backend directory, once with bcrypt offloaded and once inline:
+
+    python -m benchmarks.login_storm
+    PASSWORD_HASH_WORKERS=0 python -m benchmarks.login_storm
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_login.db"))
+    parser.add_argument("--logins", type=int, default=40, help="total login requests")
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    parser.add_argument("--me-interval", type=float, default=0.01, help="seconds between /auth/me probes")
+    return parser.parse_args()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(args):
+    import httpx
+    from sqlalchemy import select
+    from database import Base, engine, SessionLocal
+    from models import Package, User
+    from auth import get_password_hash, password_hash_pool
+    import main
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        if not await db.scalar(select(User).where(User.email == "bench-login@example.com")):
+            package = await db.scalar(select(Package).where(Package.name == "Standard")) or Package(
+                name="Standard", price=500, camera_limit=1, max_registered_faces=200
+            )
+            db.add(User(
+                email="bench-login@example.com", full_name="Bench", package=package,
+                password_hash=get_password_hash("bench-password")
+            ))
+            await db.commit()
+
+    credentials = {"email": "bench-login@example.com", "password": "bench-password"}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/auth/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.get("/auth/me", headers=headers)
+
+        done = asyncio.Event()
+        me_latencies = []
+
+        async def probe_me():
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/auth/me", headers=headers)
+                me_latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(args.me_interval)
+
+        remaining = iter(range(args.logins))
+
+        async def login_worker():
+            for _ in remaining:
+                await client.post("/auth/login", json=credentials)
+
+        prober = asyncio.create_task(probe_me())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(args.login_concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    print(f"hash workers:        {password_hash_pool.workers}")
+    print(f"logins/sec:          {args.logins / elapsed:.1f}")
+    print(f"/auth/me samples:    {len(me_latencies)}")
+    print(f"/auth/me p50 ms:     {statistics.median(me_latencies):.1f}")
+    print(f"/auth/me p99 ms:     {percentile(me_latencies, 99):.1f}")
+    print(f"/auth/me max ms:     {max(me_latencies):.1f}")
+    print(f"pool stats:          {password_hash_pool.stats()}")
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
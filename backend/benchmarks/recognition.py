@@ -0,0 +1,107 @@
+"""Drive the recognition pipeline with synthetic cameras and report stage counters
+
+Each camera replays a mix of registered faces and unknown visitors at a
+fixed frame rate through the stub detector and embedding model, so the
+numbers reflect pipeline overhead (queues, batching, matching, ingestion)
+rather than model cost. Run from the backend directory:
+
+    python -m benchmarks.recognition --cameras 50 --fps 15 --seconds 20
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_recognition.db"))
+    parser.add_argument("--cameras", type=int, default=20)
+    parser.add_argument("--faces", type=int, default=100)
+    parser.add_argument("--fps", type=float, default=10.0, help="frames/sec produced per camera")
+    parser.add_argument("--sample-fps", type=float, default=5.0, help="frames/sec processed per camera")
+    parser.add_argument("--known-ratio", type=float, default=0.7)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    return parser.parse_args()
+
+
+async def seed(db, cameras, face_images):
+    from sqlalchemy import select
+    from models import Package, User, Camera, RegisteredFace
+    from embedding_models import encode_embedding, get_model, WholeFrameDetector
+
+    email = "bench-recognition@example.com"
+    user = await db.scalar(select(User).where(User.email == email))
+    if user is not None:
+        await db.delete(user)
+        await db.commit()
+
+    package = await db.scalar(select(Package).where(Package.name == "Bench Recognition")) or Package(
+        name="Bench Recognition", price=0, camera_limit=-1, max_registered_faces=-1
+    )
+    user = User(email=email, full_name="Bench", password_hash="x", package=package)
+    camera_rows = [Camera(user=user, camera_name=f"Bench {i}", camera_type="webcam") for i in range(cameras)]
+
+    model, detector = get_model("stub"), WholeFrameDetector()
+    embeddings = model.embed_faces([(image, detector.detect(image)[0]) for image in face_images])
+    face_rows = [
+        RegisteredFace(
+            user=user, face_name=f"Person {i}", face_encoding=encode_embedding(embedding, model="stub"),
+            encoding_status="ready"
+        )
+        for i, embedding in enumerate(embeddings)
+    ]
+    db.add_all([user, *camera_rows, *face_rows])
+    await db.commit()
+    return user.id, [camera.id for camera in camera_rows]
+
+
+async def run(args):
+    import numpy as np
+    from sqlalchemy import func, select
+    from database import Base, engine, SessionLocal
+    from models import DetectionLog
+    from recognition_pipeline import RecognitionPipeline, SyntheticFrameSource
+
+    rng = np.random.default_rng(7)
+    face_images = [rng.integers(0, 256, (48, 48, 3), dtype=np.uint8) for _ in range(args.faces)]
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        user_id, camera_ids = await seed(db, args.cameras, face_images)
+
+    pipeline = RecognitionPipeline(detector_name="stub", model_name="stub", sample_fps=args.sample_fps)
+    for i, camera_id in enumerate(camera_ids):
+        pipeline.add_source(SyntheticFrameSource(
+            camera_id, user_id, face_images, fps=args.fps, known_ratio=args.known_ratio, seed=i
+        ))
+
+    started = time.perf_counter()
+    await pipeline.start()
+    await asyncio.sleep(args.seconds)
+    stats = pipeline.stats()
+    await pipeline.stop()
+    elapsed = time.perf_counter() - started
+
+    async with SessionLocal() as db:
+        written = await db.scalar(select(func.count(DetectionLog.id)).where(DetectionLog.user_id == user_id))
+    await engine.dispose()
+
+    print(json.dumps(stats, indent=2))
+    print(f"detections written:   {written}")
+    print(f"detections/sec:       {written / elapsed:.1f}")
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["FACE_EMBEDDING_MODEL"] = "stub"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
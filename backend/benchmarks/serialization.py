@@ -0,0 +1,167 @@
+"""Compare JSON encoding of list responses, and time the cached package catalog
+
+Part one builds --rows cameras, faces and detections in memory and puts
+each list through FastAPI's response pipeline: validation against the
+response model, conversion to JSON-compatible objects, then encoding with
+JSONResponse (standard library json) and with FastJSONResponse. The two
+encodings are checked to produce identical bytes.
+
+Part two serves GET /packages through the app three ways: with the catalog
+invalidated before every request (a query and serialization each time,
+as before the cache), from the cache, and as a 304 revalidation. Run from
+the backend directory:
+
+    python -m benchmarks.serialization --rows 500
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_serialization.db"))
+    parser.add_argument("--rows", type=int, default=500, help="rows per list response")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000, help="GET /packages requests per mode")
+    return parser.parse_args()
+
+
+def sample_lists(rows):
+    from models import Camera, RegisteredFace
+    from pagination import row_to_detection
+
+    now = datetime.utcnow()
+    cameras = [
+        Camera(
+            id=i, camera_name=f"Entrance camera {i}", camera_brand="Hikvision", camera_type="ip_camera",
+            ip_address=f"10.0.{i // 250}.{i % 250 + 1}", port=554, username="admin", status="active",
+            last_seen=now, created_at=now - timedelta(days=i), updated_at=now
+        )
+        for i in range(rows)
+    ]
+    faces = [
+        RegisteredFace(
+            id=i, face_name=f"Person {i}", face_image_path=f"uploads/faces/{i:064x}.jpg",
+            encoding_status="ready", is_active=True, created_at=now - timedelta(hours=i), updated_at=now
+        )
+        for i in range(rows)
+    ]
+    detections = [
+        row_to_detection((
+            i, i % 8, i % 40 if i % 3 else None, Decimal(f"0.{9000 + i % 999:04d}"),
+            f"uploads/detections/{i:064x}.jpg", now - timedelta(seconds=i), now - timedelta(seconds=i - 5),
+            1 + i % 4, now - timedelta(seconds=i), f"Camera {i % 8}", "Hikvision", "ip_camera",
+            f"Person {i % 40}" if i % 3 else None, f"uploads/faces/{i % 40:064x}.jpg"
+        ))
+        for i in range(rows)
+    ]
+    return cameras, faces, detections
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def encoding(args):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from responses import FastJSONResponse
+    from schemas import CameraResponse, FaceResponse, DetectionLogResponse
+
+    if FastJSONResponse is JSONResponse:
+        print("orjson is not installed or FAST_JSON_ENABLED=false; FastJSONResponse is JSONResponse\n")
+
+    cameras, faces, detections = sample_lists(args.rows)
+    cases = {
+        "/cameras": (CameraResponse, cameras),
+        "/faces": (FaceResponse, faces),
+        "/detections": (DetectionLogResponse, detections),
+    }
+    print(f"{args.rows} rows per response, median of {args.repeat}")
+    print(f"{'endpoint':<13}{'model ms':>10}{'json ms':>10}{'fast ms':>10}{'total saved':>14}")
+    for endpoint, (schema, rows) in cases.items():
+        field = create_response_field(name=f"Response_{schema.__name__}", type_=List[schema])
+        content = await serialize_response(field=field, response_content=rows)
+        if JSONResponse(content).body != FastJSONResponse(content).body:
+            raise AssertionError(f"{endpoint}: encodings differ")
+
+        model_ms = median_ms(lambda: field.serialize(field.validate(rows, {}, loc=("response",))[0]), args.repeat)
+        json_ms = median_ms(lambda: JSONResponse(content), args.repeat)
+        fast_ms = median_ms(lambda: FastJSONResponse(content), args.repeat)
+        saved = (json_ms - fast_ms) / (model_ms + json_ms) * 100
+        print(f"{endpoint:<13}{model_ms:>10.2f}{json_ms:>10.2f}{fast_ms:>10.2f}{saved:>13.0f}%")
+
+
+async def catalog(args):
+    import httpx
+    from sqlalchemy import select
+    from database import Base, engine, SessionLocal
+    from models import Package
+    from catalog import package_catalog
+    import main
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        if not (await db.scalars(select(Package))).first():
+            db.add_all([
+                Package(
+                    name=name, price=price, description=f"{name} plan", camera_limit=limit,
+                    max_registered_faces=limit * 25, data_retention_days=30 * limit,
+                    features=[f"Up to {limit} cameras", "Real-time alerts", "Detection history", "Email support"]
+                )
+                for name, price, limit in (("Basic", "9.99", 1), ("Standard", "29.99", 4), ("Premium", "79.99", 16))
+            ])
+            await db.commit()
+
+    async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+        etag = (await client.get("/packages")).headers["etag"]
+
+        async def timed(headers=None, invalidate=False):
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                if invalidate:
+                    package_catalog.invalidate()
+                response = await client.get("/packages", headers=headers)
+            elapsed = time.perf_counter() - started
+            return response.status_code, elapsed / args.requests * 1e6, args.requests / elapsed
+
+        print(f"\nGET /packages, {args.requests} requests each")
+        print(f"{'mode':<22}{'status':>8}{'us/request':>12}{'requests/s':>12}")
+        for mode, kwargs in (
+            ("query every request", {"invalidate": True}),
+            ("cached", {}),
+            ("If-None-Match", {"headers": {"If-None-Match": etag}}),
+        ):
+            code, micros, rate = await timed(**kwargs)
+            print(f"{mode:<22}{code:>8}{micros:>12.0f}{rate:>12.0f}")
+    await engine.dispose()
+
+
+async def run(args):
+    await encoding(args)
+    await catalog(args)
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
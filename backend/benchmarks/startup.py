@@ -0,0 +1,115 @@
+"""Measure API cold start: import time and time to first request
+
+Applies migrations once, then repeatedly launches --workers uvicorn
+processes side by side, each on its own port. For every process it
+records how long it takes from spawn until --path answers. Run from the
+backend directory:
+
+    python -m benchmarks.startup --workers 8 --runs 5
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file. Other
+settings (FACE_ENCODING_ENABLED, RECOGNITION_ENABLED, ...) come from the
+environment, as they would for a real deploy.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_startup.db"))
+    parser.add_argument("--workers", type=int, default=1, help="processes started at the same time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/packages", help="first request sent to each process")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_seconds(env) -> float:
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def answered(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1):
+            return True
+    except urllib.error.HTTPError:
+        # Any HTTP status means the app is serving
+        return True
+    except OSError:
+        return False
+
+
+def start_workers(count: int, env, path: str, timeout: float):
+    """Spawn count servers at once and return each one's seconds to first answer"""
+    ports = [free_port() for _ in range(count)]
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        for port in ports
+    ]
+    ready = {}
+    try:
+        while len(ready) < count:
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"{count - len(ready)} worker(s) did not answer within {timeout}s")
+            for port, process in zip(ports, processes):
+                if port in ready:
+                    continue
+                if process.poll() is not None:
+                    raise RuntimeError(f"Worker on port {port} exited with {process.returncode}")
+                if answered(f"http://127.0.0.1:{port}{path}"):
+                    ready[port] = time.perf_counter() - started
+            time.sleep(0.005)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    return list(ready.values())
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    subprocess.run([sys.executable, "-m", "migrate"], cwd=BACKEND_DIR, env=env, check=True, capture_output=True)
+
+    imports = [import_seconds(env) for _ in range(args.runs)]
+    print(f"import main:            median {statistics.median(imports) * 1000:7.0f} ms")
+
+    firsts, slowest = [], []
+    for _ in range(args.runs):
+        timings = start_workers(args.workers, env, args.path, args.timeout)
+        firsts.extend(timings)
+        slowest.append(max(timings))
+    print(f"spawn -> first request: median {statistics.median(firsts) * 1000:7.0f} ms, "
+          f"max {max(firsts) * 1000:.0f} ms over {len(firsts)} worker starts")
+    if args.workers > 1:
+        print(f"all {args.workers} workers serving:  median {statistics.median(slowest) * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
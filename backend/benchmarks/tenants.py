@@ -0,0 +1,350 @@
+"""Generate reproducible synthetic tenants for benchmarks and load tests
+
+Creates --tenants users spread over the Basic, Standard and Premium
+packages by --mix. Each tenant gets:
+- as many cameras as its package allows;
+- registered faces up to --face-fill of its face limit, or --unlimited-faces
+  on unlimited packages, each with a stored image and a ready embedding;
+- VISITORS_PER_TENANT recurring unknown visitors (visitor clusters);
+- a share of --detections detection_logs rows over the last --days days.
+The share is proportional to the tenant's camera count. Sightings favour
+a few regular visitors, and about a third are unknown faces, half of
+those recurring visitors.
+
+The same arguments always produce the same rows (except timestamps, which
+are relative to now). An existing data set with the expected shape is
+reused; any other generated data is deleted first. Every tenant logs in
+with TENANT_PASSWORD. Run from the backend directory:
+
+    python -m benchmarks.tenants --tenants 100 --detections 2000000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file. The schema
+is brought up to date with migrate.py first.
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import struct
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+EMAIL_DOMAIN = "bench.example.com"
+TENANT_PASSWORD = "bench-password"
+CHUNK_SIZE = 10000
+VISITORS_PER_TENANT = 20
+
+# Seeded by migrations/0001_initial.sql; created here for SQLite databases
+PACKAGES = (
+    {"name": "Basic", "price": 100, "camera_limit": 1, "max_registered_faces": 50, "data_retention_days": 30},
+    {"name": "Standard", "price": 500, "camera_limit": 1, "max_registered_faces": 200, "data_retention_days": 60},
+    {"name": "Premium", "price": 1400, "camera_limit": 2, "max_registered_faces": -1, "data_retention_days": 90},
+)
+
+
+@dataclass
+class Tenant:
+    user_id: int
+    email: str
+    package: str
+    camera_ids: List[int] = field(default_factory=list)
+    face_ids: List[int] = field(default_factory=list)
+    visitor_cluster_ids: List[int] = field(default_factory=list)
+    detections: int = 0
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Data set options, shared with benchmarks.load"""
+    group = parser.add_argument_group("synthetic tenants")
+    group.add_argument("--tenants", type=int, default=20)
+    group.add_argument("--mix", default="50,35,15", help="percent of tenants on Basic,Standard,Premium")
+    group.add_argument("--face-fill", type=float, default=0.8, help="fraction of each package's face limit used")
+    group.add_argument("--unlimited-faces", type=int, default=2000, help="faces per tenant on unlimited packages")
+    group.add_argument("--detections", type=int, default=200000, help="detection_logs rows across all tenants")
+    group.add_argument("--days", type=int, default=30)
+    group.add_argument("--seed", type=int, default=1)
+
+
+def tenant_email(index: int) -> str:
+    return f"tenant-{index:05d}@{EMAIL_DOMAIN}"
+
+
+def png_image(seed: int, size: int = 16) -> bytes:
+    """A small solid-colour PNG; different seeds give different bytes"""
+    rng = random.Random(seed)
+    pixel = bytes(rng.randrange(256) for _ in range(3))
+    raw = b"".join(b"\x00" + pixel * size for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)),
+        chunk(b"IDAT", zlib.compress(raw)),
+        chunk(b"IEND", b""),
+    ))
+
+
+def plan(args) -> List[dict]:
+    """Package, camera, face and detection counts per tenant"""
+    rng = random.Random(args.seed)
+    weights = [float(part) for part in args.mix.split(",")]
+    if len(weights) != len(PACKAGES):
+        raise ValueError("--mix needs one weight per package: Basic,Standard,Premium")
+    tenants = []
+    for _ in range(args.tenants):
+        package = rng.choices(PACKAGES, weights)[0]
+        face_limit = package["max_registered_faces"]
+        tenants.append({
+            "package": package["name"],
+            "cameras": package["camera_limit"],
+            "faces": args.unlimited_faces if face_limit == -1 else int(face_limit * args.face_fill),
+        })
+    total_cameras = sum(tenant["cameras"] for tenant in tenants) or 1
+    assigned = 0
+    for tenant in tenants:
+        tenant["detections"] = args.detections * tenant["cameras"] // total_cameras
+        assigned += tenant["detections"]
+    if tenants:
+        tenants[-1]["detections"] += args.detections - assigned
+    return tenants
+
+
+async def ensure_packages(db) -> Dict[str, int]:
+    from sqlalchemy import select
+    from models import Package
+
+    existing = {package.name: package.id for package in (await db.scalars(select(Package))).all()}
+    missing = [Package(**values) for values in PACKAGES if values["name"] not in existing]
+    if missing:
+        db.add_all(missing)
+        await db.commit()
+        existing.update({package.name: package.id for package in missing})
+    return existing
+
+
+async def existing_tenants(db) -> List[Tenant]:
+    from sqlalchemy import func, select
+    from models import User, Package, Camera, RegisteredFace, DetectionLog, VisitorCluster
+
+    rows = (await db.execute(
+        select(User.id, User.email, Package.name)
+        .outerjoin(Package, Package.id == User.package_id)
+        .where(User.email.like(f"tenant-%@{EMAIL_DOMAIN}"))
+        .order_by(User.email)
+    )).all()
+    tenants = {row.id: Tenant(row.id, row.email, row.name) for row in rows}
+    if not tenants:
+        return []
+    ids = list(tenants)
+    for camera_id, user_id in (await db.execute(
+        select(Camera.id, Camera.user_id).where(Camera.user_id.in_(ids)).order_by(Camera.id)
+    )).all():
+        tenants[user_id].camera_ids.append(camera_id)
+    for face_id, user_id in (await db.execute(
+        select(RegisteredFace.id, RegisteredFace.user_id).where(RegisteredFace.user_id.in_(ids)).order_by(RegisteredFace.id)
+    )).all():
+        tenants[user_id].face_ids.append(face_id)
+    for cluster_id, user_id in (await db.execute(
+        select(VisitorCluster.id, VisitorCluster.user_id).where(VisitorCluster.user_id.in_(ids)).order_by(VisitorCluster.id)
+    )).all():
+        tenants[user_id].visitor_cluster_ids.append(cluster_id)
+    for user_id, count in (await db.execute(
+        select(DetectionLog.user_id, func.count()).where(DetectionLog.user_id.in_(ids)).group_by(DetectionLog.user_id)
+    )).all():
+        tenants[user_id].detections = count
+    return list(tenants.values())
+
+
+def matches(tenants: List[Tenant], planned: List[dict]) -> bool:
+    return len(tenants) == len(planned) and all(
+        tenant.package == spec["package"]
+        and len(tenant.camera_ids) == spec["cameras"]
+        and len(tenant.face_ids) == spec["faces"]
+        and len(tenant.visitor_cluster_ids) == VISITORS_PER_TENANT
+        and tenant.detections == spec["detections"]
+        for tenant, spec in zip(tenants, planned)
+    )
+
+
+async def ensure_partitions_for(days: int) -> None:
+    """Monthly detection_logs partitions covering the generated range"""
+    from database import engine
+    from retention import add_months, ensure_partitions, is_partitioned, month_start
+
+    start = month_start(date.today() - timedelta(days=days))
+    months = 0
+    while add_months(start, months) < month_start(date.today()):
+        months += 1
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            await ensure_partitions(conn, start, months_ahead=months + 1)
+
+
+async def insert_detections(db, tenant: Tenant, count: int, days: int, rng: random.Random) -> None:
+    from sqlalchemy import insert
+    from models import DetectionLog
+
+    now = datetime.utcnow()
+    span = days * 86400
+    faces = tenant.face_ids
+    visitors = tenant.visitor_cluster_ids
+    for offset in range(0, count, CHUNK_SIZE):
+        rows = []
+        for _ in range(min(CHUNK_SIZE, count - offset)):
+            detected_at = now - timedelta(seconds=rng.random() * span)
+            hits = rng.randint(1, 3)
+            # Regular visitors get most sightings; a third are strangers,
+            # half of whom keep coming back
+            known = faces and rng.random() >= 0.33
+            recurring = not known and visitors and rng.random() < 0.5
+            rows.append({
+                "user_id": tenant.user_id,
+                "camera_id": rng.choice(tenant.camera_ids),
+                "registered_face_id": faces[int(len(faces) * rng.random() ** 3)] if known else None,
+                "visitor_cluster_id": visitors[int(len(visitors) * rng.random() ** 2)] if recurring else None,
+                "detection_confidence": round(0.5 + rng.random() * 0.4999, 4),
+                "detected_at": detected_at,
+                "last_seen_at": detected_at + timedelta(seconds=5 * (hits - 1)),
+                "hit_count": hits,
+                "created_at": detected_at,
+            })
+        await db.execute(insert(DetectionLog), rows)
+        await db.commit()
+
+
+async def generate(args, progress: bool = True) -> List[Tenant]:
+    """Create (or reuse) the data set described by args and return its tenants"""
+    import numpy as np
+    from sqlalchemy import delete, insert, select
+    from starlette.concurrency import run_in_threadpool
+    from database import SessionLocal
+    from models import User, Camera, RegisteredFace, VisitorCluster
+    from auth import get_password_hash
+    from embedding_models import EMBEDDING_DIM, encode_embedding
+    from face_index import FACE_EMBEDDING_MODEL
+    from migrate import migrate
+    from uploads import save_fileobj
+    from visitor_clusters import CENTROID_DTYPE
+
+    def log(message):
+        if progress:
+            print(message, flush=True)
+
+    await migrate()
+    planned = plan(args)
+    async with SessionLocal() as db:
+        package_ids = await ensure_packages(db)
+        tenants = await existing_tenants(db)
+        if matches(tenants, planned):
+            log(f"Reusing {len(tenants)} existing tenants")
+            return tenants
+        if tenants:
+            log(f"Deleting {len(tenants)} tenants generated with other settings")
+            await db.execute(delete(User).where(User.id.in_([tenant.user_id for tenant in tenants])))
+            await db.commit()
+
+    await ensure_partitions_for(args.days)
+    started = time.perf_counter()
+    rng = random.Random(args.seed)
+    vectors = np.random.default_rng(args.seed)
+    password_hash = get_password_hash(TENANT_PASSWORD)
+    image = await run_in_threadpool(save_fileobj, io.BytesIO(png_image(args.seed)))
+
+    tenants = []
+    async with SessionLocal() as db:
+        for index, spec in enumerate(planned):
+            user = User(
+                email=tenant_email(index), full_name=f"Tenant {index}", password_hash=password_hash,
+                package_id=package_ids[spec["package"]], is_verified=True
+            )
+            db.add(user)
+            await db.flush()
+            ip_camera = spec["package"] != "Basic"
+            cameras = [
+                Camera(
+                    user_id=user.id, camera_name=f"Camera {number + 1}", camera_brand="Generic",
+                    camera_type="ip_camera" if ip_camera else "webcam",
+                    ip_address="127.0.0.1" if ip_camera else None,
+                    port=10554 + number if ip_camera else None,
+                    status="active"
+                )
+                for number in range(spec["cameras"])
+            ]
+            db.add_all(cameras)
+            embeddings = vectors.standard_normal((spec["faces"], EMBEDDING_DIM)).astype(np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            face_ids = (await db.scalars(insert(RegisteredFace).returning(RegisteredFace.id, sort_by_parameter_order=True), [
+                {
+                    "user_id": user.id,
+                    "face_name": f"Person {number + 1}",
+                    "face_image_path": image.path,
+                    "face_encoding": encode_embedding(embedding, model=FACE_EMBEDDING_MODEL),
+                    "encoding_status": "ready",
+                    "is_active": True,
+                }
+                for number, embedding in enumerate(embeddings)
+            ])).all() if spec["faces"] else []
+            centroids = vectors.standard_normal((VISITORS_PER_TENANT, EMBEDDING_DIM)).astype(np.float32)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            now = datetime.utcnow()
+            visitor_cluster_ids = (await db.scalars(insert(VisitorCluster).returning(VisitorCluster.id, sort_by_parameter_order=True), [
+                {
+                    "user_id": user.id,
+                    "centroid": encode_embedding(centroid, model=FACE_EMBEDDING_MODEL, dtype=CENTROID_DTYPE),
+                    "sighting_count": 1,
+                    "first_seen_at": now - timedelta(days=args.days),
+                    "last_seen_at": now,
+                }
+                for centroid in centroids
+            ])).all()
+            await db.commit()
+            tenant = Tenant(
+                user.id, user.email, spec["package"], [camera.id for camera in cameras], list(face_ids),
+                list(visitor_cluster_ids)
+            )
+            await insert_detections(db, tenant, spec["detections"], args.days, rng)
+            tenant.detections = spec["detections"]
+            tenants.append(tenant)
+            if (index + 1) % 10 == 0 or index + 1 == len(planned):
+                log(f"  {index + 1}/{len(planned)} tenants, {time.perf_counter() - started:.0f}s")
+    return tenants
+
+
+async def run(args):
+    from database import engine
+
+    tenants = await generate(args)
+    await engine.dispose()
+    by_package: Dict[str, List[Tenant]] = {}
+    for tenant in tenants:
+        by_package.setdefault(tenant.package, []).append(tenant)
+    print(f"{'package':<10}{'tenants':>9}{'cameras':>9}{'faces':>9}{'detections':>12}")
+    for name, group in sorted(by_package.items()):
+        print(
+            f"{name:<10}{len(group):>9}{sum(len(t.camera_ids) for t in group):>9}"
+            f"{sum(len(t.face_ids) for t in group):>9}{sum(t.detections for t in group):>12}"
+        )
+    print(f"Log in as {tenant_email(0)} .. {tenant_email(len(tenants) - 1)} with password {TENANT_PASSWORD!r}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_load.db"))
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Measure online visitor clustering: assignment cost and cluster quality
+
+Streams --sightings unknown face embeddings through visitor_clusters in
+batches of --batch, as the recognition pipeline would. They come from
+--visitors synthetic people, a few of whom visit far more often than the
+rest, with per-dimension noise of --noise around each person's embedding.
+Reports assignment throughput per stretch of the stream, which should stay
+flat as history grows, and how well clusters match people:
+- purity: share of sightings in their person's largest cluster;
+- split: people spread over more than one cluster;
+- merged: clusters holding sightings of more than one person.
+Run from the backend directory:
+
+    python -m benchmarks.visitor_clusters --visitors 2000 --sightings 100000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///bench_visitor_clusters.db"))
+    parser.add_argument("--visitors", type=int, default=500)
+    parser.add_argument("--sightings", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=32, help="embeddings per assign() call")
+    parser.add_argument("--noise", type=float, default=0.025, help="per-dimension standard deviation")
+    parser.add_argument("--max-candidates", type=int, default=None, help="defaults to VISITOR_CLUSTER_MAX_CANDIDATES")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+async def seed_user(db) -> int:
+    from sqlalchemy import delete
+    from models import User
+
+    email = "bench-visitors@example.com"
+    await db.execute(delete(User).where(User.email == email))
+    user = User(email=email, full_name="Visitor benchmark", password_hash="-")
+    db.add(user)
+    await db.commit()
+    return user.id
+
+
+async def run(args):
+    import numpy as np
+    from database import engine, SessionLocal
+    from embedding_models import EMBEDDING_DIM
+    from migrate import migrate
+    from visitor_clusters import VisitorClusterer, VISITOR_CLUSTER_MAX_CANDIDATES
+
+    await migrate()
+    async with SessionLocal() as db:
+        user_id = await seed_user(db)
+
+    rng = np.random.default_rng(args.seed)
+    people = rng.standard_normal((args.visitors, EMBEDDING_DIM)).astype(np.float32)
+    people /= np.linalg.norm(people, axis=1, keepdims=True)
+    # Zipf-like visit frequencies: regulars and many occasional visitors
+    weights = 1.0 / np.arange(1, args.visitors + 1)
+    who = rng.choice(args.visitors, size=args.sightings, p=weights / weights.sum())
+    embeddings = people[who] + rng.standard_normal((args.sightings, EMBEDDING_DIM)).astype(np.float32) * args.noise
+    start = datetime.utcnow() - timedelta(seconds=args.sightings)
+    times = [start + timedelta(seconds=i) for i in range(args.sightings)]
+
+    clusterer = VisitorClusterer(max_candidates=args.max_candidates or VISITOR_CLUSTER_MAX_CANDIDATES)
+    assigned = []
+    stretch = max(args.batch, args.sightings // 5)
+    print(f"{args.visitors} visitors, {args.sightings} sightings, batches of {args.batch}, "
+          f"tolerance {clusterer.tolerance}, max candidates {clusterer.max_candidates}")
+    print(f"{'sightings':>12}{'candidates':>12}{'clusters':>10}{'us/sighting':>13}")
+    for offset in range(0, args.sightings, stretch):
+        started = time.perf_counter()
+        end = min(offset + stretch, args.sightings)
+        for first in range(offset, end, args.batch):
+            last = min(first + args.batch, end)
+            assigned += await clusterer.assign(user_id, embeddings[first:last], times[first:last])
+        micros = (time.perf_counter() - started) / (end - offset) * 1e6
+        stats = clusterer.stats()
+        print(f"{end:>12}{stats['candidates']:>12}{stats['created']:>10}{micros:>13.0f}")
+    await clusterer.flush()
+
+    by_person = defaultdict(Counter)
+    by_cluster = defaultdict(set)
+    for person, cluster_id in zip(who.tolist(), assigned):
+        by_person[person][cluster_id] += 1
+        by_cluster[cluster_id].add(person)
+    purity = sum(counts.most_common(1)[0][1] for counts in by_person.values()) / len(assigned)
+    split = sum(1 for counts in by_person.values() if len(counts) > 1)
+    merged = sum(1 for people_in in by_cluster.values() if len(people_in) > 1)
+    print(f"\npeople seen {len(by_person)}, clusters {len(by_cluster)}")
+    print(f"purity {purity:.3f}, split {split}, merged {merged}, evicted {clusterer.evicted}")
+    await engine.dispose()
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
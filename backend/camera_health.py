@@ -0,0 +1,474 @@
+import asyncio
+import heapq
+import ipaddress
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, func, select, update
+
+from database import SessionLocal
+from leader_lock import LeaderLock
+from models import Camera
+from events import event_broker
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CAMERA_HEALTH_ENABLED = os.getenv("CAMERA_HEALTH_ENABLED", "true").lower() in ("1", "true", "yes")
+CAMERA_HEALTH_INTERVAL_SECONDS = float(os.getenv("CAMERA_HEALTH_INTERVAL_SECONDS", "30"))
+CAMERA_HEALTH_TIMEOUT_SECONDS = float(os.getenv("CAMERA_HEALTH_TIMEOUT_SECONDS", "3"))
+CAMERA_HEALTH_CONCURRENCY = int(os.getenv("CAMERA_HEALTH_CONCURRENCY", "500"))
+CAMERA_HEALTH_MAX_BACKOFF_SECONDS = float(os.getenv("CAMERA_HEALTH_MAX_BACKOFF_SECONDS", "600"))
+# Split cameras across nodes: this node probes ids where id % COUNT == INDEX
+CAMERA_HEALTH_SHARD_INDEX = int(os.getenv("CAMERA_HEALTH_SHARD_INDEX", "0"))
+CAMERA_HEALTH_SHARD_COUNT = int(os.getenv("CAMERA_HEALTH_SHARD_COUNT", "1"))
+# Cameras may not point at these: loopback, link-local (including cloud
+# metadata at 169.254.169.254) and other metadata addresses. Set to empty
+# for on-prem installs whose cameras share the server's network
+CAMERA_BLOCKED_NETWORKS = os.getenv(
+    "CAMERA_BLOCKED_NETWORKS",
+    "0.0.0.0/8,127.0.0.0/8,169.254.0.0/16,100.100.100.200/32,::/128,::1/128,fe80::/10,fd00:ec2::254/128"
+)
+# A user's on-demand probes (POST /cameras/{id}/test) are this far apart at least
+CAMERA_TEST_MIN_INTERVAL_SECONDS = float(os.getenv("CAMERA_TEST_MIN_INTERVAL_SECONDS", "10"))
+
+# Consecutive failed probes before an active camera is marked inactive
+FAILURES_BEFORE_INACTIVE = 2
+# Scheduled delays are spread by +/- this fraction so probes do not align
+JITTER = 0.2
+# Pending status changes are written to the database this often
+FLUSH_SECONDS = 2.0
+# last_seen is refreshed at most this often for a camera that stays active
+LAST_SEEN_WRITE_SECONDS = 300.0
+# The camera list is reloaded this often to pick up changes from other workers
+REFRESH_SECONDS = 60.0
+# Only the API worker holding this lock (per shard) runs the monitor
+ADVISORY_LOCK_KEY = 0x63616d68  # "camh"
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+_write_status = update(Camera.__table__).where(
+    Camera.__table__.c.id == bindparam("camera_id"),
+    Camera.__table__.c.status != "disabled"
+).values(
+    status=bindparam("new_status"),
+    last_seen=func.coalesce(bindparam("seen_at"), Camera.__table__.c.last_seen),
+)
+
+
+@dataclass
+class ProbeResult:
+    reachable: bool
+    latency_ms: Optional[float]
+    error: Optional[str]
+    checked_at: datetime
+
+
+class ProbeRateLimited(Exception):
+    """The user probed a camera on demand too recently"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Target:
+    camera_id: int
+    user_id: int
+    host: str
+    port: int
+    status: str
+    failures: int = 0
+    next_due: float = 0.0
+    last_result: Optional[ProbeResult] = None
+    checked_at: float = 0.0
+    last_seen_written: float = 0.0
+
+
+@dataclass
+class _PendingWrite:
+    status: str
+    seen_at: Optional[datetime] = None
+    status_changed: bool = False
+
+
+def _host(ip_address) -> str:
+    # asyncpg returns INET values as ipaddress objects
+    return str(getattr(ip_address, "ip", ip_address))
+
+
+def parse_networks(value: str) -> List[Network]:
+    return [ipaddress.ip_network(part.strip()) for part in value.split(",") if part.strip()]
+
+
+def address_allowed(ip_address, blocked: Sequence[Network]) -> bool:
+    """Whether a camera address is an IP outside the blocked networks"""
+    try:
+        address = ipaddress.ip_address(_host(ip_address))
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return not any(address in network for network in blocked if network.version == address.version)
+
+
+async def probe(host: str, port: int, timeout: float = CAMERA_HEALTH_TIMEOUT_SECONDS) -> ProbeResult:
+    """Check that a TCP connection to host:port can be opened within timeout"""
+    started = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        return ProbeResult(False, None, f"Timed out after {timeout:g}s", datetime.utcnow())
+    except OSError as exc:
+        return ProbeResult(False, None, exc.strerror or str(exc), datetime.utcnow())
+
+    latency_ms = round((time.monotonic() - started) * 1000, 1)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return ProbeResult(True, latency_ms, None, datetime.utcnow())
+
+
+class CameraHealthMonitor:
+    """Probes IP cameras and keeps Camera.status and Camera.last_seen current
+
+    One scheduler task pops due cameras from a heap and starts probes, with
+    a semaphore capping how many connections are in flight, so the number of
+    tasks tracks the concurrency limit rather than the number of cameras.
+    Healthy cameras are re-probed every interval, dead ones back off
+    exponentially, and each delay is jittered. Status changes are collected
+    and written back in batches; disabled cameras and webcams are skipped.
+    On PostgreSQL only the worker holding its shard's advisory lock probes;
+    the others retry the lock every REFRESH_SECONDS and serve check() alone.
+    Addresses in blocked networks are never probed.
+    """
+
+    def __init__(
+        self,
+        interval: float = CAMERA_HEALTH_INTERVAL_SECONDS,
+        timeout: float = CAMERA_HEALTH_TIMEOUT_SECONDS,
+        concurrency: int = CAMERA_HEALTH_CONCURRENCY,
+        max_backoff: float = CAMERA_HEALTH_MAX_BACKOFF_SECONDS,
+        shard_index: int = CAMERA_HEALTH_SHARD_INDEX,
+        shard_count: int = CAMERA_HEALTH_SHARD_COUNT,
+        blocked_networks: Optional[Sequence[Network]] = None,
+        test_interval: float = CAMERA_TEST_MIN_INTERVAL_SECONDS
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_backoff = max_backoff
+        self.shard_index = shard_index
+        self.shard_count = max(1, shard_count)
+        self.blocked_networks = (
+            parse_networks(CAMERA_BLOCKED_NETWORKS) if blocked_networks is None else list(blocked_networks)
+        )
+        self.test_interval = test_interval
+        # Users by the time of their last on-demand probe, oldest first
+        self._last_test: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = LeaderLock(ADVISORY_LOCK_KEY, self.shard_index)
+        self._lead_task: Optional[asyncio.Task] = None
+        self._targets: Dict[int, _Target] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._pending: Dict[int, _PendingWrite] = {}
+        self._probes = set()
+        self._tasks: List[asyncio.Task] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.probes_done = 0
+        self.probes_failed = 0
+        self.rows_written = 0
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self):
+        if self._lead_task is not None and not self._lead_task.done():
+            return
+        try:
+            if await self._lock.acquire():
+                await self._start_probing()
+        except Exception:
+            logger.exception("Starting camera health checks failed")
+        self._lead_task = asyncio.create_task(self._lead())
+
+    async def stop(self):
+        if self._lead_task is not None:
+            self._lead_task.cancel()
+            await asyncio.gather(self._lead_task, return_exceptions=True)
+            self._lead_task = None
+        await self._stop_probing()
+
+    async def _lead(self):
+        """Take over probing when the lock frees up, and give it up if the lock is lost"""
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            try:
+                if not self.running:
+                    if await self._lock.acquire():
+                        await self._start_probing()
+                else:
+                    await self._lock.check()
+            except Exception:
+                logger.exception("Camera health lock check failed")
+                await self._stop_probing()
+
+    async def _start_probing(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        try:
+            await self.refresh()
+        except BaseException:
+            await self._stop_probing()
+            raise
+        self._tasks = [
+            asyncio.create_task(self._schedule()),
+            asyncio.create_task(self._flush_loop()),
+        ]
+
+    async def _stop_probing(self):
+        for task in self._tasks + list(self._probes):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._probes, return_exceptions=True)
+        self._tasks = []
+        self._slots = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Writing camera health results failed")
+        self._targets.clear()
+        self._heap.clear()
+        await self._lock.release()
+
+    def _owns(self, camera_id: int) -> bool:
+        return camera_id % self.shard_count == self.shard_index
+
+    def _delay(self, target: _Target) -> float:
+        if target.failures:
+            base = min(self.interval * (2 ** (target.failures - 1)), self.max_backoff)
+        else:
+            base = self.interval
+        return base * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def _schedule_at(self, target: _Target, due: float):
+        target.next_due = due
+        heapq.heappush(self._heap, (due, target.camera_id))
+        if self._wakeup is not None and self._heap[0][1] == target.camera_id:
+            self._wakeup.set()
+
+    def track(self, camera: Camera) -> None:
+        """Start or update monitoring of a camera after it was created or edited"""
+        if self._slots is None:
+            return
+        if (
+            camera.camera_type != "ip_camera" or camera.status == "disabled"
+            or not camera.ip_address or not camera.port or not self._owns(camera.id)
+            or not self.allows(camera.ip_address)
+        ):
+            self.forget(camera.id)
+            return
+
+        host = _host(camera.ip_address)
+        target = self._targets.get(camera.id)
+        if target is not None and (target.host, target.port) == (host, camera.port):
+            target.status = camera.status or target.status
+            return
+
+        target = _Target(camera.id, camera.user_id, host, camera.port, camera.status or "inactive")
+        self._targets[camera.id] = target
+        # Spread the first round of probes over one interval
+        self._schedule_at(target, time.monotonic() + random.uniform(0, self.interval))
+
+    def forget(self, camera_id: int) -> None:
+        """Stop monitoring a deleted or disabled camera"""
+        # Its heap entry becomes stale and is skipped when popped
+        self._targets.pop(camera_id, None)
+        self._pending.pop(camera_id, None)
+
+    async def refresh(self):
+        """Reload the set of IP cameras to monitor"""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(
+                    Camera.id, Camera.user_id, Camera.camera_type, Camera.ip_address,
+                    Camera.port, Camera.status
+                ).where(Camera.camera_type == "ip_camera", Camera.status != "disabled")
+            )
+            cameras = result.all()
+
+        seen = set()
+        for camera in cameras:
+            if self._owns(camera.id):
+                seen.add(camera.id)
+                self.track(camera)
+        for camera_id in [camera_id for camera_id in self._targets if camera_id not in seen]:
+            self.forget(camera_id)
+
+    async def _schedule(self):
+        next_refresh = time.monotonic() + REFRESH_SECONDS
+        while True:
+            now = time.monotonic()
+            if now >= next_refresh:
+                try:
+                    await self.refresh()
+                except Exception:
+                    logger.exception("Reloading cameras for health checks failed")
+                next_refresh = time.monotonic() + REFRESH_SECONDS
+
+            while self._heap and self._heap[0][0] <= now:
+                due, camera_id = heapq.heappop(self._heap)
+                target = self._targets.get(camera_id)
+                if target is None or target.next_due != due:
+                    continue
+                await self._slots.acquire()
+                task = asyncio.create_task(self._probe_target(target))
+                self._probes.add(task)
+                task.add_done_callback(self._probes.discard)
+
+            wake_at = min(self._heap[0][0] if self._heap else next_refresh, next_refresh)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, wake_at - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _probe_target(self, target: _Target):
+        try:
+            result = await probe(target.host, target.port, self.timeout)
+            self._record(target, result)
+            if self._targets.get(target.camera_id) is target:
+                self._schedule_at(target, time.monotonic() + self._delay(target))
+        finally:
+            self._slots.release()
+
+    def _record(self, target: _Target, result: ProbeResult) -> None:
+        now = time.monotonic()
+        target.last_result = result
+        target.checked_at = now
+        self.probes_done += 1
+
+        if result.reachable:
+            target.failures = 0
+            new_status = "active"
+        else:
+            target.failures += 1
+            self.probes_failed += 1
+            new_status = "inactive" if target.failures >= FAILURES_BEFORE_INACTIVE else target.status
+
+        status_changed = new_status != target.status
+        refresh_seen = result.reachable and now - target.last_seen_written >= LAST_SEEN_WRITE_SECONDS
+        if not status_changed and not refresh_seen:
+            return
+
+        target.status = new_status
+        pending = self._pending.setdefault(target.camera_id, _PendingWrite(new_status))
+        pending.status = new_status
+        pending.status_changed = pending.status_changed or status_changed
+        if result.reachable:
+            pending.seen_at = result.checked_at
+            target.last_seen_written = now
+
+    def allows(self, ip_address) -> bool:
+        """Whether cameras may be configured with this address"""
+        return address_allowed(ip_address, self.blocked_networks)
+
+    def _claim_test(self, user_id: int) -> None:
+        now = time.monotonic()
+        while self._last_test and next(iter(self._last_test.values())) <= now - self.test_interval:
+            self._last_test.popitem(last=False)
+        last = self._last_test.get(user_id)
+        if last is not None:
+            raise ProbeRateLimited(last + self.test_interval - now)
+        self._last_test[user_id] = now
+
+    async def check(self, camera: Camera, max_age: Optional[float] = None) -> Tuple[ProbeResult, bool]:
+        """Return (result, cached) for a camera, probing now if no fresh result exists
+
+        Used by the test endpoint; the caller persists the outcome. Raises
+        ProbeRateLimited when the camera's owner probed too recently.
+        """
+        max_age = self.interval if max_age is None else max_age
+        target = self._targets.get(camera.id)
+        if (
+            target is not None and target.last_result is not None
+            and time.monotonic() - target.checked_at <= max_age
+        ):
+            return target.last_result, True
+
+        if not self.allows(camera.ip_address):
+            return ProbeResult(False, None, "Address not allowed", datetime.utcnow()), False
+        self._claim_test(camera.user_id)
+        result = await probe(_host(camera.ip_address), camera.port, self.timeout)
+        if target is not None:
+            target.failures = 0 if result.reachable else max(target.failures + 1, FAILURES_BEFORE_INACTIVE)
+            target.status = "active" if result.reachable else "inactive"
+            target.last_result = result
+            target.checked_at = time.monotonic()
+            if result.reachable:
+                target.last_seen_written = target.checked_at
+            self._pending.pop(camera.id, None)
+            self._schedule_at(target, target.checked_at + self._delay(target))
+        return result, False
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Writing camera health results failed")
+
+    async def flush(self):
+        """Write collected status and last_seen changes with one executemany"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        params = [
+            {"camera_id": camera_id, "new_status": write.status, "seen_at": write.seen_at}
+            for camera_id, write in pending.items()
+        ]
+        try:
+            async with SessionLocal() as db:
+                await db.execute(_write_status, params)
+                await db.commit()
+        except Exception:
+            # Keep the changes for the next flush unless newer ones arrived
+            for camera_id, write in pending.items():
+                self._pending.setdefault(camera_id, write)
+            raise
+        self.rows_written += len(params)
+
+        for camera_id, write in pending.items():
+            target = self._targets.get(camera_id)
+            if target is not None and write.status_changed:
+                event_broker.publish(target.user_id, "camera", {
+                    "camera_id": camera_id,
+                    "status": write.status,
+                    "last_seen": write.seen_at,
+                })
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "cameras": len(self._targets),
+            "probes_in_flight": len(self._probes),
+            "probes_done": self.probes_done,
+            "probes_failed": self.probes_failed,
+            "rows_written": self.rows_written,
+            "pending_writes": len(self._pending),
+        }
+
+
+camera_health = CameraHealthMonitor()
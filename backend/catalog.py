@@ -0,0 +1,146 @@
+"""Process-local cache of the serialized package catalog
+
+GET /packages is hit by every visit to the landing and registration pages,
+while the packages table changes a few times a year. The catalog is kept
+as the encoded JSON body plus a content hash used as its ETag, so a hit
+costs neither a query nor serialization, and a client revalidating with
+If-None-Match gets a bodyless 304. The ETag depends only on the content,
+so every worker hands out the same one.
+
+ORM writes to Package in this process invalidate the cache; the TTL bounds
+staleness for changes made by other workers or directly in the database.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from database import SessionLocal
+from models import Package
+from schemas import PackageResponse
+from storage import etag_matches
+
+load_dotenv()
+
+PACKAGE_CATALOG_TTL_SECONDS = float(os.getenv("PACKAGE_CATALOG_TTL_SECONDS", "300"))
+# Browser/CDN freshness; after it lapses clients revalidate with the ETag
+PACKAGE_CATALOG_MAX_AGE_SECONDS = int(os.getenv("PACKAGE_CATALOG_MAX_AGE_SECONDS", "60"))
+
+_packages_adapter = TypeAdapter(List[PackageResponse])
+
+
+def encode_catalog(packages) -> bytes:
+    """The /packages response body, exactly as the response model renders it"""
+    return _packages_adapter.dump_json(_packages_adapter.validate_python(packages, from_attributes=True))
+
+
+class PackageCatalog:
+    """Encoded package list and its ETag, reloaded after invalidation or TTL"""
+
+    def __init__(self, ttl: float = PACKAGE_CATALOG_TTL_SECONDS, max_age: int = PACKAGE_CATALOG_MAX_AGE_SECONDS):
+        self.ttl = ttl
+        self.max_age = max_age
+        # (body, etag, expires_at)
+        self._entry: Optional[Tuple[bytes, str, float]] = None
+        # Bumped by invalidate() so a load racing a write is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._load_lock: Optional[asyncio.Lock] = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def _cached(self) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            if self._entry is not None and self._entry[2] > time.monotonic():
+                return self._entry[0], self._entry[1]
+        return None
+
+    async def get(self) -> Tuple[bytes, str]:
+        """(body, etag), loading the catalog from the database on a miss"""
+        cached = self._cached()
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        # Concurrent misses share a single query
+        async with self._load_lock:
+            cached = self._cached()
+            if cached is not None:
+                return cached
+            generation = self._generation
+            async with SessionLocal() as db:
+                packages = (await db.scalars(select(Package).order_by(Package.id))).all()
+                body = encode_catalog(packages)
+            etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            with self._lock:
+                if generation == self._generation:
+                    self._entry = (body, etag, time.monotonic() + self.ttl)
+            return body, etag
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entry = None
+            self._generation += 1
+            self.invalidations += 1
+
+    async def respond(self, request: Request) -> Response:
+        """200 with the catalog, or 304 when If-None-Match already has it"""
+        body, etag = await self.get()
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={self.max_age}"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": self._entry is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+package_catalog = PackageCatalog()
+
+
+# Invalidate at flush, and again at commit in case a reload read the old
+# rows in between
+@event.listens_for(Package, "after_insert")
+@event.listens_for(Package, "after_delete")
+def _package_changed(mapper, connection, target):
+    package_catalog.invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info["package_catalog_stale"] = True
+
+
+@event.listens_for(Package, "after_update")
+def _package_updated(mapper, connection, target):
+    # Also fires when only Package.users changed, e.g. on every registration
+    session = object_session(target)
+    if session is None or session.is_modified(target, include_collections=False):
+        _package_changed(mapper, connection, target)
+
+
+@event.listens_for(Session, "after_commit")
+def _session_committed(session):
+    if session.info.pop("package_catalog_stale", False):
+        package_catalog.invalidate()
@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, update
+
+from database import SessionLocal
+from models import DetectionLog
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sightings of the same face on the same camera less than this many seconds
+# apart are merged into one detection; 0 writes every sighting
+DETECTION_DEDUP_WINDOW_SECONDS = float(os.getenv("DETECTION_DEDUP_WINDOW_SECONDS", "30"))
+DETECTION_DEDUP_MAX_ENTRIES = int(os.getenv("DETECTION_DEDUP_MAX_ENTRIES", "100000"))
+# Merged hit counts and last-seen times are written back this often
+FLUSH_SECONDS = 5.0
+
+# Matching on detected_at as well lets PostgreSQL prune the monthly
+# partitions of detection_logs
+_write_episodes = update(DetectionLog.__table__).where(
+    DetectionLog.__table__.c.id == bindparam("detection_id"),
+    DetectionLog.__table__.c.detected_at == bindparam("recorded_first_seen"),
+).values(
+    detected_at=bindparam("first_seen"),
+    last_seen_at=bindparam("last_seen"),
+    hit_count=bindparam("hits"),
+    detection_confidence=bindparam("peak_confidence"),
+)
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Naive UTC, as detection timestamps are stored"""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@dataclass(eq=False)
+class Episode:
+    """An open run of sightings of one face (or unknown visitor) on one camera"""
+    user_id: int
+    camera_id: int
+    registered_face_id: Optional[int]
+    visitor_cluster_id: Optional[int]
+    first_seen: datetime
+    last_seen: datetime
+    hits: int
+    peak_confidence: object
+    detection_image_path: Optional[str]
+    detection_id: Optional[int] = None
+    # detected_at of the row as last written
+    recorded_first_seen: Optional[datetime] = None
+    dirty: bool = False
+    touched: float = 0.0
+
+    @property
+    def key(self) -> Tuple[int, Optional[int], Optional[int]]:
+        return self.camera_id, self.registered_face_id, self.visitor_cluster_id
+
+    def as_row(self, created_at: datetime) -> dict:
+        # Every row carries the same keys so the driver can batch them
+        return {
+            "user_id": self.user_id,
+            "camera_id": self.camera_id,
+            "registered_face_id": self.registered_face_id,
+            "visitor_cluster_id": self.visitor_cluster_id,
+            "detection_confidence": self.peak_confidence,
+            "detection_image_path": self.detection_image_path,
+            "detected_at": self.first_seen,
+            "last_seen_at": self.last_seen,
+            "hit_count": self.hits,
+            "created_at": created_at,
+        }
+
+    def as_update(self) -> dict:
+        return {
+            "detection_id": self.detection_id,
+            "recorded_first_seen": self.recorded_first_seen,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "hits": self.hits,
+            "peak_confidence": self.peak_confidence,
+        }
+
+
+class DetectionDeduper:
+    """Merges repeat sightings keyed by (camera_id, registered_face_id, visitor_cluster_id)
+
+    The first sighting of a key inserts a detection right away so alerts are
+    not delayed. Further sightings within the window only update the open
+    episode in memory: first and last seen time, hit count and peak
+    confidence, which a background task writes back in batches. A sighting
+    more than the window before or after the episode starts a new detection;
+    one older than the open episode is recorded on its own and leaves the
+    open episode in place. Events with neither a registered face nor a
+    visitor cluster are unrelated strangers and are never merged. Episodes
+    live in an LRU bounded by
+    max_entries and are dropped once idle. Used from the event loop only;
+    each API worker dedups the traffic it ingests.
+    """
+
+    def __init__(
+        self,
+        window: float = DETECTION_DEDUP_WINDOW_SECONDS,
+        max_entries: int = DETECTION_DEDUP_MAX_ENTRIES
+    ):
+        self.window = window
+        self.max_entries = max_entries
+        self._episodes: "OrderedDict[Tuple[int, Optional[int], Optional[int]], Episode]" = OrderedDict()
+        # Dirty episodes pushed out of the LRU, kept until their next flush
+        self._retired: List[Episode] = []
+        self._task: Optional[asyncio.Task] = None
+        self.sightings = 0
+        self.inserted = 0
+        self.updates_written = 0
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _retire(self, episode: Episode):
+        if episode.dirty:
+            self._retired.append(episode)
+
+    def absorb(self, user_id: int, events: Sequence, now: datetime) -> List[Episode]:
+        """Fold validated events into open episodes, returning the new ones
+
+        The caller inserts one row per returned episode and then calls
+        bind() with the new detection ids.
+        """
+        created: List[Episode] = []
+        created_keys = set()
+        touched = time.monotonic()
+        for event in events:
+            self.sightings += 1
+            seen_at = naive_utc(event.detected_at or now)
+            key = (event.camera_id, event.registered_face_id, event.visitor_cluster_id)
+            anonymous = event.registered_face_id is None and event.visitor_cluster_id is None
+            episode = None if anonymous else self._episodes.get(key)
+
+            if episode is not None and self._within(episode, seen_at):
+                episode.hits += 1
+                episode.first_seen = min(episode.first_seen, seen_at)
+                episode.last_seen = max(episode.last_seen, seen_at)
+                confidence = event.detection_confidence
+                if confidence is not None and (episode.peak_confidence is None or confidence > episode.peak_confidence):
+                    episode.peak_confidence = confidence
+                if episode.detection_image_path is None:
+                    episode.detection_image_path = event.detection_image_path
+                # Episodes created in this batch are inserted with their totals
+                episode.dirty = key not in created_keys
+                episode.touched = touched
+                self._episodes.move_to_end(key)
+                continue
+
+            # Backfilled sightings older than the open episode do not replace it
+            tracked = not anonymous and (episode is None or seen_at > episode.last_seen)
+            if tracked and episode is not None:
+                self._retire(episode)
+            episode = Episode(
+                user_id=user_id,
+                camera_id=event.camera_id,
+                registered_face_id=event.registered_face_id,
+                visitor_cluster_id=event.visitor_cluster_id,
+                first_seen=seen_at,
+                last_seen=seen_at,
+                hits=1,
+                peak_confidence=event.detection_confidence,
+                detection_image_path=event.detection_image_path,
+                touched=touched,
+            )
+            created.append(episode)
+            if tracked:
+                self._episodes[key] = episode
+                self._episodes.move_to_end(key)
+                created_keys.add(key)
+
+        while len(self._episodes) > self.max_entries:
+            _, evicted = self._episodes.popitem(last=False)
+            self._retire(evicted)
+            self.evicted += 1
+        for episode in created:
+            episode.recorded_first_seen = episode.first_seen
+        self.inserted += len(created)
+        return created
+
+    def _within(self, episode: Episode, seen_at: datetime) -> bool:
+        earliest = episode.first_seen - timedelta(seconds=self.window)
+        latest = episode.last_seen + timedelta(seconds=self.window)
+        return earliest <= seen_at <= latest
+
+    def bind(self, episodes: Sequence[Episode], detection_ids: Sequence[int]) -> None:
+        """Attach the ids of the rows inserted for new episodes"""
+        for episode, detection_id in zip(episodes, detection_ids):
+            episode.detection_id = detection_id
+
+    def forget(self, episodes: Sequence[Episode]) -> None:
+        """Drop new episodes whose insert failed, so the next sighting retries"""
+        for episode in episodes:
+            episode.dirty = False
+            if self._episodes.get(episode.key) is episode:
+                del self._episodes[episode.key]
+
+    def _prune(self):
+        idle_before = time.monotonic() - 2 * self.window
+        while self._episodes:
+            key, episode = next(iter(self._episodes.items()))
+            if episode.touched > idle_before:
+                break
+            del self._episodes[key]
+            self._retire(episode)
+
+    async def flush(self):
+        """Write merged sightings of open and retired episodes"""
+        self._prune()
+        pending = [e for e in self._episodes.values() if e.dirty and e.detection_id is not None]
+        pending += [e for e in self._retired if e.detection_id is not None]
+        self._retired = [e for e in self._retired if e.detection_id is None and e.dirty]
+        if not pending:
+            return
+        for episode in pending:
+            episode.dirty = False
+        params = [episode.as_update() for episode in pending]
+        try:
+            async with SessionLocal() as db:
+                await db.execute(_write_episodes, params)
+                await db.commit()
+        except Exception:
+            for episode in pending:
+                episode.dirty = True
+                if self._episodes.get(episode.key) is not episode:
+                    self._retired.append(episode)
+            raise
+        for episode, written in zip(pending, params):
+            episode.recorded_first_seen = written["first_seen"]
+        self.updates_written += len(params)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Writing merged detections failed")
+
+    async def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "open_episodes": len(self._episodes),
+            "sightings": self.sightings,
+            "inserted": self.inserted,
+            "updates_written": self.updates_written,
+            "evicted": self.evicted,
+        }
+
+
+detection_dedup = DetectionDeduper()
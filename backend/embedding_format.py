@@ -0,0 +1,170 @@
+"""Versioned binary layout of RegisteredFace.face_encoding
+
+Layout (little endian), 16-byte header followed by the vector:
+
+    magic     4s   b"FEMB"
+    version   u8   1
+    dtype     u8   1 = float32, 2 = float16, 3 = int8
+    dim       u16
+    model     u16  embedding model id, 0 = unknown
+    reserved  u16
+    scale     f32  int8 dequantization scale, 1.0 otherwise
+    payload   dim values of dtype
+
+int8 is symmetric per-vector quantization (value = q * scale). Values
+written before the header existed are raw float32 and still decode.
+
+Like embedding_models, this module only depends on numpy.
+"""
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"FEMB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHHHf")
+HEADER_SIZE = HEADER.size
+
+DTYPES: Dict[str, Tuple[int, np.dtype]] = {
+    "float32": (1, np.dtype("<f4")),
+    "float16": (2, np.dtype("<f2")),
+    "int8": (3, np.dtype("i1")),
+}
+_DTYPE_BY_CODE = {code: (name, dtype) for name, (code, dtype) in DTYPES.items()}
+
+# Stable ids written into the header; never reuse a number
+MODEL_IDS = {
+    "face_recognition": 1,
+    "stub": 2,
+}
+_MODEL_BY_ID = {model_id: name for name, model_id in MODEL_IDS.items()}
+
+
+@dataclass(frozen=True)
+class EncodingInfo:
+    version: int
+    dtype: str
+    dim: int
+    model_id: int
+    scale: float
+    offset: int
+
+    @property
+    def legacy(self) -> bool:
+        return self.version == 0
+
+    @property
+    def model(self) -> Optional[str]:
+        return _MODEL_BY_ID.get(self.model_id)
+
+
+def model_id(model: Optional[str]) -> int:
+    return MODEL_IDS.get(model, 0) if model else 0
+
+
+def _read_header(data: bytes) -> Tuple[int, str, int, int, float, int]:
+    if len(data) >= HEADER_SIZE and data[:4] == MAGIC:
+        _, version, code, dim, model, _, scale = HEADER.unpack_from(data)
+        if version != VERSION or code not in _DTYPE_BY_CODE:
+            raise ValueError(f"Unsupported embedding encoding v{version} dtype {code}")
+        name, dtype = _DTYPE_BY_CODE[code]
+        if len(data) != HEADER_SIZE + dim * dtype.itemsize:
+            raise ValueError("Embedding encoding length does not match its header")
+        return version, name, dim, model, scale, HEADER_SIZE
+    if len(data) % 4:
+        raise ValueError("Not an embedding encoding")
+    return 0, "float32", len(data) // 4, 0, 1.0, 0
+
+
+def parse_header(data: bytes) -> EncodingInfo:
+    """Parse the header of a stored encoding, ValueError if malformed"""
+    return EncodingInfo(*_read_header(data))
+
+
+def encode(embedding, dtype: str = "float32", model: Optional[str] = None) -> bytes:
+    """Serialize one embedding with a header"""
+    code, np_dtype = DTYPES[dtype]
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    scale = 1.0
+    if dtype == "int8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        payload = np.clip(np.rint(vector / scale), -127, 127).astype(np_dtype)
+    else:
+        payload = vector.astype(np_dtype)
+    header = HEADER.pack(MAGIC, VERSION, code, vector.shape[0], model_id(model), 0, scale)
+    return header + payload.tobytes()
+
+
+def decode(data: bytes) -> np.ndarray:
+    """Deserialize one encoding to float32
+
+    float32 payloads are a zero-copy read-only view of ``data``.
+    """
+    info = parse_header(data)
+    _, np_dtype = DTYPES[info.dtype]
+    payload = np.frombuffer(data, dtype=np_dtype, count=info.dim, offset=info.offset)
+    if info.dtype == "float32":
+        return payload
+    vector = payload.astype(np.float32)
+    if info.dtype == "int8":
+        vector *= np.float32(info.scale)
+    return vector
+
+
+def decode_many(
+    encodings: Sequence[bytes],
+    dim: int,
+    model: Optional[str] = None,
+    out: Optional[np.ndarray] = None
+) -> Tuple[List[int], np.ndarray]:
+    """Decode many encodings into one float32 matrix
+
+    Returns (positions of the encodings that were used, matrix). Encodings
+    with another dimension, another model or a malformed layout are
+    skipped; legacy encodings carry no model id and are assumed to match.
+    Payloads of each stored dtype are joined into one buffer and converted
+    with a single vectorized cast instead of decoding row by row. ``out``
+    may supply a preallocated matrix of at least len(encodings) rows.
+    """
+    wanted_model = model_id(model)
+    # Encodings of one dtype and layout all have the same length, so each
+    # group is joined whole and the payload columns sliced out as a view
+    groups: Dict[Tuple[str, int], Tuple[List[int], List[bytes], List[float]]] = {}
+    for position, data in enumerate(encodings):
+        if not data:
+            continue
+        try:
+            _, dtype, encoded_dim, encoded_model, scale, offset = _read_header(data)
+        except ValueError:
+            continue
+        if encoded_dim != dim:
+            continue
+        if wanted_model and encoded_model and encoded_model != wanted_model:
+            continue
+        positions, records, scales = groups.setdefault((dtype, offset), ([], [], []))
+        positions.append(position)
+        records.append(data)
+        scales.append(scale)
+
+    total = sum(len(positions) for positions, _, _ in groups.values())
+    matrix = out if out is not None else np.empty((total, dim), dtype=np.float32)
+    used: List[int] = []
+    row = 0
+    for (dtype, offset), (positions, records, scales) in groups.items():
+        _, np_dtype = DTYPES[dtype]
+        block = np.frombuffer(b"".join(records), dtype=np.uint8).reshape(len(records), -1)
+        target = matrix[row:row + len(positions)]
+        target[:] = block[:, offset:].view(np_dtype)
+        if dtype == "int8":
+            target *= np.asarray(scales, dtype=np.float32)[:, None]
+        used.extend(positions)
+        row += len(positions)
+    # Keep rows in input order so callers can pair them with their ids
+    if len(groups) > 1:
+        order = np.argsort(used, kind="stable")
+        matrix[:row] = matrix[:row][order]
+        used = [used[i] for i in order]
+    return used, matrix[:row]
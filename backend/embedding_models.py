@@ -0,0 +1,198 @@
+"""Pluggable face embedding models
+
+This module only depends on numpy (and the model's own library), because it
+is imported by the encoding worker processes.
+"""
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import embedding_format
+
+EMBEDDING_DIM = 128
+# Stored precision of new encodings: float32, float16 or int8, see embedding_format
+FACE_ENCODING_DTYPE = os.getenv("FACE_ENCODING_DTYPE", "float16")
+
+# (top, right, bottom, left), the face_recognition box convention
+Box = Tuple[int, int, int, int]
+
+
+class EmbeddingModel:
+    """Turns face images into fixed-size embeddings"""
+    name = ""
+    dim = EMBEDDING_DIM
+
+    def embed_images(self, paths: List[str]) -> List[Optional[np.ndarray]]:
+        """Return one embedding per image, or None where no face was found"""
+        raise NotImplementedError
+
+    def embed_faces(self, faces: Sequence[Tuple[np.ndarray, Box]]) -> np.ndarray:
+        """Embed already located faces given as (RGB image, box) pairs"""
+        raise NotImplementedError
+
+
+class FaceRecognitionModel(EmbeddingModel):
+    """dlib ResNet encodings via the face_recognition library"""
+    name = "face_recognition"
+
+    def __init__(self):
+        import face_recognition
+        self._fr = face_recognition
+
+    def embed_images(self, paths):
+        embeddings = []
+        for path in paths:
+            image = self._fr.load_image_file(path)
+            encodings = self._fr.face_encodings(image)
+            embeddings.append(encodings[0] if encodings else None)
+        return embeddings
+
+    def embed_faces(self, faces):
+        embeddings = np.empty((len(faces), self.dim), dtype=np.float32)
+        for i, (image, box) in enumerate(faces):
+            embeddings[i] = self._fr.face_encodings(image, known_face_locations=[box])[0]
+        return embeddings
+
+
+class StubEmbeddingModel(EmbeddingModel):
+    """Deterministic embeddings derived from pixel contents, for tests and benchmarks
+
+    Identical images get identical unit vectors; different images get
+    unrelated ones, which are far apart in 128 dimensions. A registered
+    image file and the same pixels arriving as a video frame embed alike.
+    """
+    name = "stub"
+
+    def _vector(self, data: bytes) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(data).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return vector / np.linalg.norm(vector)
+
+    def embed_images(self, paths):
+        embeddings = []
+        for path in paths:
+            try:
+                from PIL import Image
+                with Image.open(path) as image:
+                    data = np.asarray(image.convert("RGB")).tobytes()
+            except (ImportError, OSError):
+                with open(path, "rb") as f:
+                    data = f.read()
+            embeddings.append(self._vector(data))
+        return embeddings
+
+    def embed_faces(self, faces):
+        embeddings = np.empty((len(faces), self.dim), dtype=np.float32)
+        for i, (image, (top, right, bottom, left)) in enumerate(faces):
+            embeddings[i] = self._vector(np.ascontiguousarray(image[top:bottom, left:right]).tobytes())
+        return embeddings
+
+
+MODELS = {
+    FaceRecognitionModel.name: FaceRecognitionModel,
+    StubEmbeddingModel.name: StubEmbeddingModel,
+}
+
+_loaded: Dict[str, EmbeddingModel] = {}
+
+
+def get_model(name: str) -> EmbeddingModel:
+    """Return a loaded model, instantiating it once per process"""
+    if name not in _loaded:
+        try:
+            _loaded[name] = MODELS[name]()
+        except KeyError:
+            raise ValueError(f"Unknown embedding model {name!r}. Choose from {sorted(MODELS)}")
+    return _loaded[name]
+
+
+def load_model(name: str) -> str:
+    """Load a model in this process, failing fast if its library is missing"""
+    return get_model(name).name
+
+
+class FaceDetector:
+    """Locates faces in a decoded RGB frame"""
+    name = ""
+
+    def detect(self, image: np.ndarray) -> List[Box]:
+        raise NotImplementedError
+
+
+class FaceRecognitionDetector(FaceDetector):
+    """HOG face detector from the face_recognition library"""
+    name = "face_recognition"
+
+    def __init__(self, upsample: int = 1):
+        import face_recognition
+        self._fr = face_recognition
+        self.upsample = upsample
+
+    def detect(self, image):
+        return self._fr.face_locations(image, number_of_times_to_upsample=self.upsample)
+
+
+class WholeFrameDetector(FaceDetector):
+    """Treats every frame as a single face crop, for synthetic sources"""
+    name = "stub"
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        return [(0, width, height, 0)]
+
+
+DETECTORS = {
+    FaceRecognitionDetector.name: FaceRecognitionDetector,
+    WholeFrameDetector.name: WholeFrameDetector,
+}
+
+
+def get_detector(name: str) -> FaceDetector:
+    try:
+        return DETECTORS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown face detector {name!r}. Choose from {sorted(DETECTORS)}")
+
+
+def encode_embedding(embedding, model: Optional[str] = None, dtype: str = FACE_ENCODING_DTYPE) -> bytes:
+    """Serialize an embedding for RegisteredFace.face_encoding"""
+    return embedding_format.encode(embedding, dtype=dtype, model=model)
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    """Deserialize a RegisteredFace.face_encoding value to float32"""
+    return embedding_format.decode(data)
+
+
+def embed_batch(model_name: str, paths: List[str]) -> List[Tuple[str, Optional[bytes]]]:
+    """Embed a batch of images into (status, encoding) pairs
+
+    status is "ready", "no_face" or "failed". Runs inside encoding worker
+    processes; an unreadable image fails on its own rather than failing
+    the whole batch. Stored paths are fetched from storage as needed.
+    """
+    from storage import local_files
+
+    model = get_model(model_name)
+    with local_files(paths) as local_paths:
+        try:
+            embeddings = model.embed_images(local_paths)
+        except (OSError, ValueError):
+            embeddings = []
+            for path in local_paths:
+                try:
+                    embeddings.extend(model.embed_images([path]))
+                except (OSError, ValueError):
+                    embeddings.append(False)
+
+    results = []
+    for embedding in embeddings:
+        if embedding is False:
+            results.append(("failed", None))
+        elif embedding is None:
+            results.append(("no_face", None))
+        else:
+            results.append(("ready", encode_embedding(embedding, model=model_name)))
+    return results
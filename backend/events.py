@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Set
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+load_dotenv()
+
+# Messages buffered per connection before the oldest are dropped
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "256"))
+# Open streams allowed per API worker
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", "10000"))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+# Client reconnect delay advertised in the stream
+EVENT_RETRY_MS = 5000
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class Subscription:
+    """One open event stream with a bounded buffer
+
+    A client that cannot keep up loses the oldest buffered messages instead
+    of growing memory or slowing the publisher; it is sent a ``resync``
+    event so the dashboard refetches once rather than showing gaps.
+    """
+
+    def __init__(self, user_id: int, buffer_size: int = EVENT_BUFFER_SIZE):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+        self._overflowed = False
+
+    def offer(self, message: str) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self._overflowed = True
+        self.queue.put_nowait(message)
+
+    async def next(self, timeout: float) -> Optional[str]:
+        """Next message to send, or None when the heartbeat is due"""
+        if self._overflowed:
+            self._overflowed = False
+            return format_event("resync", {"dropped": self.dropped})
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def format_event(event_type: str, data, event_id: Optional[int] = None) -> str:
+    """Encode a Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=_json_default, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventBroker:
+    """In-process fan-out of per-user events to open streams
+
+    Publishing encodes a message once and appends it to each of the user's
+    subscriber buffers, so the cost is proportional to the events produced
+    and their listeners, not to how often dashboards would have polled.
+    Must be used from the event loop thread. Each API worker has its own
+    broker and only sees events ingested through that worker.
+    """
+
+    def __init__(self, max_subscribers: int = EVENT_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscribers: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._count = 0
+        self._next_id = 0
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        if self._count >= self.max_subscribers:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many open event streams. Try again later.",
+                headers={"Retry-After": "30"}
+            )
+        subscription = Subscription(user_id)
+        self._subscribers[user_id].add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers and subscription in subscribers:
+            subscribers.discard(subscription)
+            self._count -= 1
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id: int, event_type: str, data) -> None:
+        subscribers = self._subscribers.get(user_id)
+        if not subscribers:
+            return
+        self._next_id += 1
+        message = format_event(event_type, data, self._next_id)
+        for subscription in subscribers:
+            subscription.offer(message)
+        self.published += 1
+        self.delivered += len(subscribers)
+
+    def publish_detections(self, user_id: int, rows: Iterable[dict]) -> None:
+        """Push newly ingested detections and the matching stats delta
+
+        Only detections on the current UTC day count towards today's
+        alerts; backfilled ones are pushed without a delta.
+        """
+        if user_id not in self._subscribers:
+            return
+        rows = list(rows)
+        today = datetime.utcnow().date()
+        by_camera = defaultdict(int)
+        for row in rows:
+            if row["detected_at"].date() == today:
+                by_camera[row["camera_id"]] += 1
+        self.publish(user_id, "detections", rows)
+        if not by_camera:
+            return
+        self.publish(user_id, "stats", {
+            "alerts": sum(by_camera.values()),
+            "alerts_by_camera": [
+                {"camera_id": camera_id, "count": count}
+                for camera_id, count in sorted(by_camera.items())
+            ],
+        })
+
+    def publish_active_faces(self, user_id: int, delta: int) -> None:
+        """Push a change in the number of registered faces"""
+        if delta:
+            self.publish(user_id, "stats", {"active_faces": delta})
+
+    async def stream(self, subscription: Subscription, heartbeat: float = EVENT_HEARTBEAT_SECONDS):
+        """Yield SSE messages for a subscription until the client disconnects"""
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            while True:
+                message = await subscription.next(heartbeat)
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self._count,
+            "users": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": sum(s.dropped for subs in self._subscribers.values() for s in subs),
+        }
+
+
+event_broker = EventBroker()
@@ -0,0 +1,209 @@
+"""Streamed detection log export as CSV, Parquet or Arrow
+
+Rows are read through a server-side cursor in chunks of EXPORT_CHUNK_ROWS
+and encoded chunk by chunk, so memory stays flat however long the range.
+Parquet and Arrow need the optional pyarrow package.
+"""
+import csv
+import importlib.util
+import io
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models import Camera, RegisteredFace, DetectionLog
+
+load_dotenv()
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+EXPORT_COLUMNS = (
+    DetectionLog.id,
+    DetectionLog.detected_at,
+    DetectionLog.last_seen_at,
+    DetectionLog.hit_count,
+    DetectionLog.detection_confidence,
+    DetectionLog.camera_id,
+    Camera.camera_name,
+    DetectionLog.registered_face_id,
+    RegisteredFace.face_name,
+    DetectionLog.detection_image_path,
+)
+FIELD_NAMES = [column.key for column in EXPORT_COLUMNS]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def pyarrow_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def export_query(user_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Detections of one user in [start, end), oldest first
+
+    Bounded on (user_id, detected_at) so it is a range scan of
+    idx_detection_logs_user_detected_at and, when partitioned, only touches
+    the months in range.
+    """
+    stmt = select(*EXPORT_COLUMNS).select_from(DetectionLog).outerjoin(
+        Camera, Camera.id == DetectionLog.camera_id
+    ).outerjoin(
+        RegisteredFace, RegisteredFace.id == DetectionLog.registered_face_id
+    ).where(
+        DetectionLog.user_id == user_id
+    )
+    if start is not None:
+        stmt = stmt.where(DetectionLog.detected_at >= start)
+    if end is not None:
+        stmt = stmt.where(DetectionLog.detected_at < end)
+    return stmt.order_by(DetectionLog.detected_at, DetectionLog.id)
+
+
+async def stream_rows(
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> AsyncIterator[List[tuple]]:
+    """Yield lists of up to chunk_rows export rows
+
+    Uses its own session since it outlives the request's dependencies.
+    """
+    stmt = export_query(user_id, start, end).execution_options(yield_per=chunk_rows)
+    async with SessionLocal() as db:
+        result = await db.stream(stmt)
+        async for rows in result.partitions():
+            yield [tuple(row) for row in rows]
+
+
+class CsvEncoder:
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(FIELD_NAMES)
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def write(self, rows: List[tuple]) -> bytes:
+        self._writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            for row in rows
+        )
+        return self._drain()
+
+    def close(self) -> bytes:
+        return self._drain()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last drain
+
+    tell() keeps counting across drains because Parquet records row group
+    offsets in its footer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ArrowEncoder:
+    """Writes each chunk as one Parquet row group or Arrow IPC record batch"""
+
+    def __init__(self, file_format: str):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("detected_at", pa.timestamp("us")),
+            ("last_seen_at", pa.timestamp("us")),
+            ("hit_count", pa.int32()),
+            ("detection_confidence", pa.float64()),
+            ("camera_id", pa.int64()),
+            ("camera_name", pa.string()),
+            ("registered_face_id", pa.int64()),
+            ("face_name", pa.string()),
+            ("detection_image_path", pa.string()),
+        ])
+        self._sink = _ChunkSink()
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self._sink, self.schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def write(self, rows: List[tuple]) -> bytes:
+        columns = [list(column) for column in zip(*rows)]
+        confidence = FIELD_NAMES.index("detection_confidence")
+        columns[confidence] = [None if value is None else float(value) for value in columns[confidence]]
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self.schema))
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def get_encoder(file_format: str):
+    if file_format == "csv":
+        return CsvEncoder()
+    return ArrowEncoder(file_format)
+
+
+async def export_detections(
+    user_id: int,
+    file_format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> AsyncIterator[bytes]:
+    """Stream a user's detections in [start, end) encoded as file_format
+
+    Encoding runs in the threadpool so large chunks do not stall the loop.
+    """
+    encoder = get_encoder(file_format)
+    async for rows in stream_rows(user_id, to_naive_utc(start), to_naive_utc(end), chunk_rows):
+        data = await run_in_threadpool(encoder.write, rows)
+        if data:
+            yield data
+    data = await run_in_threadpool(encoder.close)
+    if data:
+        yield data
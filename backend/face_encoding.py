@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal
+from models import RegisteredFace
+from embedding_format import decode, model_id, parse_header
+from embedding_models import FACE_ENCODING_DTYPE, embed_batch, encode_embedding, load_model
+from face_index import FACE_EMBEDDING_MODEL, face_indexes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FACE_ENCODING_ENABLED = os.getenv("FACE_ENCODING_ENABLED", "true").lower() in ("1", "true", "yes")
+FACE_ENCODING_WORKERS = int(os.getenv("FACE_ENCODING_WORKERS", "2"))
+FACE_ENCODING_BATCH_SIZE = int(os.getenv("FACE_ENCODING_BATCH_SIZE", "32"))
+FACE_ENCODING_POLL_SECONDS = float(os.getenv("FACE_ENCODING_POLL_SECONDS", "5"))
+# Claimed jobs older than this are assumed lost (worker crashed) and retried
+STALE_PROCESSING_SECONDS = 600
+
+ENCODING_STATUSES = ("pending", "processing", "ready", "no_face", "failed")
+
+_write_encodings = update(RegisteredFace.__table__).where(
+    RegisteredFace.__table__.c.id == bindparam("face_id")
+).values(face_encoding=bindparam("face_encoding"))
+
+_write_results = update(RegisteredFace.__table__).where(
+    RegisteredFace.__table__.c.id == bindparam("face_id")
+).values(
+    face_encoding=bindparam("face_encoding"),
+    encoding_status=bindparam("encoding_status"),
+    updated_at=bindparam("updated_at"),
+)
+
+
+class FaceEncodingWorker:
+    """Computes embeddings for newly registered faces off the request path
+
+    registered_faces rows with encoding_status='pending' form the job queue.
+    Batches are claimed with an atomic UPDATE (SKIP LOCKED on PostgreSQL), so
+    several API workers can run encoders side by side. Each batch is embedded
+    in a process pool and the results are written back with one executemany.
+    """
+
+    def __init__(
+        self,
+        model_name: str = FACE_EMBEDDING_MODEL,
+        workers: int = FACE_ENCODING_WORKERS,
+        batch_size: int = FACE_ENCODING_BATCH_SIZE,
+        poll_seconds: float = FACE_ENCODING_POLL_SECONDS
+    ):
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batches = set()
+        # Why the model could not be loaded, if it could not
+        self.unavailable: Optional[str] = None
+        self.batches_done = 0
+        self.faces_done = 0
+        self.last_batch_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn avoids forking the event loop, DB connections and threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def start(self):
+        """Start the process pool and the claim loop
+
+        The model is loaded in the pool first. If that fails, e.g. because
+        face_recognition is not installed, the worker stays off and faces
+        stay pending instead of every claimed face being marked failed.
+        """
+        if self.running:
+            return
+        self._executor = self._new_executor()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, load_model, self.model_name)
+        except Exception as exc:
+            self.unavailable = f"{type(exc).__name__}: {exc}"
+            logger.error(
+                "Face encoding disabled: embedding model %r cannot be loaded (%s); new faces stay pending",
+                self.model_name, self.unavailable
+            )
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            return
+        self.unavailable = None
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        await self._requeue_stale()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            for batch in list(self._batches):
+                batch.cancel()
+            await asyncio.gather(self._task, *self._batches, return_exceptions=True)
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def notify(self):
+        """Wake the claim loop after new faces were registered"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _requeue_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=STALE_PROCESSING_SECONDS)
+        async with SessionLocal() as db:
+            await db.execute(
+                update(RegisteredFace).where(
+                    RegisteredFace.encoding_status == "processing",
+                    RegisteredFace.updated_at < cutoff
+                ).values(encoding_status="pending").execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _claim(self):
+        pending = select(RegisteredFace.id).where(
+            RegisteredFace.encoding_status == "pending"
+        ).order_by(RegisteredFace.id).limit(self.batch_size).with_for_update(skip_locked=True)
+
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(RegisteredFace).where(
+                    RegisteredFace.id.in_(pending.scalar_subquery()),
+                    RegisteredFace.encoding_status == "pending"
+                ).values(
+                    encoding_status="processing",
+                    updated_at=datetime.utcnow()
+                ).returning(
+                    RegisteredFace.id, RegisteredFace.user_id, RegisteredFace.face_image_path
+                ).execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            await db.commit()
+        return rows
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                rows = await self._claim()
+            except Exception:
+                self._slots.release()
+                logger.exception("Claiming face encoding jobs failed")
+                await asyncio.sleep(self.poll_seconds)
+                continue
+
+            if not rows:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = asyncio.create_task(self._process(rows))
+            self._batches.add(batch)
+            batch.add_done_callback(self._batches.discard)
+
+    async def _process(self, rows):
+        started = time.monotonic()
+        try:
+            with_paths = [row for row in rows if row.face_image_path]
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, embed_batch, self.model_name,
+                    [row.face_image_path for row in with_paths]
+                )
+            except asyncio.CancelledError:
+                raise
+            except BrokenProcessPool:
+                logger.exception("Face encoding process pool died, restarting it")
+                self._executor = self._new_executor()
+                results = [("failed", None)] * len(with_paths)
+            except Exception:
+                logger.exception("Embedding a batch of %d faces failed", len(with_paths))
+                results = [("failed", None)] * len(with_paths)
+
+            outcome = {row.id: result for row, result in zip(with_paths, results)}
+            now = datetime.utcnow()
+            params = [
+                {
+                    "face_id": row.id,
+                    "face_encoding": outcome.get(row.id, ("failed", None))[1],
+                    "encoding_status": outcome.get(row.id, ("failed", None))[0],
+                    "updated_at": now,
+                }
+                for row in rows
+            ]
+            async with SessionLocal() as db:
+                await db.execute(_write_results, params)
+                await db.commit()
+                await self._publish(db, rows, outcome)
+
+            self.batches_done += 1
+            self.faces_done += len(rows)
+            self.last_batch_seconds = time.monotonic() - started
+        finally:
+            self._slots.release()
+
+    async def _publish(self, db: AsyncSession, rows, outcome):
+        """Add freshly encoded faces to loaded matching indexes"""
+        ready = {row.id: row.user_id for row in rows if outcome.get(row.id, (None,))[0] == "ready"}
+        if not ready:
+            return
+        # Skip faces deleted while they were being encoded
+        existing = set((await db.scalars(
+            select(RegisteredFace.id).where(RegisteredFace.id.in_(ready))
+        )).all())
+        for face_id in existing:
+            face_indexes.add_face(ready[face_id], face_id, outcome[face_id][1])
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "model": self.model_name,
+            "unavailable": self.unavailable,
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "batches_in_flight": len(self._batches),
+            "batches_done": self.batches_done,
+            "faces_done": self.faces_done,
+            "last_batch_seconds": self.last_batch_seconds,
+        }
+
+
+async def encoding_status_counts(db: AsyncSession, user_id: int) -> dict:
+    """Number of the user's faces in each encoding status"""
+    result = await db.execute(
+        select(RegisteredFace.encoding_status, func.count(RegisteredFace.id)).where(
+            RegisteredFace.user_id == user_id
+        ).group_by(RegisteredFace.encoding_status)
+    )
+    counts = dict.fromkeys(ENCODING_STATUSES, 0)
+    for encoding_status, count in result.all():
+        counts[encoding_status or "pending"] = count
+    return counts
+
+
+async def _scan_encodings(batch_size: int):
+    """Yield batches of (id, face_encoding) rows in id order"""
+    last_id = 0
+    while True:
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(RegisteredFace.id, RegisteredFace.face_encoding).where(
+                    RegisteredFace.id > last_id,
+                    RegisteredFace.face_encoding.isnot(None)
+                ).order_by(RegisteredFace.id).limit(batch_size)
+            )).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+async def migrate_encodings(
+    dtype: str = FACE_ENCODING_DTYPE,
+    model_name: str = FACE_EMBEDDING_MODEL,
+    batch_size: int = 500
+) -> dict:
+    """Rewrite stored encodings in the current binary format and dtype
+
+    Legacy headerless encodings are tagged with ``model_name``, the model
+    that produced them. Encodings already in ``dtype`` are left alone, as
+    are ones from another model (those need re-encoding, not conversion).
+    """
+    counts = {"scanned": 0, "converted": 0, "skipped": 0}
+    wanted_model = model_id(model_name)
+    async for rows in _scan_encodings(batch_size):
+        params = []
+        for row in rows:
+            counts["scanned"] += 1
+            try:
+                info = parse_header(row.face_encoding)
+            except ValueError:
+                counts["skipped"] += 1
+                continue
+            if not info.legacy and (info.dtype == dtype or info.model_id != wanted_model):
+                continue
+            params.append({
+                "face_id": row.id,
+                "face_encoding": encode_embedding(decode(row.face_encoding), model=model_name, dtype=dtype),
+            })
+        if params:
+            async with SessionLocal() as db:
+                await db.execute(_write_encodings, params)
+                await db.commit()
+            counts["converted"] += len(params)
+    return counts
+
+
+async def queue_reencoding(
+    model_name: str = FACE_EMBEDDING_MODEL,
+    include_legacy: bool = False,
+    batch_size: int = 500
+) -> int:
+    """Queue faces encoded by another model for the encoding worker
+
+    Matching skips those encodings until the worker has replaced them.
+    Legacy encodings carry no model id and are only queued on request.
+    """
+    wanted_model = model_id(model_name)
+    queued = 0
+    async for rows in _scan_encodings(batch_size):
+        stale = []
+        for row in rows:
+            try:
+                info = parse_header(row.face_encoding)
+            except ValueError:
+                stale.append(row.id)
+                continue
+            if info.model_id != wanted_model and (info.model_id or include_legacy):
+                stale.append(row.id)
+        if stale:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(RegisteredFace).where(RegisteredFace.id.in_(stale)).values(
+                        encoding_status="pending", updated_at=datetime.utcnow()
+                    ).execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            queued += len(stale)
+    return queued
+
+
+face_encoder = FaceEncodingWorker()
+
+
+if __name__ == "__main__":
+    import argparse
+    from embedding_format import DTYPES
+
+    parser = argparse.ArgumentParser(description="Maintain stored face encodings")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="convert encodings to the current format and dtype")
+    migrate.add_argument("--dtype", choices=sorted(DTYPES), default=FACE_ENCODING_DTYPE)
+    reencode = commands.add_parser("reencode", help="queue faces encoded by another model")
+    reencode.add_argument("--include-legacy", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(asyncio.run(migrate_encodings(dtype=args.dtype)))
+    else:
+        print(f"Queued {asyncio.run(queue_reencoding(include_legacy=args.include_legacy))} faces")
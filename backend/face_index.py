@@ -0,0 +1,240 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import RegisteredFace
+from embedding_models import EMBEDDING_DIM
+from embedding_format import decode_many
+
+load_dotenv()
+
+# Model whose embeddings are matched; encodings from another model are
+# ignored until they are re-encoded (python -m face_encoding reencode)
+FACE_EMBEDDING_MODEL = os.getenv("FACE_EMBEDDING_MODEL", "face_recognition")
+
+# face_recognition treats a euclidean distance of 0.6 or less between two
+# encodings as the same person
+DEFAULT_TOLERANCE = 0.6
+
+
+@dataclass(frozen=True)
+class FaceMatch:
+    face_id: int
+    distance: float
+
+
+class FaceIndex:
+    """Contiguous float32 matrix of one user's active face encodings
+
+    Rows are kept packed: removing a face moves the last row into its slot,
+    so matching is always a single matrix product over ``[:size]``.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, capacity: int = 64):
+        self.dim = dim
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._face_ids = np.empty(capacity, dtype=np.int64)
+        self._positions: Dict[int, int] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[Tuple[int, bytes]],
+        dim: int = EMBEDDING_DIM,
+        model: Optional[str] = None
+    ) -> "FaceIndex":
+        """Build an index from (face_id, face_encoding) rows
+
+        All encodings are decoded straight into the index matrix in one
+        vectorized pass, see embedding_format.decode_many.
+        """
+        rows = [(face_id, data) for face_id, data in rows if data]
+        index = cls(dim=dim, capacity=max(64, len(rows)))
+        used, _ = decode_many([data for _, data in rows], dim, model=model, out=index._vectors)
+        for pos, row in enumerate(used):
+            face_id = rows[row][0]
+            index._face_ids[pos] = face_id
+            index._positions[face_id] = pos
+        index._size = size = len(used)
+        index._sq_norms[:size] = np.einsum("ij,ij->i", index._vectors[:size], index._vectors[:size])
+        return index
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, face_id: int) -> bool:
+        return face_id in self._positions
+
+    def _grow(self):
+        capacity = self._vectors.shape[0] * 2
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        face_ids = np.empty(capacity, dtype=np.int64)
+        vectors[:self._size] = self._vectors[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        face_ids[:self._size] = self._face_ids[:self._size]
+        self._vectors, self._sq_norms, self._face_ids = vectors, sq_norms, face_ids
+
+    def add(self, face_id: int, embedding) -> None:
+        """Insert or replace the encoding for a face"""
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d embedding, got {vector.shape[0]}")
+
+        with self._lock:
+            pos = self._positions.get(face_id)
+            if pos is None:
+                if self._size == self._vectors.shape[0]:
+                    self._grow()
+                pos = self._size
+                self._size += 1
+                self._positions[face_id] = pos
+                self._face_ids[pos] = face_id
+            self._vectors[pos] = vector
+            self._sq_norms[pos] = float(vector @ vector)
+
+    def remove(self, face_id: int) -> bool:
+        """Drop a face from the index, returning whether it was present"""
+        with self._lock:
+            pos = self._positions.pop(face_id, None)
+            if pos is None:
+                return False
+            last = self._size - 1
+            if pos != last:
+                moved_id = int(self._face_ids[last])
+                self._vectors[pos] = self._vectors[last]
+                self._sq_norms[pos] = self._sq_norms[last]
+                self._face_ids[pos] = moved_id
+                self._positions[moved_id] = pos
+            self._size = last
+            return True
+
+    def distances(self, probes) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (face_ids, distance matrix) for a batch of probe embeddings
+
+        Uses ||p - f||^2 = ||p||^2 + ||f||^2 - 2 p.f so the whole batch is one
+        matrix product against the packed encodings.
+        """
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        if probes.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d probes, got {probes.shape[1]}")
+
+        with self._lock:
+            size = self._size
+            face_ids = self._face_ids[:size].copy()
+            if size == 0:
+                return face_ids, np.empty((probes.shape[0], 0), dtype=np.float32)
+            sq = probes @ self._vectors[:size].T
+            sq *= -2.0
+            sq += self._sq_norms[:size]
+
+        sq += np.einsum("ij,ij->i", probes, probes)[:, None]
+        np.maximum(sq, 0.0, out=sq)
+        return face_ids, np.sqrt(sq, out=sq)
+
+    def match(self, probes, tolerance: float = DEFAULT_TOLERANCE) -> List[Optional[FaceMatch]]:
+        """Find the closest registered face for each probe embedding"""
+        face_ids, dist = self.distances(probes)
+        if dist.shape[1] == 0:
+            return [None] * dist.shape[0]
+
+        best = dist.argmin(axis=1)
+        best_dist = dist[np.arange(dist.shape[0]), best]
+        return [
+            FaceMatch(face_id=int(face_ids[col]), distance=float(d)) if d <= tolerance else None
+            for col, d in zip(best, best_dist)
+        ]
+
+
+class FaceIndexRegistry:
+    """Lazily loaded FaceIndex per user_id, kept in sync by the /faces endpoints"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, model: Optional[str] = FACE_EMBEDDING_MODEL):
+        self.dim = dim
+        self.model = model
+        self._indexes: Dict[int, FaceIndex] = {}
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _bump(self, user_id: int):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    async def get(self, db: AsyncSession, user_id: int) -> FaceIndex:
+        """Return the user's index, loading it from the database on first use"""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            version = self._versions.get(user_id, 0)
+        if index is not None:
+            return index
+
+        result = await db.execute(
+            select(RegisteredFace.id, RegisteredFace.face_encoding).where(
+                RegisteredFace.user_id == user_id,
+                RegisteredFace.is_active == True,
+                RegisteredFace.face_encoding.isnot(None)
+            )
+        )
+        rows = result.all()
+        index = FaceIndex.from_rows(rows, dim=self.dim, model=self.model)
+
+        with self._lock:
+            # Only cache the load if no face was added or removed meanwhile,
+            # otherwise the next call reloads a consistent snapshot
+            if self._versions.get(user_id, 0) == version:
+                index = self._indexes.setdefault(user_id, index)
+        return index
+
+    def loaded(self, user_id: int) -> Optional[FaceIndex]:
+        """Return the user's index if it is already in memory"""
+        with self._lock:
+            return self._indexes.get(user_id)
+
+    def add_face(self, user_id: int, face_id: int, encoding: Optional[bytes]) -> None:
+        """Add a newly registered face to a loaded index"""
+        if not encoding:
+            return
+        with self._lock:
+            self._bump(user_id)
+            index = self._indexes.get(user_id)
+        if index is None:
+            return
+        used, vectors = decode_many([encoding], self.dim, model=self.model)
+        if used:
+            index.add(face_id, vectors[0])
+
+    def remove_face(self, user_id: int, face_id: int) -> None:
+        """Remove a deleted or deactivated face from a loaded index"""
+        with self._lock:
+            self._bump(user_id)
+            index = self._indexes.get(user_id)
+        if index is not None:
+            index.remove(face_id)
+
+    def invalidate(self, user_id: int) -> None:
+        """Forget a user's index so it is reloaded on next use"""
+        with self._lock:
+            self._bump(user_id)
+            self._indexes.pop(user_id, None)
+
+    async def match(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        probes,
+        tolerance: float = DEFAULT_TOLERANCE
+    ) -> List[Optional[FaceMatch]]:
+        """Match all probe embeddings from one frame against the user's faces"""
+        index = await self.get(db, user_id)
+        return index.match(probes, tolerance=tolerance)
+
+
+face_indexes = FaceIndexRegistry()
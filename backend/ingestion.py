@@ -0,0 +1,193 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, FrozenSet, List, Optional, Sequence
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Camera, RegisteredFace, DetectionLog, VisitorCluster
+from stats import dashboard_stats
+from events import event_broker
+from detection_dedup import detection_dedup, naive_utc
+
+MAX_BATCH_SIZE = 5000
+OWNERSHIP_TTL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class _Ownership:
+    camera_ids: FrozenSet[int]
+    face_ids: FrozenSet[int]
+    loaded_at: float
+    # When a reload was last forced by an unknown id
+    refreshed_at: float
+
+
+class OwnershipCache:
+    """Per-user sets of camera and registered face ids used to validate events"""
+
+    def __init__(self, ttl: float = OWNERSHIP_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries: Dict[int, _Ownership] = {}
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, user_id: int, refresh: bool = False) -> _Ownership:
+        """Return the user's owned ids, loading them if missing, stale or forced
+
+        A forced reload runs at most once per ttl per user, so batches that
+        keep referencing unknown ids cannot query the database every time.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+        refreshed_at = float("-inf")
+        if entry is not None:
+            refreshed_at = entry.refreshed_at
+            if refresh and now - refreshed_at < self.ttl:
+                refresh = False
+            if not refresh and now - entry.loaded_at < self.ttl:
+                return entry
+        if refresh:
+            refreshed_at = now
+
+        camera_ids = frozenset(
+            (await db.scalars(select(Camera.id).where(Camera.user_id == user_id))).all()
+        )
+        face_ids = frozenset(
+            (await db.scalars(select(RegisteredFace.id).where(RegisteredFace.user_id == user_id))).all()
+        )
+        entry = _Ownership(camera_ids=camera_ids, face_ids=face_ids, loaded_at=now, refreshed_at=refreshed_at)
+        with self._lock:
+            self._entries[user_id] = entry
+        return entry
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop a user's entry after a camera or face is created or deleted"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+ownership_cache = OwnershipCache()
+
+
+class UnknownReferences(LookupError):
+    """A batch references cameras, faces or visitor clusters the user does not own"""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(f"{len(errors)} detection events reference unknown ids")
+        self.errors = errors
+
+
+@dataclass
+class IngestResult:
+    accepted: int = 0
+    # Accepted events folded into an already recorded detection
+    merged: int = 0
+    rows: List[dict] = field(default_factory=list)
+
+
+def _validate(events: Sequence, ownership: _Ownership, cluster_ids: FrozenSet[int]) -> List[Optional[str]]:
+    problems = []
+    for event in events:
+        cluster_id = event.visitor_cluster_id
+        if event.camera_id not in ownership.camera_ids:
+            problems.append(f"Unknown camera_id {event.camera_id}")
+        elif event.registered_face_id is not None and event.registered_face_id not in ownership.face_ids:
+            problems.append(f"Unknown registered_face_id {event.registered_face_id}")
+        elif cluster_id is not None and (event.registered_face_id is not None or cluster_id not in cluster_ids):
+            problems.append(f"Unknown visitor_cluster_id {cluster_id}")
+        else:
+            problems.append(None)
+    return problems
+
+
+async def _owned_clusters(db: AsyncSession, user_id: int, events: Sequence) -> FrozenSet[int]:
+    """Which of the visitor clusters the events reference belong to the user
+
+    Clusters are created continuously, so they are looked up per batch
+    rather than kept in the ownership cache.
+    """
+    wanted = {event.visitor_cluster_id for event in events if event.visitor_cluster_id is not None}
+    if not wanted:
+        return frozenset()
+    return frozenset((await db.scalars(
+        select(VisitorCluster.id).where(VisitorCluster.user_id == user_id, VisitorCluster.id.in_(wanted))
+    )).all())
+
+
+async def ingest_detections(
+    db: AsyncSession,
+    user_id: int,
+    events: Sequence,
+    dedup: bool = True
+) -> IngestResult:
+    """Validate a batch of detection events and write them with one multi-row insert
+
+    ``events`` are DetectionCreate-like objects. If any event references a
+    camera, face or visitor cluster the user does not own, nothing is written
+    and UnknownReferences lists the offending events. Before that, the
+    ownership cache is reloaded (at most once per ttl, see OwnershipCache.get)
+    so ids created moments ago in another worker are still accepted. With
+    ``dedup``, repeat sightings are merged by detection_dedup and only new
+    detections are inserted.
+    """
+    result = IngestResult()
+    if not events:
+        return result
+
+    cluster_ids = await _owned_clusters(db, user_id, events)
+    problems = _validate(events, await ownership_cache.get(db, user_id), cluster_ids)
+    if any(problems):
+        problems = _validate(events, await ownership_cache.get(db, user_id, refresh=True), cluster_ids)
+
+    errors = [{"index": index, "detail": problem} for index, problem in enumerate(problems) if problem]
+    if errors:
+        raise UnknownReferences(errors)
+
+    now = datetime.utcnow()
+    valid = list(events)
+    result.accepted = len(valid)
+
+    episodes = []
+    if dedup and detection_dedup.enabled:
+        episodes = detection_dedup.absorb(user_id, valid, now)
+        result.rows = [episode.as_row(now) for episode in episodes]
+    else:
+        # Every row carries the same keys so the driver can batch them
+        # into multi-row INSERT statements
+        result.rows = [
+            {
+                "user_id": user_id,
+                "camera_id": event.camera_id,
+                "registered_face_id": event.registered_face_id,
+                "visitor_cluster_id": event.visitor_cluster_id,
+                "detection_confidence": event.detection_confidence,
+                "detection_image_path": event.detection_image_path,
+                "detected_at": naive_utc(event.detected_at or now),
+                "last_seen_at": naive_utc(event.detected_at or now),
+                "hit_count": 1,
+                "created_at": now,
+            }
+            for event in valid
+        ]
+    result.merged = result.accepted - len(result.rows)
+
+    if result.rows:
+        try:
+            inserted = await db.execute(
+                insert(DetectionLog).returning(DetectionLog.id, sort_by_parameter_order=True),
+                result.rows
+            )
+            detection_ids = inserted.scalars().all()
+            await db.commit()
+        except BaseException:
+            detection_dedup.forget(episodes)
+            raise
+        for row, detection_id in zip(result.rows, detection_ids):
+            row["id"] = detection_id
+        detection_dedup.bind(episodes, detection_ids)
+        dashboard_stats.record_detections(user_id, result.rows)
+        event_broker.publish_detections(user_id, result.rows)
+    return result
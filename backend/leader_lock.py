@@ -0,0 +1,72 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database import engine, IS_SQLITE
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """Session-level PostgreSQL advisory lock held on its own connection
+
+    Lets exactly one API worker run a background job that would otherwise
+    run once per worker. ``shard`` is the lock's second key, so each shard
+    of a job has its own holder. SQLite databases are single-process, so
+    the lock is always granted there.
+    """
+
+    def __init__(self, key: int, shard: int = 0):
+        self.key = key
+        self.shard = shard
+        self._conn: Optional[AsyncConnection] = None
+        self._held = False
+
+    @property
+    def held(self) -> bool:
+        return self._held
+
+    async def acquire(self) -> bool:
+        """Try to take the lock without waiting"""
+        if self._held:
+            return True
+        if IS_SQLITE:
+            self._held = True
+            return True
+        conn = await engine.connect()
+        try:
+            locked = await conn.scalar(
+                text("SELECT pg_try_advisory_lock(:key, :shard)"), {"key": self.key, "shard": self.shard}
+            )
+            await conn.commit()
+        except BaseException:
+            await conn.close()
+            raise
+        if not locked:
+            await conn.close()
+            return False
+        self._conn, self._held = conn, True
+        return True
+
+    async def check(self) -> None:
+        """Raise if the connection holding the lock was lost"""
+        if self._conn is not None:
+            await self._conn.scalar(text("SELECT 1"))
+            await self._conn.commit()
+
+    async def release(self) -> None:
+        conn, self._conn, self._held = self._conn, None, False
+        if conn is None:
+            return
+        try:
+            await conn.execute(
+                text("SELECT pg_advisory_unlock(:key, :shard)"), {"key": self.key, "shard": self.shard}
+            )
+            await conn.commit()
+        except Exception:
+            # A broken connection is discarded, which releases the lock
+            logger.warning("Releasing advisory lock %#x/%d failed", self.key, self.shard, exc_info=True)
+        finally:
+            await conn.close()
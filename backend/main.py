@@ -1,29 +1,63 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form
+from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Query, Request, Response, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session, joinedload
-import uvicorn
-from typing import Optional, List
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List, Literal
+from datetime import datetime, timedelta
+from functools import partial
+import math
 import os
 
-from database import get_db, engine, Base
-from models import User, Camera, RegisteredFace, DetectionLog, Package, UserSession
+from database import get_db, SessionLocal
+from models import User, Camera, RegisteredFace, DetectionLog, Package, VisitorCluster
 from schemas import (
     UserCreate, UserLogin, UserResponse, 
     CameraCreate, CameraResponse, CameraUpdate,
-    FaceCreate, FaceResponse,
-    DetectionLogResponse,
+    FaceCreate, FaceResponse, FaceBulkItem, FaceBulkResponse,
+    DetectionLogResponse, DetectionBatchCreate, DetectionBatchResponse,
     PackageResponse,
     Token
 )
 from auth import (
-    create_access_token, verify_token, get_password_hash, 
-    verify_password, get_current_user
+    create_access_token, verify_token, get_password_hash_async,
+    verify_password_async, get_current_user, authenticate_token, password_hash_pool,
+    ACCESS_TOKEN_EXPIRE_MINUTES
+)
+from user_cache import UserSnapshot, user_cache
+from face_index import face_indexes, FACE_EMBEDDING_MODEL
+from embedding_models import decode_embedding, encode_embedding
+from ingestion import ingest_detections, ownership_cache, UnknownReferences, MAX_BATCH_SIZE
+from detection_dedup import detection_dedup
+from pagination import get_detection_page, InvalidCursor, MAX_PAGE_SIZE
+from analytics import (
+    analytics_cache, resolve_range, detections_over_time, detections_by_camera,
+    detections_by_face, unknown_visitors, confidence_histogram
+)
+from export import export_detections, pyarrow_available, to_naive_utc, MEDIA_TYPES
+from stats import dashboard_stats
+from events import event_broker
+from camera_health import camera_health, ProbeRateLimited, CAMERA_HEALTH_ENABLED
+from recognition_pipeline import recognition_pipeline, RECOGNITION_ENABLED
+from visitor_clusters import visitor_clusters
+from face_encoding import face_encoder, encoding_status_counts, FACE_ENCODING_ENABLED
+from retention import retention_job, RETENTION_ENABLED
+from storage import serve_object
+from sessions import session_store, new_session, STREAM_TICKET_SECONDS
+from catalog import package_catalog
+from responses import FastJSONResponse
+from migrate import migrate, MIGRATE_ON_STARTUP
+from metrics import (
+    MetricsMiddleware, loop_lag_monitor, register_stats, tag_request, render as render_metrics,
+    token_matches as metrics_token_matches, warn_if_unprotected,
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_ENABLED
+)
+from uploads import (
+    save_upload, save_archive_entry, open_archive, face_name_from_path,
+    generate_thumbnail, remove_face_image, MAX_BULK_FACES
 )
-
-# Create database tables
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="AI Face Recognition API",
@@ -31,6 +65,90 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Schema changes are applied once per deploy with "python -m migrate";
+# workers only run them at startup when MIGRATE_ON_STARTUP is set
+@app.on_event("startup")
+async def run_migrations():
+    if MIGRATE_ON_STARTUP:
+        await migrate()
+
+# Background face encoding
+@app.on_event("startup")
+async def start_face_encoder():
+    if FACE_ENCODING_ENABLED:
+        await face_encoder.start()
+
+@app.on_event("shutdown")
+async def stop_face_encoder():
+    await face_encoder.stop()
+
+# Camera health monitoring
+@app.on_event("startup")
+async def start_camera_health():
+    if CAMERA_HEALTH_ENABLED:
+        await camera_health.start()
+
+@app.on_event("shutdown")
+async def stop_camera_health():
+    await camera_health.stop()
+
+# Live recognition from IP camera streams, in one worker per shard
+@app.on_event("startup")
+async def start_recognition():
+    if RECOGNITION_ENABLED:
+        await recognition_pipeline.start_streaming()
+
+@app.on_event("shutdown")
+async def stop_recognition():
+    await recognition_pipeline.stop_streaming()
+
+# Merged detection write-back
+@app.on_event("startup")
+async def start_detection_dedup():
+    await detection_dedup.start()
+
+@app.on_event("shutdown")
+async def stop_detection_dedup():
+    await detection_dedup.stop()
+
+# Visitor cluster write-back
+@app.on_event("startup")
+async def start_visitor_clusters():
+    await visitor_clusters.start()
+
+@app.on_event("shutdown")
+async def stop_visitor_clusters():
+    await visitor_clusters.stop()
+
+# Detection log partitions and retention
+@app.on_event("startup")
+async def start_retention():
+    if RETENTION_ENABLED:
+        await retention_job.start()
+
+@app.on_event("shutdown")
+async def stop_retention():
+    await retention_job.stop()
+
+# Session revocation set and expired session sweeping
+@app.on_event("startup")
+async def start_session_store():
+    await session_store.start()
+
+@app.on_event("shutdown")
+async def stop_session_store():
+    await session_store.stop()
+
+# Event loop lag sampling for /metrics
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    warn_if_unprotected()
+    await loop_lag_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_lag_monitor():
+    await loop_lag_monitor.stop()
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -38,22 +156,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Create uploads directory if it doesn't exist
-os.makedirs("uploads/faces", exist_ok=True)
-os.makedirs("uploads/detections", exist_ok=True)
+# Per-route latency and SQL usage; added last so it also times CORS handling
+app.add_middleware(MetricsMiddleware)
+
+for name, component in {
+    "event_broker": event_broker,
+    "camera_health": camera_health,
+    "recognition_pipeline": recognition_pipeline,
+    "detection_dedup": detection_dedup,
+    "visitor_clusters": visitor_clusters,
+    "face_encoder": face_encoder,
+    "password_hash_pool": password_hash_pool,
+    "user_cache": user_cache,
+    "package_catalog": package_catalog,
+    "analytics_cache": analytics_cache,
+    "retention_job": retention_job,
+    "session_store": session_store,
+}.items():
+    register_stats(name, component.stats)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    if not metrics_token_matches(request.headers.get("authorization")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
-# Mount static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Uploaded images, served from storage.py with caching and range support
+@app.api_route("/uploads/{key:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_upload(key: str, request: Request):
+    return await serve_object(key, request)
 
 security = HTTPBearer()
 
 # Authentication endpoints
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if user already exists
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -61,12 +209,12 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Hash password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     
     # Get package
-    package = db.query(Package).filter(Package.name.ilike(user.selected_package)).first()
+    package = await db.scalar(select(Package).where(Package.name.ilike(user.selected_package)))
     if not package:
-        package = db.query(Package).filter(Package.name == "Standard").first()
+        package = await db.scalar(select(Package).where(Package.name == "Standard"))
     
     # Create new user
     db_user = User(
@@ -74,80 +222,109 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         full_name=user.full_name,
         phone_number=user.phone_number,
         password_hash=hashed_password,
-        package_id=package.id if package else None
+        package=package
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     
-    return db_user
+    return UserSnapshot.from_model(db_user)
 
 @app.post("/auth/login", response_model=Token)
-async def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
     # Authenticate user
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
+    if not db_user or not await verify_password_async(user.password, db_user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
-    # Create access token
-    access_token = create_access_token(data={"sub": db_user.email})
-    
-    # Store session
-    from datetime import datetime, timedelta
-    expires_at = datetime.utcnow() + timedelta(days=30)  # 30 days expiry
-    
-    session = UserSession(
-        user_id=db_user.id,
-        session_token=access_token,
-        expires_at=expires_at
-    )
+    # Store the session, then issue a token carrying its jti
+    expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    session = new_session(db_user.id, expires_delta)
     db.add(session)
-    db.commit()
+    await db.commit()
     
+    access_token = create_access_token(
+        data={"sub": db_user.email, "jti": session.jti},
+        expires_delta=expires_delta
+    )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/auth/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+):
+    current_user = await authenticate_token(credentials.credentials, db)
+    payload = verify_token(credentials.credentials)
+    # Tokens issued before sessions were keyed by jti cannot be revoked one
+    # by one; never fall back to ending every session
+    if not payload.get("jti"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This token has no session id and cannot be revoked; it expires on its own"
+        )
+    await session_store.revoke(
+        db, current_user.id, jti=payload["jti"],
+        expires_at=datetime.utcfromtimestamp(payload["exp"])
+    )
+    return {"message": "Logged out successfully"}
+
+@app.post("/auth/logout-all")
+async def logout_all_sessions(
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    revoked = await session_store.revoke_all(db, current_user.id)
+    return {"message": "All sessions revoked", "revoked": revoked}
+
 @app.get("/auth/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: UserSnapshot = Depends(get_current_user)):
     return current_user
 
 # Package endpoints
+# Served from the in-process catalog cache with an ETag
 @app.get("/packages", response_model=List[PackageResponse])
-async def get_packages(db: Session = Depends(get_db)):
-    packages = db.query(Package).all()
-    return packages
+async def get_packages(request: Request):
+    return await package_catalog.respond(request)
 
 # Camera endpoints
-@app.get("/cameras", response_model=List[CameraResponse])
+@app.get("/cameras", response_model=List[CameraResponse], response_class=FastJSONResponse)
 async def get_cameras(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    cameras = db.query(Camera).filter(Camera.user_id == current_user.id).all()
+    cameras = (await db.scalars(select(Camera).where(Camera.user_id == current_user.id))).all()
     return cameras
 
 @app.post("/cameras", response_model=CameraResponse)
 async def create_camera(
     camera: CameraCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     # Check camera limit based on package
-    user_cameras = db.query(Camera).filter(Camera.user_id == current_user.id).count()
+    user_cameras = await db.scalar(
+        select(func.count(Camera.id)).where(Camera.user_id == current_user.id)
+    )
     if current_user.package and current_user.package.camera_limit != -1:
         if user_cameras >= current_user.package.camera_limit:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Camera limit reached. Your package allows {current_user.package.camera_limit} cameras."
             )
+    if camera.ip_address and not camera_health.allows(camera.ip_address):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Camera ip_address must be a routable IP address"
+        )
     
     # Hash camera password if provided
     password_hash = None
     if camera.password:
-        password_hash = get_password_hash(camera.password)
+        password_hash = await get_password_hash_async(camera.password)
     
     db_camera = Camera(
         user_id=current_user.id,
@@ -162,8 +339,14 @@ async def create_camera(
     )
     
     db.add(db_camera)
-    db.commit()
-    db.refresh(db_camera)
+    await db.commit()
+    await db.refresh(db_camera)
+    
+    ownership_cache.invalidate(current_user.id)
+    camera_health.track(db_camera)
+    if recognition_pipeline.running:
+        recognition_pipeline.track_camera(db_camera)
+    analytics_cache.invalidate_user(current_user.id)
     
     return db_camera
 
@@ -171,13 +354,15 @@ async def create_camera(
 async def update_camera(
     camera_id: int,
     camera: CameraUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    db_camera = db.query(Camera).filter(
-        Camera.id == camera_id,
-        Camera.user_id == current_user.id
-    ).first()
+    db_camera = await db.scalar(
+        select(Camera).where(
+            Camera.id == camera_id,
+            Camera.user_id == current_user.id
+        )
+    )
     
     if not db_camera:
         raise HTTPException(
@@ -185,28 +370,42 @@ async def update_camera(
             detail="Camera not found"
         )
     
+    if camera.ip_address and not camera_health.allows(camera.ip_address):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Camera ip_address must be a routable IP address"
+        )
+    
     # Update camera fields
     for field, value in camera.dict(exclude_unset=True).items():
         if field == "password" and value:
-            setattr(db_camera, "password_hash", get_password_hash(value))
+            setattr(db_camera, "password_hash", await get_password_hash_async(value))
         else:
             setattr(db_camera, field, value)
     
-    db.commit()
-    db.refresh(db_camera)
+    await db.commit()
+    await db.refresh(db_camera)
+    
+    camera_health.track(db_camera)
+    if recognition_pipeline.running:
+        recognition_pipeline.track_camera(db_camera)
+    # Cached analytics carry camera names
+    analytics_cache.invalidate_user(current_user.id)
     
     return db_camera
 
 @app.delete("/cameras/{camera_id}")
 async def delete_camera(
     camera_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    db_camera = db.query(Camera).filter(
-        Camera.id == camera_id,
-        Camera.user_id == current_user.id
-    ).first()
+    db_camera = await db.scalar(
+        select(Camera).where(
+            Camera.id == camera_id,
+            Camera.user_id == current_user.id
+        )
+    )
     
     if not db_camera:
         raise HTTPException(
@@ -214,29 +413,41 @@ async def delete_camera(
             detail="Camera not found"
         )
     
-    db.delete(db_camera)
-    db.commit()
+    await db.delete(db_camera)
+    await db.commit()
+    
+    # The camera's detection logs are deleted with it
+    ownership_cache.invalidate(current_user.id)
+    dashboard_stats.invalidate(current_user.id)
+    analytics_cache.invalidate_user(current_user.id)
+    camera_health.forget(camera_id)
+    recognition_pipeline.remove_source(camera_id)
     
     return {"message": "Camera deleted successfully"}
 
 # Face endpoints
-@app.get("/faces", response_model=List[FaceResponse])
+@app.get("/faces", response_model=List[FaceResponse], response_class=FastJSONResponse)
 async def get_faces(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    faces = db.query(RegisteredFace).filter(RegisteredFace.user_id == current_user.id).all()
+    faces = (await db.scalars(
+        select(RegisteredFace).where(RegisteredFace.user_id == current_user.id)
+    )).all()
     return faces
 
 @app.post("/faces", response_model=FaceResponse)
 async def create_face(
+    background_tasks: BackgroundTasks,
     face_name: str = Form(...),
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     # Check face limit based on package
-    user_faces = db.query(RegisteredFace).filter(RegisteredFace.user_id == current_user.id).count()
+    user_faces = await db.scalar(
+        select(func.count(RegisteredFace.id)).where(RegisteredFace.user_id == current_user.id)
+    )
     if current_user.package and current_user.package.max_registered_faces != -1:
         if user_faces >= current_user.package.max_registered_faces:
             raise HTTPException(
@@ -244,36 +455,153 @@ async def create_face(
                 detail=f"Face limit reached. Your package allows {current_user.package.max_registered_faces} faces."
             )
     
-    # Save uploaded file
-    file_path = f"uploads/faces/{current_user.id}_{face_name}_{file.filename}"
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    # TODO: Process face encoding here using face_recognition library
+    # Stream the upload to disk under its content hash
+    saved = await save_upload(file)
     
+    # The encoding is computed in the background by face_encoder
     db_face = RegisteredFace(
         user_id=current_user.id,
         face_name=face_name,
-        face_image_path=file_path
+        face_image_path=saved.path
     )
     
     db.add(db_face)
-    db.commit()
-    db.refresh(db_face)
+    await db.commit()
+    await db.refresh(db_face)
+    
+    face_encoder.notify()
+    ownership_cache.invalidate(current_user.id)
+    dashboard_stats.adjust_active_faces(current_user.id, 1)
+    event_broker.publish_active_faces(current_user.id, 1)
+    background_tasks.add_task(generate_thumbnail, saved.path)
     
     return db_face
 
+@app.post("/faces/bulk", response_model=FaceBulkResponse)
+async def create_faces_bulk(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(None),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Register many faces from image files and/or a ZIP archive
+
+    Faces are named after the entry's folder (``Alice/01.jpg``) or, for
+    top-level entries, the file name. The quota is checked once and all rows
+    are inserted in a single transaction; per-item results are returned.
+    """
+    if not files and archive is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload image files or a ZIP archive"
+        )
+    
+    # Each item is (filename, face_name, coroutine factory that saves it)
+    items = [
+        (file.filename or "", face_name_from_path(file.filename or ""),
+         lambda file=file: save_upload(file))
+        for file in files
+    ]
+    zip_file = None
+    if archive is not None:
+        await archive.seek(0)
+        zip_file, entries = await run_in_threadpool(open_archive, archive.file)
+        items.extend(
+            (info.filename, face_name_from_path(info.filename),
+             lambda info=info: run_in_threadpool(save_archive_entry, zip_file, info))
+            for info in entries
+        )
+    if len(items) > MAX_BULK_FACES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many images. Upload at most {MAX_BULK_FACES} per request."
+        )
+    
+    # Check the face limit once for the whole batch
+    remaining = None
+    if current_user.package and current_user.package.max_registered_faces != -1:
+        user_faces = await db.scalar(
+            select(func.count(RegisteredFace.id)).where(RegisteredFace.user_id == current_user.id)
+        )
+        remaining = max(0, current_user.package.max_registered_faces - user_faces)
+    
+    results = []
+    created = []
+    for filename, face_name, save in items:
+        if remaining is not None and len(created) >= remaining:
+            results.append(FaceBulkItem(
+                filename=filename, face_name=face_name, status="rejected",
+                detail=f"Face limit reached. Your package allows {current_user.package.max_registered_faces} faces."
+            ))
+            continue
+        if not face_name:
+            results.append(FaceBulkItem(
+                filename=filename, face_name=face_name, status="rejected",
+                detail="Could not derive a face name from the file name"
+            ))
+            continue
+        try:
+            saved = await save()
+        except HTTPException as exc:
+            results.append(FaceBulkItem(
+                filename=filename, face_name=face_name, status="rejected", detail=exc.detail
+            ))
+            continue
+        db_face = RegisteredFace(
+            user_id=current_user.id,
+            face_name=face_name[:255],
+            face_image_path=saved.path
+        )
+        created.append(db_face)
+        results.append(FaceBulkItem(filename=filename, face_name=face_name, status="created"))
+    if zip_file is not None:
+        zip_file.close()
+    
+    if created:
+        db.add_all(created)
+        await db.commit()
+        
+        face_encoder.notify()
+        ownership_cache.invalidate(current_user.id)
+        dashboard_stats.adjust_active_faces(current_user.id, len(created))
+        event_broker.publish_active_faces(current_user.id, len(created))
+        for path in {face.face_image_path for face in created}:
+            background_tasks.add_task(generate_thumbnail, path)
+    
+    faces = iter(created)
+    for result in results:
+        if result.status == "created":
+            result.face = FaceResponse.model_validate(next(faces))
+    
+    return FaceBulkResponse(
+        created=len(created),
+        rejected=len(results) - len(created),
+        results=results
+    )
+
+@app.get("/faces/encoding-status")
+async def get_face_encoding_status(
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return {
+        "faces": await encoding_status_counts(db, current_user.id),
+        "worker": face_encoder.stats()
+    }
+
 @app.delete("/faces/{face_id}")
 async def delete_face(
     face_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    db_face = db.query(RegisteredFace).filter(
-        RegisteredFace.id == face_id,
-        RegisteredFace.user_id == current_user.id
-    ).first()
+    db_face = await db.scalar(
+        select(RegisteredFace).where(
+            RegisteredFace.id == face_id,
+            RegisteredFace.user_id == current_user.id
+        )
+    )
     
     if not db_face:
         raise HTTPException(
@@ -281,95 +609,360 @@ async def delete_face(
             detail="Face not found"
         )
     
-    # Delete image file
-    if db_face.face_image_path and os.path.exists(db_face.face_image_path):
-        os.remove(db_face.face_image_path)
+    image_path = db_face.face_image_path
+    was_active = db_face.is_active
+    await db.delete(db_face)
+    await db.commit()
+    
+    # Identical uploads share one file, so only delete it once unreferenced
+    if image_path:
+        still_used = await db.scalar(
+            select(RegisteredFace.id).where(RegisteredFace.face_image_path == image_path).limit(1)
+        )
+        if still_used is None:
+            await run_in_threadpool(remove_face_image, image_path)
     
-    db.delete(db_face)
-    db.commit()
+    face_indexes.remove_face(current_user.id, face_id)
+    ownership_cache.invalidate(current_user.id)
+    analytics_cache.invalidate_user(current_user.id)
+    if was_active:
+        dashboard_stats.adjust_active_faces(current_user.id, -1)
+        event_broker.publish_active_faces(current_user.id, -1)
     
     return {"message": "Face deleted successfully"}
 
 # Detection log endpoints
-@app.get("/detections", response_model=List[DetectionLogResponse])
+@app.get("/detections", response_model=List[DetectionLogResponse], response_class=FastJSONResponse)
 async def get_detections(
-    limit: int = 50,
-    offset: int = 0,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    detections = db.query(DetectionLog).options(
-        joinedload(DetectionLog.camera),
-        joinedload(DetectionLog.registered_face)
-    ).filter(
-        DetectionLog.user_id == current_user.id
-    ).order_by(DetectionLog.detected_at.desc()).offset(offset).limit(limit).all()
-    
-    # Convert related objects to dictionaries
-    result = []
-    for detection in detections:
-        detection_dict = {
-            "id": detection.id,
-            "camera_id": detection.camera_id,
-            "registered_face_id": detection.registered_face_id,
-            "detection_confidence": detection.detection_confidence,
-            "detection_image_path": detection.detection_image_path,
-            "detected_at": detection.detected_at,
-            "created_at": detection.created_at,
-            "camera": {
-                "id": detection.camera.id,
-                "camera_name": detection.camera.camera_name,
-                "camera_brand": detection.camera.camera_brand,
-                "camera_type": detection.camera.camera_type,
-            } if detection.camera else None,
-            "registered_face": {
-                "id": detection.registered_face.id,
-                "face_name": detection.registered_face.face_name,
-                "face_image_path": detection.registered_face.face_image_path,
-            } if detection.registered_face else None
-        }
-        result.append(detection_dict)
-    
-    return result
+    # Pass the X-Next-Cursor value back as ?cursor= to fetch the next page.
+    # offset is kept for existing clients but gets slower with depth.
+    try:
+        detections, next_cursor = await get_detection_page(
+            db, current_user.id, limit=limit, cursor=cursor, offset=offset
+        )
+    except InvalidCursor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    
+    return detections
+
+@app.get("/detections/export")
+async def export_detection_logs(
+    format: Literal["csv", "parquet", "arrow"] = Query("csv"),
+    start: Optional[datetime] = Query(None, description="Inclusive lower bound on detected_at"),
+    end: Optional[datetime] = Query(None, description="Exclusive upper bound on detected_at"),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Stream the user's detections in [start, end) with camera and face names
+
+    The token is checked with a short-lived session; the export reads
+    through its own session, see export.py.
+    """
+    async with SessionLocal() as db:
+        current_user = await authenticate_token(credentials.credentials, db)
+    
+    if start and end and to_naive_utc(start) >= to_naive_utc(end):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must be before end"
+        )
+    
+    if format != "csv" and not pyarrow_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"{format} export requires pyarrow"
+        )
+    
+    span = "-".join(value.strftime("%Y%m%d") for value in (start, end) if value) or "all"
+    return StreamingResponse(
+        export_detections(current_user.id, format, start, end),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="detections-{span}.{format}"'}
+    )
+
+@app.post("/detections/batch", response_model=DetectionBatchResponse)
+async def create_detections_batch(
+    batch: DetectionBatchCreate,
+    dedup: bool = Query(True, description="Merge repeat sightings into open detections"),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if len(batch.detections) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch too large. At most {MAX_BATCH_SIZE} detections per request."
+        )
+    
+    try:
+        result = await ingest_detections(db, current_user.id, batch.detections, dedup=dedup)
+    except UnknownReferences as exc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=exc.errors
+        )
+    
+    return {
+        "accepted": result.accepted,
+        "merged": result.merged
+    }
 
 # Dashboard stats endpoint
 @app.get("/dashboard/stats")
 async def get_dashboard_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Served from incrementally maintained counters, see stats.py
+    stats = await dashboard_stats.get(db, current_user.id)
+    
+    return {
+        "total_alerts_today": f"{stats['alerts']:02d}",
+        "total_registered_faces": f"{stats['active_faces']:02d}",
+        "alerts_by_camera": stats["alerts_by_camera"],
+        "alerts_by_hour": stats["alerts_by_hour"]
+    }
+
+# Analytics endpoints
+async def cached_analytics(user_id: int, name: str, start, end, compute, **params):
+    """Serve an analytics aggregate through analytics_cache"""
+    try:
+        start, end = resolve_range(start, end, params.get("interval"))
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc)
+        )
+    
+    async def run():
+        async with SessionLocal() as db:
+            return await compute(db, user_id, start, end, **params)
+    
+    key = (user_id, name, start, end, *sorted(params.items()))
+    results = await analytics_cache.get_or_compute(key, end, run)
+    return {"start": start, "end": end, **params, name: results}
+
+@app.get("/analytics/detections")
+async def get_detection_analytics(
+    interval: Literal["hour", "day"] = Query("hour"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await cached_analytics(
+        current_user.id, "buckets", to_naive_utc(start), to_naive_utc(end),
+        detections_over_time, interval=interval
+    )
+
+@app.get("/analytics/cameras")
+async def get_camera_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await cached_analytics(
+        current_user.id, "cameras", to_naive_utc(start), to_naive_utc(end), detections_by_camera
+    )
+
+@app.get("/analytics/faces")
+async def get_face_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await cached_analytics(
+        current_user.id, "faces", to_naive_utc(start), to_naive_utc(end),
+        detections_by_face, limit=limit
+    )
+
+@app.get("/analytics/top-visitors")
+async def get_top_visitors(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    # Registered faces ranked by the number of days they were seen
+    return await cached_analytics(
+        current_user.id, "visitors", to_naive_utc(start), to_naive_utc(end),
+        partial(detections_by_face, known_only=True, by_visit_days=True), limit=limit
+    )
+
+@app.get("/analytics/confidence")
+async def get_confidence_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bins: int = Query(10, ge=2, le=100),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    return await cached_analytics(
+        current_user.id, "histogram", to_naive_utc(start), to_naive_utc(end),
+        confidence_histogram, bins=bins
+    )
+
+# Unknown visitor endpoints
+@app.get("/visitors/unknown")
+async def get_unknown_visitors(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    min_visit_days: int = Query(2, ge=1),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: UserSnapshot = Depends(get_current_user)
+):
+    # Recurring strangers, ranked by the number of days they were seen
+    return await cached_analytics(
+        current_user.id, "unknown_visitors", to_naive_utc(start), to_naive_utc(end),
+        unknown_visitors, min_visit_days=min_visit_days, limit=limit
+    )
+
+@app.post("/visitors/{cluster_id}/promote", response_model=FaceResponse)
+async def promote_visitor(
+    cluster_id: int,
+    background_tasks: BackgroundTasks,
+    face_name: str = Form(...),
+    file: Optional[UploadFile] = File(None),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    from datetime import datetime, timedelta
+    """Register a recurring unknown visitor as a face
+
+    The cluster's centroid becomes the face encoding, so no image is needed;
+    an uploaded one is stored as the face image. The visitor's past
+    detections are labelled with the new face.
+    """
+    cluster = await db.scalar(
+        select(VisitorCluster).where(
+            VisitorCluster.id == cluster_id,
+            VisitorCluster.user_id == current_user.id
+        )
+    )
+    if not cluster:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Visitor not found"
+        )
+    if cluster.promoted_face_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Visitor is already registered as face {cluster.promoted_face_id}"
+        )
     
-    today = datetime.now().date()
+    # Check face limit based on package
+    user_faces = await db.scalar(
+        select(func.count(RegisteredFace.id)).where(RegisteredFace.user_id == current_user.id)
+    )
+    if current_user.package and current_user.package.max_registered_faces != -1:
+        if user_faces >= current_user.package.max_registered_faces:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Face limit reached. Your package allows {current_user.package.max_registered_faces} faces."
+            )
     
-    # Get today's alerts count
-    today_alerts = db.query(DetectionLog).filter(
-        DetectionLog.user_id == current_user.id,
-        DetectionLog.detected_at >= today
-    ).count()
+    saved = await save_upload(file) if file is not None else None
+    centroid = visitor_clusters.centroid(current_user.id, cluster_id)
+    if centroid is None:
+        centroid = decode_embedding(cluster.centroid)
+    db_face = RegisteredFace(
+        user_id=current_user.id,
+        face_name=face_name,
+        face_image_path=saved.path if saved else None,
+        face_encoding=encode_embedding(centroid, model=FACE_EMBEDDING_MODEL),
+        encoding_status="ready"
+    )
+    db.add(db_face)
+    await db.flush()
+    
+    cluster.promoted_face_id = db_face.id
+    await db.execute(
+        update(DetectionLog).where(
+            DetectionLog.user_id == current_user.id,
+            DetectionLog.visitor_cluster_id == cluster_id,
+            DetectionLog.registered_face_id.is_(None)
+        ).values(registered_face_id=db_face.id).execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    await db.refresh(db_face)
+    
+    # From now on the visitor is recognized instead of clustered
+    visitor_clusters.release(current_user.id, cluster_id)
+    face_indexes.add_face(current_user.id, db_face.id, db_face.face_encoding)
+    ownership_cache.invalidate(current_user.id)
+    analytics_cache.invalidate_user(current_user.id)
+    dashboard_stats.adjust_active_faces(current_user.id, 1)
+    event_broker.publish_active_faces(current_user.id, 1)
+    if saved:
+        background_tasks.add_task(generate_thumbnail, saved.path)
     
-    # Get total registered faces
-    total_faces = db.query(RegisteredFace).filter(
-        RegisteredFace.user_id == current_user.id,
-        RegisteredFace.is_active == True
-    ).count()
+    return db_face
+
+# Recognition counters for the user's own cameras
+@app.get("/recognition/stats")
+async def get_recognition_stats(current_user: UserSnapshot = Depends(get_current_user)):
+    return recognition_pipeline.user_stats(current_user.id)
+
+# Real-time events
+@app.post("/events/ticket")
+async def create_event_ticket(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+):
+    """Single-use, short-lived ticket for opening /events/stream"""
+    current_user = await authenticate_token(credentials.credentials, db)
+    payload = verify_token(credentials.credentials)
+    ticket = await session_store.issue_stream_ticket(db, current_user.id, payload.get("jti"))
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_SECONDS}
+
+@app.get("/events/stream")
+async def stream_events(ticket: str = Query(...)):
+    """Server-Sent Events stream of the user's new detections and stats deltas
+
+    EventSource cannot send headers, so a ticket from POST /events/ticket
+    is passed as a query parameter instead of the access token. It is
+    redeemed with a short-lived session so an open stream does not hold a
+    database connection.
+    """
+    async with SessionLocal() as db:
+        user_id = await session_store.redeem_stream_ticket(db, ticket)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired stream ticket"
+        )
+    tag_request(user_id)
     
-    return {
-        "total_alerts_today": f"{today_alerts:02d}",
-        "total_registered_faces": f"{total_faces:02d}"
-    }
+    subscription = event_broker.subscribe(user_id)
+    return StreamingResponse(
+        event_broker.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Test camera connection endpoint
 @app.post("/cameras/{camera_id}/test")
 async def test_camera_connection(
     camera_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    refresh: bool = Query(False, description="Probe now even if a recent result is cached"),
+    current_user: UserSnapshot = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    db_camera = db.query(Camera).filter(
-        Camera.id == camera_id,
-        Camera.user_id == current_user.id
-    ).first()
+    db_camera = await db.scalar(
+        select(Camera).where(
+            Camera.id == camera_id,
+            Camera.user_id == current_user.id
+        )
+    )
     
     if not db_camera:
         raise HTTPException(
@@ -377,9 +970,33 @@ async def test_camera_connection(
             detail="Camera not found"
         )
     
-    # TODO: Implement actual camera connection testing
-    # For now, return success
-    return {"status": "success", "message": "Camera connection test successful"}
+    if db_camera.camera_type != "ip_camera" or not db_camera.ip_address or not db_camera.port:
+        return {"status": "success", "message": "Webcams are attached locally and are not probed"}
+    
+    # Reuse the monitor's recent result, otherwise probe right away
+    try:
+        result, cached = await camera_health.check(db_camera, max_age=0 if refresh else None)
+    except ProbeRateLimited as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Camera tests are rate limited, try again shortly",
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
+    if not cached and db_camera.status != "disabled":
+        db_camera.status = "active" if result.reachable else "inactive"
+        if result.reachable:
+            db_camera.last_seen = result.checked_at
+        await db.commit()
+    
+    # Only reachability is reported, so the endpoint cannot map networks
+    return {
+        "status": "success" if result.reachable else "failed",
+        "message": "Camera reachable" if result.reachable else "Camera unreachable",
+        "cached": cached,
+        "reachable": result.reachable,
+        "checked_at": result.checked_at,
+    }
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,440 @@
+"""Request, database and event loop metrics in the Prometheus text format
+
+MetricsMiddleware times every HTTP request per route template and, via
+SQLAlchemy cursor events, counts the statements each request runs and
+the time they take. A contextvar ties statements to the request that
+issued them. Pool utilization, event loop lag and the stats() of the
+background components are collected when /metrics is scraped.
+"""
+import asyncio
+import bisect
+import contextvars
+import hmac
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from database import engine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Requests slower than this are logged with their SQL; 0 disables
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "20"))
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+# Tenants with the most request time exported with a user_id label. User
+# ids are only published when /metrics is protected by METRICS_TOKEN
+METRICS_TOP_TENANTS = int(os.getenv("METRICS_TOP_TENANTS", "10"))
+TENANT_METRICS_ENABLED = bool(METRICS_TOKEN) and METRICS_TOP_TENANTS > 0
+# Tenants tracked for the ranking; past this the least busy half is dropped
+METRICS_MAX_TENANTS = int(os.getenv("METRICS_MAX_TENANTS", "10000"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Labels = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in values)
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, amount: float):
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> List[str]:
+        return _gauge(self.name, self.help, [((), self.value)])
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Labels = ()):
+        # Counts per bucket, then sum and count
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 3)
+            series[slot] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, values in series:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {_format_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(values[-1])}")
+        return lines
+
+
+def _gauge(name: str, help: str, samples: Sequence[Tuple[Labels, float]]) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return lines
+
+
+http_requests = Counter("app_http_requests_total", "HTTP requests by route and status")
+http_in_progress = Gauge("app_http_requests_in_progress", "HTTP requests being served")
+http_duration = Histogram(
+    "app_http_request_duration_seconds", "HTTP request latency by route", LATENCY_BUCKETS
+)
+http_db_queries = Histogram(
+    "app_http_request_db_queries", "SQL statements run per HTTP request", QUERY_COUNT_BUCKETS
+)
+http_db_seconds = Histogram(
+    "app_http_request_db_seconds", "Time spent in SQL per HTTP request", LATENCY_BUCKETS
+)
+db_query_duration = Histogram(
+    "app_db_query_duration_seconds", "SQL statement latency, background work included", QUERY_BUCKETS
+)
+loop_lag = Histogram(
+    "app_event_loop_lag_seconds", "Delay of a timer callback behind its schedule", LAG_BUCKETS
+)
+
+
+@dataclass
+class RequestMetrics:
+    """Per-request accumulator reached through the current_request contextvar"""
+    method: str
+    path: str
+    started: float = field(default_factory=time.perf_counter)
+    user_id: Optional[int] = None
+    queries: int = 0
+    query_seconds: float = 0.0
+    statements: List[Tuple[float, str]] = field(default_factory=list)
+
+
+current_request: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def tag_request(user_id: int) -> None:
+    """Attribute the current request to a tenant"""
+    request = current_request.get()
+    if request is not None:
+        request.user_id = user_id
+
+
+# SQL statement timing
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    db_query_duration.observe(elapsed)
+    request = current_request.get()
+    if request is not None:
+        request.queries += 1
+        request.query_seconds += elapsed
+        if SLOW_REQUEST_SECONDS > 0 and len(request.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+            request.statements.append((elapsed, statement))
+
+
+class TenantTotals:
+    """Cumulative request and SQL seconds per tenant
+
+    At most max_tenants are tracked. When that is exceeded the half with the
+    least request time is dropped, which cannot change the top few.
+    """
+
+    def __init__(self, max_tenants: int = METRICS_MAX_TENANTS):
+        self.max_tenants = max(2, max_tenants)
+        self._totals: Dict[int, List[float]] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, user_id: int, seconds: float, query_seconds: float):
+        with self._lock:
+            totals = self._totals.setdefault(user_id, [0.0, 0.0, 0])
+            totals[0] += seconds
+            totals[1] += query_seconds
+            totals[2] += 1
+            if len(self._totals) > self.max_tenants:
+                ranked = sorted(self._totals.items(), key=lambda item: item[1][0], reverse=True)
+                self._totals = dict(ranked[:self.max_tenants // 2])
+                self.dropped += len(ranked) - len(self._totals)
+
+    def top(self, limit: int) -> List[Tuple[int, List[float]]]:
+        with self._lock:
+            items = [(user_id, list(totals)) for user_id, totals in self._totals.items()]
+        return sorted(items, key=lambda item: item[1][0], reverse=True)[:limit]
+
+
+tenant_totals = TenantTotals()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage per route template
+
+    Routes are labelled by their path template ("/cameras/{camera_id}"),
+    looked up from the endpoint Starlette matched, so ids never become
+    label values. Streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._templates: Optional[Dict[Callable, str]] = None
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._templates is None:
+            application = scope.get("app")
+            self._templates = {
+                getattr(route, "endpoint", None): route.path
+                for route in getattr(application, "routes", [])
+                if hasattr(route, "path")
+            }
+        return self._templates.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics(method=scope["method"], path=scope["path"])
+        token = current_request.set(request)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_progress.add(1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_progress.add(-1)
+            current_request.reset(token)
+            self._record(request, self._route_template(scope), status_code)
+
+    def _record(self, request: RequestMetrics, route: str, status_code: int):
+        elapsed = time.perf_counter() - request.started
+        labels = (("method", request.method), ("route", route))
+        http_requests.inc(labels + (("status", str(status_code)),))
+        http_duration.observe(elapsed, labels)
+        http_db_queries.observe(request.queries, labels)
+        http_db_seconds.observe(request.query_seconds, labels)
+        if request.user_id is not None and TENANT_METRICS_ENABLED:
+            tenant_totals.add(request.user_id, elapsed, request.query_seconds)
+
+        if SLOW_REQUEST_SECONDS > 0 and elapsed >= SLOW_REQUEST_SECONDS:
+            statements = "".join(
+                f"\n  {seconds * 1000:8.1f} ms  {' '.join(statement.split())}"
+                for seconds, statement in request.statements
+            )
+            if request.queries > len(request.statements):
+                statements += f"\n  ... {request.queries - len(request.statements)} more"
+            logger.warning(
+                "Slow request %s %s (%s) %d in %.3fs, user %s, %d queries in %.3fs%s",
+                request.method, request.path, route, status_code, elapsed,
+                request.user_id, request.queries, request.query_seconds, statements
+            )
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic sleep wakes up on the event loop"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None and METRICS_ENABLED:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag.observe(lag)
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+def token_matches(authorization: Optional[str]) -> bool:
+    """Check an Authorization header against METRICS_TOKEN in constant time"""
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+def warn_if_unprotected() -> None:
+    """Log a warning when /metrics is served without METRICS_TOKEN"""
+    if METRICS_ENABLED and not METRICS_TOKEN:
+        logger.warning(
+            "/metrics is enabled without METRICS_TOKEN; set a token or METRICS_ENABLED=false "
+            "unless the endpoint is only reachable from an internal network"
+        )
+
+_stats_sources: Dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(name: str, source: Callable[[], dict]) -> None:
+    """Export a component's stats() dict as app_<name>_<key> gauges"""
+    _stats_sources[name] = source
+
+
+def _flatten_stats(prefix: str, stats: dict) -> Dict[str, List[Tuple[Labels, float]]]:
+    """Numbers become gauges; nested dicts add a "key" label"""
+    metrics: Dict[str, List[Tuple[Labels, float]]] = {}
+    for key, value in stats.items():
+        if isinstance(value, (bool, int, float)):
+            metrics.setdefault(f"{prefix}_{key}", []).append(((), float(value)))
+        elif isinstance(value, dict):
+            for label, inner in value.items():
+                if isinstance(inner, (bool, int, float)):
+                    metrics.setdefault(f"{prefix}_{key}", []).append(((("key", label),), float(inner)))
+                elif isinstance(inner, dict):
+                    for field_name, number in inner.items():
+                        if isinstance(number, (bool, int, float)):
+                            metrics.setdefault(f"{prefix}_{key}_{field_name}", []).append(
+                                ((("key", label),), float(number))
+                            )
+    return metrics
+
+
+def _pool_samples() -> List[str]:
+    pool = engine.sync_engine.pool
+    lines = []
+    for name, attr, help in (
+        ("app_db_pool_size", "size", "Configured connection pool size"),
+        ("app_db_pool_checked_out", "checkedout", "Connections currently in use"),
+        ("app_db_pool_checked_in", "checkedin", "Idle connections in the pool"),
+        ("app_db_pool_overflow", "overflow", "Connections opened beyond the pool size"),
+    ):
+        method = getattr(pool, attr, None)
+        if method is not None:
+            lines.extend(_gauge(name, help, [((), float(method()))]))
+    return lines
+
+
+def render() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in (
+        http_requests, http_in_progress, http_duration, http_db_queries,
+        http_db_seconds, db_query_duration, loop_lag
+    ):
+        lines.extend(metric.render())
+    lines.extend(_gauge("app_event_loop_lag_max_seconds", "Largest event loop lag seen", [((), loop_lag_monitor.max_lag)]))
+    lines.extend(_pool_samples())
+
+    if TENANT_METRICS_ENABLED:
+        top = tenant_totals.top(METRICS_TOP_TENANTS)
+        lines.extend(_gauge(
+            "app_tenant_request_seconds", "Request seconds of the busiest tenants",
+            [((("user_id", user_id),), totals[0]) for user_id, totals in top]
+        ))
+        lines.extend(_gauge(
+            "app_tenant_db_seconds", "SQL seconds of the busiest tenants",
+            [((("user_id", user_id),), totals[1]) for user_id, totals in top]
+        ))
+        lines.extend(_gauge(
+            "app_tenant_requests", "Requests of the busiest tenants",
+            [((("user_id", user_id),), totals[2]) for user_id, totals in top]
+        ))
+
+    for name, source in _stats_sources.items():
+        try:
+            stats = source()
+        except Exception:
+            logger.exception("Collecting %s stats failed", name)
+            continue
+        for metric, samples in _flatten_stats(f"app_{name}", stats).items():
+            lines.extend(_gauge(metric, f"{name} {metric[len(name) + 5:]}", samples))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,169 @@
+"""Versioned schema migrations
+
+Migrations are plain PostgreSQL scripts in migrations/NNNN_description.sql,
+applied in version order, each in its own transaction, and recorded in
+schema_migrations with a checksum. A PostgreSQL advisory lock serializes
+concurrent runs, so it is safe to run from every instance of a deploy:
+
+    python -m migrate            # apply pending migrations
+    python -m migrate --status   # list applied and pending versions
+
+API workers do not touch the schema unless MIGRATE_ON_STARTUP is set.
+SQLite databases (benchmarks, local experiments) cannot run the
+PostgreSQL scripts and are created from the models instead.
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from database import engine, Base, IS_SQLITE
+import models  # registers the tables on Base.metadata
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+MIGRATIONS_DIR = Path(__file__).with_name("migrations")
+ADVISORY_LOCK_KEY = 0x6d696772  # "migr"
+
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def sql(self) -> str:
+        return self.path.read_text()
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Migration scripts in version order"""
+    migrations = []
+    for path in directory.glob("*.sql"):
+        match = _FILENAME.match(path.name)
+        if match is None:
+            raise ValueError(f"Migration file {path.name} is not named NNNN_description.sql")
+        migrations.append(Migration(int(match.group(1)), match.group(2), path))
+    migrations.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Duplicate migration versions")
+    return migrations
+
+
+async def _applied(driver) -> Dict[int, str]:
+    rows = await driver.fetch("SELECT version, checksum FROM schema_migrations")
+    return {row["version"]: row["checksum"] for row in rows}
+
+
+async def _baseline(driver, migrations: List[Migration]) -> None:
+    """Record the initial migration for databases created by the old schema script"""
+    if not migrations or await driver.fetchval("SELECT count(*) FROM schema_migrations"):
+        return
+    if await driver.fetchval("SELECT to_regclass('public.packages')") is None:
+        return
+    initial = migrations[0]
+    await driver.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+        initial.version, initial.name, initial.checksum
+    )
+    logger.info("Existing schema recorded as migration %04d_%s", initial.version, initial.name)
+
+
+async def migrate() -> List[Migration]:
+    """Apply pending migrations, returning the ones applied"""
+    migrations = discover()
+    if IS_SQLITE:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        return []
+
+    applied_now = []
+    async with engine.connect() as conn:
+        # asyncpg runs multi-statement scripts only outside prepared statements
+        driver = (await conn.get_raw_connection()).driver_connection
+        await driver.execute("SELECT pg_advisory_lock($1)", ADVISORY_LOCK_KEY)
+        try:
+            await driver.execute(CREATE_MIGRATIONS_TABLE)
+            await _baseline(driver, migrations)
+            applied = await _applied(driver)
+            for migration in migrations:
+                checksum = applied.get(migration.version)
+                if checksum is not None:
+                    if checksum != migration.checksum:
+                        logger.warning(
+                            "Migration %04d_%s changed after it was applied",
+                            migration.version, migration.name
+                        )
+                    continue
+                logger.info("Applying migration %04d_%s", migration.version, migration.name)
+                async with driver.transaction():
+                    await driver.execute(migration.sql)
+                    await driver.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3)",
+                        migration.version, migration.name, migration.checksum
+                    )
+                applied_now.append(migration)
+        finally:
+            await driver.execute("SELECT pg_advisory_unlock($1)", ADVISORY_LOCK_KEY)
+    return applied_now
+
+
+async def status() -> List[tuple]:
+    """(migration, applied) for every known migration"""
+    migrations = discover()
+    if IS_SQLITE:
+        return [(migration, None) for migration in migrations]
+    async with engine.connect() as conn:
+        driver = (await conn.get_raw_connection()).driver_connection
+        if await driver.fetchval("SELECT to_regclass('public.schema_migrations')") is None:
+            applied = {}
+        else:
+            applied = await _applied(driver)
+    return [(migration, migration.version in applied) for migration in migrations]
+
+
+async def _main(args):
+    try:
+        if args.status:
+            for migration, applied in await status():
+                state = "unknown (SQLite)" if applied is None else ("applied" if applied else "pending")
+                print(f"{migration.version:04d}_{migration.name}: {state}")
+        else:
+            applied = await migrate()
+            print(f"Applied {len(applied)} migration(s)" if not IS_SQLITE else "Created SQLite schema from the models")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,9 @@
+-- Registered faces are encoded by the background worker in
+-- backend/face_encoding.py; pending rows form its job queue.
+ALTER TABLE registered_faces ADD COLUMN encoding_status VARCHAR(20) DEFAULT 'pending'
+    CHECK (encoding_status IN ('pending', 'processing', 'ready', 'no_face', 'failed'));
+
+-- Faces encoded before the worker existed are done; the rest are queued
+UPDATE registered_faces SET encoding_status = 'ready' WHERE face_encoding IS NOT NULL;
+
+CREATE INDEX idx_registered_faces_encoding_pending ON registered_faces(id) WHERE encoding_status = 'pending';
@@ -0,0 +1,77 @@
+-- detection_logs becomes range partitioned by month on detected_at, so
+-- backend/retention.py can drop whole months. The partition key must be
+-- part of the primary key. Repeat sightings are merged into one row
+-- (backend/detection_dedup.py), counted in hit_count up to last_seen_at.
+-- Existing rows are copied over with their ids.
+ALTER TABLE detection_logs RENAME TO detection_logs_unpartitioned;
+-- Free the constraint and index names for the new table
+ALTER INDEX detection_logs_pkey RENAME TO detection_logs_unpartitioned_pkey;
+ALTER TABLE detection_logs_unpartitioned
+    DROP CONSTRAINT IF EXISTS detection_logs_user_id_fkey,
+    DROP CONSTRAINT IF EXISTS detection_logs_camera_id_fkey,
+    DROP CONSTRAINT IF EXISTS detection_logs_registered_face_id_fkey;
+DROP INDEX IF EXISTS idx_detection_logs_user_id;
+DROP INDEX IF EXISTS idx_detection_logs_camera_id;
+DROP INDEX IF EXISTS idx_detection_logs_detected_at;
+-- Keep the id sequence when the old table is dropped
+ALTER SEQUENCE detection_logs_id_seq OWNED BY NONE;
+
+CREATE TABLE detection_logs (
+    id INTEGER NOT NULL DEFAULT nextval('detection_logs_id_seq'),
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    camera_id INTEGER REFERENCES cameras(id) ON DELETE CASCADE,
+    registered_face_id INTEGER REFERENCES registered_faces(id) ON DELETE SET NULL,
+    detection_confidence DECIMAL(5,4),
+    detection_image_path VARCHAR(500),
+    detected_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen_at TIMESTAMP,
+    hit_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, detected_at)
+) PARTITION BY RANGE (detected_at);
+
+-- Catches rows outside every monthly partition (e.g. clock skew)
+CREATE TABLE detection_logs_default PARTITION OF detection_logs DEFAULT;
+
+-- Monthly partitions named detection_logs_pYYYY_MM from the oldest
+-- existing row (or the sample data) through two months ahead; retention.py
+-- creates the following ones
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            LEAST(DATE '2025-01-01', (SELECT date_trunc('month', min(detected_at))::date FROM detection_logs_unpartitioned)),
+            date_trunc('month', CURRENT_DATE) + INTERVAL '2 months',
+            INTERVAL '1 month'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE detection_logs_p%s PARTITION OF detection_logs FOR VALUES FROM (%L) TO (%L)',
+            to_char(month, 'YYYY_MM'), month, (month + INTERVAL '1 month')::date
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO detection_logs (
+    id, user_id, camera_id, registered_face_id, detection_confidence, detection_image_path,
+    detected_at, last_seen_at, hit_count, created_at
+)
+SELECT
+    id, user_id, camera_id, registered_face_id, detection_confidence, detection_image_path,
+    COALESCE(detected_at, created_at, CURRENT_TIMESTAMP), COALESCE(detected_at, created_at, CURRENT_TIMESTAMP),
+    1, created_at
+FROM detection_logs_unpartitioned;
+
+DROP TABLE detection_logs_unpartitioned;
+ALTER SEQUENCE detection_logs_id_seq OWNED BY detection_logs.id;
+
+CREATE INDEX idx_detection_logs_user_id ON detection_logs(user_id);
+CREATE INDEX idx_detection_logs_camera_id ON detection_logs(camera_id);
+CREATE INDEX idx_detection_logs_detected_at ON detection_logs(detected_at);
+-- Keyset pagination of a user's detections, newest first
+CREATE INDEX idx_detection_logs_user_detected_at ON detection_logs(user_id, detected_at DESC, id DESC);
+-- Covers the analytics aggregates over a user's time range
+CREATE INDEX idx_detection_logs_user_analytics ON detection_logs(user_id, detected_at)
+    INCLUDE (camera_id, registered_face_id, hit_count, detection_confidence);
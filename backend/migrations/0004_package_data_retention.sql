@@ -0,0 +1,11 @@
+-- Detection history older than a package's data_retention_days is deleted
+-- by backend/retention.py; NULL keeps it forever. The defaults match the
+-- retention the plans advertise.
+ALTER TABLE packages ADD COLUMN data_retention_days INTEGER;
+
+UPDATE packages SET data_retention_days = CASE name
+    WHEN 'Basic' THEN 30
+    WHEN 'Standard' THEN 60
+    WHEN 'Premium' THEN 90
+END
+WHERE data_retention_days IS NULL;
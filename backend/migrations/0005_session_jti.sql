@@ -0,0 +1,16 @@
+-- Sessions are keyed by the JWT "jti" claim instead of storing the token,
+-- and logging out sets revoked_at (see backend/sessions.py). Stored tokens
+-- carry no jti, so their rows cannot be converted; they were never checked
+-- and are dropped. Those tokens stay valid until they expire.
+DELETE FROM user_sessions;
+
+DROP INDEX idx_user_sessions_token;
+ALTER TABLE user_sessions DROP COLUMN session_token;
+ALTER TABLE user_sessions ADD COLUMN jti VARCHAR(32) NOT NULL UNIQUE;
+ALTER TABLE user_sessions ADD COLUMN revoked_at TIMESTAMP;
+ALTER TABLE user_sessions ALTER COLUMN user_id SET NOT NULL;
+
+-- Serves the expiry sweep
+CREATE INDEX idx_user_sessions_expires_at ON user_sessions(expires_at);
+-- Serves the incremental revocation refresh; few rows are revoked
+CREATE INDEX idx_user_sessions_revoked_at ON user_sessions(revoked_at) WHERE revoked_at IS NOT NULL;
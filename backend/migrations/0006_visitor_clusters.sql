@@ -0,0 +1,29 @@
+-- Recurring unknown visitors. backend/visitor_clusters.py assigns every
+-- unknown face the recognition pipeline sees to the nearest cluster
+-- centroid, or starts a new cluster. Promoting a cluster turns it into a
+-- registered face.
+CREATE TABLE visitor_clusters (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    centroid BYTEA NOT NULL,  -- float32 mean embedding, embedding_format encoded
+    sighting_count INTEGER NOT NULL DEFAULT 1,
+    first_seen_at TIMESTAMP NOT NULL,
+    last_seen_at TIMESTAMP NOT NULL,
+    promoted_face_id INTEGER REFERENCES registered_faces(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Loads a user's most recently seen clusters as matching candidates
+CREATE INDEX idx_visitor_clusters_user_last_seen ON visitor_clusters(user_id, last_seen_at DESC)
+    WHERE promoted_face_id IS NULL;
+
+CREATE TRIGGER update_visitor_clusters_updated_at BEFORE UPDATE ON visitor_clusters FOR EACH ROW EXECUTE PROCEDURE update_updated_at_column();
+
+-- Adding a nullable column without a default is a catalog-only change,
+-- including on the partitions
+ALTER TABLE detection_logs ADD COLUMN visitor_cluster_id INTEGER REFERENCES visitor_clusters(id) ON DELETE SET NULL;
+
+-- Serves promotion, which labels the cluster's past detections
+CREATE INDEX idx_detection_logs_visitor_cluster ON detection_logs(visitor_cluster_id)
+    WHERE visitor_cluster_id IS NOT NULL;
@@ -0,0 +1,15 @@
+-- Single-use tickets for opening the event stream. EventSource cannot send
+-- headers, so /events/stream takes a short-lived ticket in its URL instead
+-- of the access token (see backend/sessions.py). Only the ticket's SHA-256
+-- is stored.
+CREATE TABLE stream_tickets (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    ticket_hash VARCHAR(64) NOT NULL UNIQUE,
+    session_jti VARCHAR(32),
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Serves the expiry sweep
+CREATE INDEX idx_stream_tickets_expires_at ON stream_tickets(expires_at);
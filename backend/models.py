@@ -1,20 +1,28 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, CheckConstraint, LargeBinary, Numeric
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, CheckConstraint, LargeBinary, Numeric, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB, INET
 from datetime import datetime
 from database import Base
+from storage_keys import thumbnail_path_for
+
+# PostgreSQL types with portable fallbacks so the models also work on SQLite
+# (benchmarks and local experiments)
+JSONBType = JSON().with_variant(JSONB(), "postgresql")
+INETType = String(45).with_variant(INET(), "postgresql")
 
 class Package(Base):
     __tablename__ = "packages"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String(50), unique=True, nullable=False)
     price = Column(Numeric(10, 2), nullable=False)
     period = Column(String(20), nullable=False, default="monthly")
     description = Column(Text)
-    features = Column(JSONB)
+    features = Column(JSONBType)
     camera_limit = Column(Integer)
     max_registered_faces = Column(Integer)
+    # Detection history older than this is deleted by retention.py
+    data_retention_days = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -24,8 +32,8 @@ class Package(Base):
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String(255), unique=True, nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    email = Column(String(255), unique=True, nullable=False)
     full_name = Column(String(255), nullable=False)
     phone_number = Column(String(20))
     password_hash = Column(String(255), nullable=False)
@@ -35,34 +43,69 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        Index("idx_users_email", email),
+        Index("idx_users_package_id", package_id),
+    )
+    
     # Relationships
     package = relationship("Package", back_populates="users")
-    sessions = relationship("UserSession", back_populates="user", cascade="all, delete-orphan")
-    cameras = relationship("Camera", back_populates="user", cascade="all, delete-orphan")
-    registered_faces = relationship("RegisteredFace", back_populates="user", cascade="all, delete-orphan")
-    detection_logs = relationship("DetectionLog", back_populates="user", cascade="all, delete-orphan")
+    sessions = relationship("UserSession", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    cameras = relationship("Camera", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    registered_faces = relationship("RegisteredFace", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    detection_logs = relationship("DetectionLog", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
 
 class UserSession(Base):
     __tablename__ = "user_sessions"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    session_token = Column(String(255), unique=True, nullable=False, index=True)
-    expires_at = Column(DateTime)
+    # JWT "jti" claim; the token itself is never stored
+    jti = Column(String(32), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     user = relationship("User", back_populates="sessions")
 
+    __table_args__ = (
+        Index("idx_user_sessions_user_id", user_id),
+        # Serves the expiry sweep in sessions.py
+        Index("idx_user_sessions_expires_at", expires_at),
+        # Serves the incremental revocation refresh; few rows are revoked
+        Index(
+            "idx_user_sessions_revoked_at", revoked_at,
+            postgresql_where=revoked_at.isnot(None)
+        ),
+    )
+
+class StreamTicket(Base):
+    __tablename__ = "stream_tickets"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # SHA-256 of the single-use ticket; the ticket itself is never stored
+    ticket_hash = Column(String(64), unique=True, nullable=False)
+    # Session the ticket was issued from; logging it out voids the ticket
+    session_jti = Column(String(32))
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Serves the expiry sweep in sessions.py
+        Index("idx_stream_tickets_expires_at", expires_at),
+    )
+
 class Camera(Base):
     __tablename__ = "cameras"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     camera_name = Column(String(255), nullable=False)
     camera_brand = Column(String(100))
     camera_type = Column(String(20), nullable=False)
-    ip_address = Column(INET)
+    ip_address = Column(INETType)
     port = Column(Integer)
     username = Column(String(255))
     password_hash = Column(String(255))
@@ -71,49 +114,118 @@ class Camera(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Names match the ones PostgreSQL gave the constraints in migrations/
     __table_args__ = (
-        CheckConstraint("camera_type IN ('ip_camera', 'webcam')", name='check_camera_type'),
-        CheckConstraint("status IN ('active', 'inactive', 'disabled')", name='check_camera_status'),
-        CheckConstraint("port >= 1 AND port <= 65535", name='check_port_range'),
+        CheckConstraint("camera_type IN ('ip_camera', 'webcam')", name='cameras_camera_type_check'),
+        CheckConstraint("status IN ('active', 'inactive', 'disabled')", name='cameras_status_check'),
+        CheckConstraint("port >= 1 AND port <= 65535", name='cameras_port_check'),
         CheckConstraint(
             "(camera_type = 'webcam') OR (camera_type = 'ip_camera' AND ip_address IS NOT NULL AND port IS NOT NULL)",
-            name='check_ip_camera_requirements'
+            name='ip_camera_requires_network'
         ),
+        Index("idx_cameras_user_id", user_id),
+        Index("idx_cameras_status", status),
     )
     
     # Relationships
     user = relationship("User", back_populates="cameras")
-    detection_logs = relationship("DetectionLog", back_populates="camera", cascade="all, delete-orphan")
+    detection_logs = relationship("DetectionLog", back_populates="camera", cascade="all, delete-orphan", passive_deletes=True)
 
 class RegisteredFace(Base):
     __tablename__ = "registered_faces"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    face_name = Column(String(255), nullable=False, index=True)
+    face_name = Column(String(255), nullable=False)
     face_image_path = Column(String(500))
     face_encoding = Column(LargeBinary)  # Store face encoding for recognition
+    encoding_status = Column(String(20), default="pending")  # Set by face_encoding.FaceEncodingWorker
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        CheckConstraint(
+            "encoding_status IN ('pending', 'processing', 'ready', 'no_face', 'failed')",
+            name='registered_faces_encoding_status_check'
+        ),
+        Index("idx_registered_faces_user_id", user_id),
+        Index("idx_registered_faces_name", face_name),
+        # Serves the encoding worker's claim query
+        Index(
+            "idx_registered_faces_encoding_pending", id,
+            postgresql_where=encoding_status == "pending"
+        ),
+    )
+    
+    @property
+    def thumbnail_path(self):
+        """Downscaled copy written in the background after upload"""
+        return thumbnail_path_for(self.face_image_path) if self.face_image_path else None
+    
     # Relationships
     user = relationship("User", back_populates="registered_faces")
-    detection_logs = relationship("DetectionLog", back_populates="registered_face")
+    detection_logs = relationship("DetectionLog", back_populates="registered_face", passive_deletes=True)
 
 class DetectionLog(Base):
     __tablename__ = "detection_logs"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     camera_id = Column(Integer, ForeignKey("cameras.id", ondelete="CASCADE"), nullable=False)
     registered_face_id = Column(Integer, ForeignKey("registered_faces.id", ondelete="SET NULL"))
+    # Recurring unknown visitor this sighting was clustered into, see visitor_clusters.py
+    visitor_cluster_id = Column(Integer, ForeignKey("visitor_clusters.id", ondelete="SET NULL"))
     detection_confidence = Column(Numeric(5, 4))
     detection_image_path = Column(String(500))
     detected_at = Column(DateTime, default=datetime.utcnow)
+    # Repeat sightings merged into this event by detection_dedup; detected_at
+    # is the first sighting and detection_confidence the peak confidence
+    last_seen_at = Column(DateTime)
+    hit_count = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index("idx_detection_logs_user_id", user_id),
+        Index("idx_detection_logs_camera_id", camera_id),
+        Index("idx_detection_logs_detected_at", detected_at),
+        # Serves keyset pagination of a user's detections newest-first
+        Index("idx_detection_logs_user_detected_at", user_id, detected_at.desc(), id.desc()),
+        # Lets analytics.py aggregate a user's range with an index-only scan
+        Index(
+            "idx_detection_logs_user_analytics", user_id, detected_at,
+            postgresql_include=["camera_id", "registered_face_id", "hit_count", "detection_confidence"]
+        ),
+        Index(
+            "idx_detection_logs_visitor_cluster", visitor_cluster_id,
+            postgresql_where=visitor_cluster_id.isnot(None)
+        ),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="detection_logs")
     camera = relationship("Camera", back_populates="detection_logs")
-    registered_face = relationship("RegisteredFace", back_populates="detection_logs")
\ No newline at end of file
+    registered_face = relationship("RegisteredFace", back_populates="detection_logs")
+
+class VisitorCluster(Base):
+    __tablename__ = "visitor_clusters"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Running mean of the member embeddings, float32 in embedding_format
+    centroid = Column(LargeBinary, nullable=False)
+    sighting_count = Column(Integer, nullable=False, default=1, server_default="1")
+    first_seen_at = Column(DateTime, nullable=False)
+    last_seen_at = Column(DateTime, nullable=False)
+    # Set once the visitor has been registered as a face
+    promoted_face_id = Column(Integer, ForeignKey("registered_faces.id", ondelete="SET NULL"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        # Loads a user's most recently seen clusters as matching candidates
+        Index(
+            "idx_visitor_clusters_user_last_seen", user_id, last_seen_at.desc(),
+            postgresql_where=promoted_face_id.is_(None)
+        ),
+    )
@@ -0,0 +1,121 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Camera, RegisteredFace, DetectionLog
+
+MAX_PAGE_SIZE = 500
+
+# Only the columns the detections list shows. Selecting plain columns
+# returns lightweight rows instead of ORM entities, so no identity map,
+# relationship loading or attribute instrumentation is involved.
+DETECTION_COLUMNS = (
+    DetectionLog.id,
+    DetectionLog.camera_id,
+    DetectionLog.registered_face_id,
+    DetectionLog.detection_confidence,
+    DetectionLog.detection_image_path,
+    DetectionLog.detected_at,
+    DetectionLog.last_seen_at,
+    DetectionLog.hit_count,
+    DetectionLog.created_at,
+    Camera.camera_name,
+    Camera.camera_brand,
+    Camera.camera_type,
+    RegisteredFace.face_name,
+    RegisteredFace.face_image_path,
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(detected_at: datetime, detection_id: int) -> str:
+    """Encode a (detected_at, id) position as an opaque URL-safe cursor"""
+    raw = f"{detected_at.isoformat()}|{detection_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        detected_at, detection_id = raw.split("|", 1)
+        return datetime.fromisoformat(detected_at), int(detection_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def detection_page_query(user_id: int, limit: int, cursor: Optional[str] = None, offset: int = 0):
+    """Build the column-only, keyset-paginated detections query
+
+    Rows are ordered by (detected_at, id) descending, which matches the
+    idx_detection_logs_user_detected_at index, so each page is an index
+    range scan starting right after the cursor position regardless of depth.
+    """
+    stmt = select(*DETECTION_COLUMNS).select_from(DetectionLog).outerjoin(
+        Camera, Camera.id == DetectionLog.camera_id
+    ).outerjoin(
+        RegisteredFace, RegisteredFace.id == DetectionLog.registered_face_id
+    ).where(
+        DetectionLog.user_id == user_id
+    )
+
+    if cursor:
+        detected_at, detection_id = decode_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(DetectionLog.detected_at, DetectionLog.id) < tuple_(detected_at, detection_id)
+        )
+    elif offset:
+        stmt = stmt.offset(offset)
+
+    return stmt.order_by(DetectionLog.detected_at.desc(), DetectionLog.id.desc()).limit(limit)
+
+
+def row_to_detection(row) -> dict:
+    """Shape a DETECTION_COLUMNS row like DetectionLogResponse"""
+    (id_, camera_id, face_id, confidence, image_path, detected_at, last_seen_at, hit_count,
+     created_at, camera_name, camera_brand, camera_type, face_name, face_image_path) = row
+    return {
+        "id": id_,
+        "camera_id": camera_id,
+        "registered_face_id": face_id,
+        "detection_confidence": confidence,
+        "detection_image_path": image_path,
+        "detected_at": detected_at,
+        "last_seen_at": last_seen_at,
+        "hit_count": hit_count,
+        "created_at": created_at,
+        "camera": {
+            "id": camera_id,
+            "camera_name": camera_name,
+            "camera_brand": camera_brand,
+            "camera_type": camera_type,
+        } if camera_name is not None else None,
+        "registered_face": {
+            "id": face_id,
+            "face_name": face_name,
+            "face_image_path": face_image_path,
+        } if face_name is not None else None,
+    }
+
+
+async def get_detection_page(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    offset: int = 0
+) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of detections and the cursor for the next page"""
+    rows = (await db.execute(detection_page_query(user_id, limit, cursor, offset))).all()
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.detected_at, last.id)
+    return [row_to_detection(row) for row in rows], next_cursor
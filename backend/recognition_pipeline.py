@@ -0,0 +1,744 @@
+"""Streaming face recognition from camera frames to detection logs
+
+frame source -> decode -> detect -> embed -> match -> emit
+
+Stages run on worker threads (PIL, OpenCV, numpy and dlib release the GIL
+for the heavy work) connected by bounded queues. A full queue drops its
+oldest frame, and every stage discards frames older than max_frame_age, so
+under load the pipeline falls back to the freshest frames instead of
+building up latency. The embed stage batches faces across cameras.
+
+Started with start_streaming(), IP cameras are only streamed by the API
+worker holding the shard's advisory lock, so detections are not
+multiplied by the number of workers.
+"""
+import asyncio
+import io
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from database import SessionLocal
+from embedding_models import Box, get_detector, get_model
+from face_encoding import FACE_EMBEDDING_MODEL
+from face_index import DEFAULT_TOLERANCE, FaceIndex, face_indexes
+from ingestion import ingest_detections
+from leader_lock import LeaderLock
+from models import Camera
+from schemas import DetectionCreate
+from visitor_clusters import visitor_clusters
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RECOGNITION_ENABLED = os.getenv("RECOGNITION_ENABLED", "false").lower() in ("1", "true", "yes")
+RECOGNITION_DETECTOR = os.getenv("RECOGNITION_DETECTOR", "face_recognition")
+RECOGNITION_SAMPLE_FPS = float(os.getenv("RECOGNITION_SAMPLE_FPS", "5"))
+RECOGNITION_MAX_FRAME_AGE = float(os.getenv("RECOGNITION_MAX_FRAME_AGE", "2"))
+RECOGNITION_QUEUE_SIZE = int(os.getenv("RECOGNITION_QUEUE_SIZE", "64"))
+RECOGNITION_DECODE_WORKERS = int(os.getenv("RECOGNITION_DECODE_WORKERS", "2"))
+RECOGNITION_DETECT_WORKERS = int(os.getenv("RECOGNITION_DETECT_WORKERS", "4"))
+RECOGNITION_EMBED_BATCH_SIZE = int(os.getenv("RECOGNITION_EMBED_BATCH_SIZE", "32"))
+RECOGNITION_EMBED_MAX_WAIT = float(os.getenv("RECOGNITION_EMBED_MAX_WAIT", "0.05"))
+# Path appended to rtsp://<ip>:<port> for IP cameras
+RECOGNITION_RTSP_PATH = os.getenv("RECOGNITION_RTSP_PATH", "/")
+# Stream credentials shared by all IP cameras; per-camera passwords are
+# stored hashed and cannot be sent
+RECOGNITION_RTSP_USERNAME = os.getenv("RECOGNITION_RTSP_USERNAME", "")
+RECOGNITION_RTSP_PASSWORD = os.getenv("RECOGNITION_RTSP_PASSWORD", "")
+# Split cameras across nodes: this node streams ids where id % COUNT == INDEX
+RECOGNITION_SHARD_INDEX = int(os.getenv("RECOGNITION_SHARD_INDEX", "0"))
+RECOGNITION_SHARD_COUNT = int(os.getenv("RECOGNITION_SHARD_COUNT", "1"))
+
+# How long emitted detections are gathered before one ingest call
+EMIT_MAX_WAIT = 0.25
+EMIT_BATCH_SIZE = 500
+# Pause before reopening a stream that stopped delivering frames
+REOPEN_SECONDS = 5.0
+# Only the API worker holding this lock (per shard) streams cameras
+ADVISORY_LOCK_KEY = 0x7265636f  # "reco"
+# Other workers retry the lock this often, so one takes over from a holder that stops
+LEADER_RETRY_SECONDS = 60.0
+
+
+@dataclass
+class Frame:
+    camera_id: int
+    user_id: int
+    captured_at: float  # time.monotonic() when read from the source
+    timestamp: datetime
+    data: Any = None  # encoded bytes or an already decoded RGB array
+    image: Optional[np.ndarray] = None
+    boxes: List[Box] = field(default_factory=list)
+    embeddings: Optional[np.ndarray] = None
+    events: List[DetectionCreate] = field(default_factory=list)
+    # (event, embedding) of unknown faces, for visitor clustering
+    unknown: List[Tuple[DetectionCreate, np.ndarray]] = field(default_factory=list)
+
+
+class DropOldestQueue:
+    """Thread-safe bounded FIFO that evicts the oldest item when full"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item) -> Optional[Any]:
+        """Append an item, returning the one evicted to make room, if any"""
+        with self._cond:
+            dropped = self._items.popleft() if len(self._items) >= self.maxsize else None
+            self._items.append(item)
+            self._cond.notify()
+            return dropped
+
+    def get(self, timeout: float) -> Optional[Any]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            return self._items.popleft() if self._items else None
+
+    def get_batch(self, max_items: int, max_wait: float, timeout: float) -> List[Any]:
+        """Wait up to timeout for a first item, then up to max_wait to fill a batch"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return []
+            deadline = time.monotonic() + max_wait
+            while len(self._items) < max_items and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+            return [self._items.popleft() for _ in range(min(max_items, len(self._items)))]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class StageStats:
+    """Throughput, drop and latency counters for one pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, count: int = 1):
+        with self._lock:
+            self.processed += count
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def drop(self, count: int = 1):
+        with self._lock:
+            self.dropped += count
+
+    def snapshot(self, elapsed: float) -> dict:
+        with self._lock:
+            return {
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "per_second": round(self.processed / elapsed, 1) if elapsed > 0 else 0.0,
+                "avg_ms": round(self.seconds / self.processed * 1000, 2) if self.processed else 0.0,
+                "max_ms": round(self.max_seconds * 1000, 2),
+            }
+
+
+class FrameSource:
+    """Produces frames for one camera
+
+    read() blocks until the next frame and returns encoded image bytes or
+    an RGB array, or None when no frame is available. ``finished`` becomes
+    true once a finite source is exhausted.
+    """
+    finished = False
+
+    def __init__(self, camera_id: int, user_id: int):
+        self.camera_id = camera_id
+        self.user_id = user_id
+        self.frames_sampled = 0
+        self.faces_found = 0
+
+    def read(self):
+        raise NotImplementedError
+
+    def reopen(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SyntheticFrameSource(FrameSource):
+    """Generates PNG frames at a fixed rate from a set of known face images
+
+    Each frame shows one of ``faces`` with probability ``known_ratio`` and
+    random noise (an unknown visitor) otherwise. Stands in for RTSP in
+    benchmarks; pair it with the "stub" detector and embedding model.
+    """
+
+    def __init__(
+        self,
+        camera_id: int,
+        user_id: int,
+        faces: List[np.ndarray],
+        fps: float = 10.0,
+        known_ratio: float = 0.5,
+        max_frames: Optional[int] = None,
+        seed: Optional[int] = None
+    ):
+        super().__init__(camera_id, user_id)
+        self.faces = faces
+        self.fps = fps
+        self.known_ratio = known_ratio
+        self.max_frames = max_frames
+        self._rng = random.Random(seed)
+        self._frames = 0
+        self._next_at = time.monotonic()
+        self._encoded = [encode_png(face) for face in faces]
+
+    def read(self):
+        if self.max_frames is not None and self._frames >= self.max_frames:
+            self.finished = True
+            return None
+        self._next_at += 1.0 / self.fps
+        delay = self._next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._frames += 1
+        if self._encoded and self._rng.random() < self.known_ratio:
+            return self._rng.choice(self._encoded)
+        shape = self.faces[0].shape if self.faces else (32, 32, 3)
+        return encode_png(np.random.default_rng(self._rng.getrandbits(32)).integers(0, 256, shape, dtype=np.uint8))
+
+
+class DirectoryFrameSource(FrameSource):
+    """Replays the image files of a directory in name order, optionally looping"""
+
+    def __init__(self, camera_id: int, user_id: int, path: str, fps: float = 5.0, loop: bool = True):
+        super().__init__(camera_id, user_id)
+        self.paths = sorted(
+            os.path.join(path, name) for name in os.listdir(path) if not name.startswith(".")
+        )
+        self.fps = fps
+        self.loop = loop
+        self._position = 0
+
+    def read(self):
+        if self._position >= len(self.paths):
+            if not self.loop or not self.paths:
+                self.finished = True
+                return None
+            self._position = 0
+        time.sleep(1.0 / self.fps)
+        path = self.paths[self._position]
+        self._position += 1
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class VideoCaptureSource(FrameSource):
+    """Reads an RTSP/HTTP stream or a video file through OpenCV"""
+
+    def __init__(self, camera_id: int, user_id: int, url: str):
+        super().__init__(camera_id, user_id)
+        self.url = url
+        self._capture = None
+
+    def reopen(self):
+        import cv2
+        self.close()
+        self._capture = cv2.VideoCapture(self.url)
+
+    def read(self):
+        if self._capture is None:
+            self.reopen()
+        ok, image = self._capture.read()
+        if not ok:
+            return None
+        # OpenCV decodes to BGR
+        return image[:, :, ::-1]
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    from PIL import Image
+    out = io.BytesIO()
+    Image.fromarray(image).save(out, "PNG")
+    return out.getvalue()
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def camera_stream_url(camera) -> str:
+    """rtsp:// URL for an IP camera row
+
+    Camera passwords are stored hashed, so the password entered for a
+    camera cannot be used. Cameras whose streams need authentication are
+    reached with RECOGNITION_RTSP_USERNAME/RECOGNITION_RTSP_PASSWORD, which
+    are the same for every camera.
+    """
+    host = str(getattr(camera.ip_address, "ip", camera.ip_address))
+    credentials = ""
+    if RECOGNITION_RTSP_USERNAME:
+        credentials = quote(RECOGNITION_RTSP_USERNAME, safe="")
+        if RECOGNITION_RTSP_PASSWORD:
+            credentials += ":" + quote(RECOGNITION_RTSP_PASSWORD, safe="")
+        credentials += "@"
+    return f"rtsp://{credentials}{host}:{camera.port}{RECOGNITION_RTSP_PATH}"
+
+
+class RecognitionPipeline:
+    """Runs frame sources through detection and matching into detection_logs
+
+    ``emit`` is a coroutine function ``emit(user_id, events)`` run on the
+    event loop passed to start(); events are DetectionCreate objects. It
+    defaults to ingestion.ingest_detections with its own session. With
+    ``cluster_unknown``, unknown faces are first assigned to recurring
+    visitor clusters (see visitor_clusters.py) and their events carry the
+    visitor_cluster_id.
+    """
+
+    def __init__(
+        self,
+        detector_name: str = RECOGNITION_DETECTOR,
+        model_name: str = FACE_EMBEDDING_MODEL,
+        sample_fps: float = RECOGNITION_SAMPLE_FPS,
+        max_frame_age: float = RECOGNITION_MAX_FRAME_AGE,
+        queue_size: int = RECOGNITION_QUEUE_SIZE,
+        decode_workers: int = RECOGNITION_DECODE_WORKERS,
+        detect_workers: int = RECOGNITION_DETECT_WORKERS,
+        embed_batch_size: int = RECOGNITION_EMBED_BATCH_SIZE,
+        embed_max_wait: float = RECOGNITION_EMBED_MAX_WAIT,
+        tolerance: float = DEFAULT_TOLERANCE,
+        emit_unknown: bool = True,
+        cluster_unknown: bool = True,
+        emit: Optional[Callable] = None,
+        shard_index: int = RECOGNITION_SHARD_INDEX,
+        shard_count: int = RECOGNITION_SHARD_COUNT
+    ):
+        self.detector_name = detector_name
+        self.model_name = model_name
+        self.sample_fps = sample_fps
+        self.max_frame_age = max_frame_age
+        self.decode_workers = decode_workers
+        self.detect_workers = detect_workers
+        self.embed_batch_size = embed_batch_size
+        self.embed_max_wait = embed_max_wait
+        self.tolerance = tolerance
+        self.emit_unknown = emit_unknown
+        self.cluster_unknown = cluster_unknown and visitor_clusters.enabled
+        self._emit = emit or _ingest
+        self.shard_index = shard_index
+        self.shard_count = max(1, shard_count)
+        self._lock = LeaderLock(ADVISORY_LOCK_KEY, self.shard_index)
+        self._lead_task: Optional[asyncio.Task] = None
+
+        self._queues = {
+            name: DropOldestQueue(queue_size)
+            for name in ("decode", "detect", "embed", "match", "emit")
+        }
+        self.stats_by_stage = {
+            name: StageStats(name)
+            for name in ("source", "decode", "detect", "embed", "match", "emit", "end_to_end")
+        }
+        self._sources: Dict[int, FrameSource] = {}
+        self._source_threads: Dict[int, threading.Thread] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started_at = 0.0
+        self.frames_without_faces = 0
+        self.faces_matched = 0
+        self.faces_unknown = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and not self._stopping.is_set()
+
+    async def start(self):
+        """Start the stage workers; sources can be added before or after"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping.clear()
+        self._started_at = time.monotonic()
+        # Models load in the worker threads' first call; load them up front
+        self._detector = await asyncio.to_thread(get_detector, self.detector_name)
+        self._model = await asyncio.to_thread(get_model, self.model_name)
+
+        workers = (
+            [("decode", self._decode)] * self.decode_workers
+            + [("detect", self._detect)] * self.detect_workers
+            + [("embed", None), ("match", self._match), ("emit", None)]
+        )
+        for name, fn in workers:
+            if name == "embed":
+                target, args = self._embed_loop, ()
+            elif name == "emit":
+                target, args = self._emit_loop, ()
+            else:
+                target, args = self._stage_loop, (name, fn)
+            thread = threading.Thread(target=target, args=args, name=f"recognition-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        for source in list(self._sources.values()):
+            self._start_source(source)
+
+    async def stop(self):
+        self._stopping.set()
+        for q in self._queues.values():
+            q.close()
+        threads = self._threads + list(self._source_threads.values())
+        await asyncio.to_thread(lambda: [thread.join(timeout=5) for thread in threads])
+        for source in self._sources.values():
+            source.close()
+        self._threads = []
+        self._source_threads = {}
+        self._queues = {name: DropOldestQueue(q.maxsize) for name, q in self._queues.items()}
+
+    async def start_streaming(self):
+        """Stream this shard's IP cameras in the one worker holding its lock"""
+        if self._lead_task is not None and not self._lead_task.done():
+            return
+        try:
+            if await self._lock.acquire():
+                await self._lead_start()
+        except Exception:
+            logger.exception("Starting live recognition failed")
+        self._lead_task = asyncio.create_task(self._lead())
+
+    async def stop_streaming(self):
+        if self._lead_task is not None:
+            self._lead_task.cancel()
+            await asyncio.gather(self._lead_task, return_exceptions=True)
+            self._lead_task = None
+        await self._lead_stop()
+
+    async def _lead(self):
+        while True:
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+            try:
+                if not self._lock.held:
+                    if await self._lock.acquire():
+                        await self._lead_start()
+                else:
+                    await self._lock.check()
+            except Exception:
+                logger.exception("Live recognition lock check failed")
+                await self._lead_stop()
+
+    async def _lead_start(self):
+        try:
+            await self.load_cameras()
+            await self.start()
+        except BaseException:
+            await self._lead_stop()
+            raise
+
+    async def _lead_stop(self):
+        await self.stop()
+        for camera_id in list(self._sources):
+            self.remove_source(camera_id)
+        await self._lock.release()
+
+    async def load_cameras(self):
+        """Track every IP camera of this shard"""
+        async with SessionLocal() as db:
+            cameras = (await db.scalars(
+                select(Camera).where(Camera.camera_type == "ip_camera", Camera.status != "disabled")
+            )).all()
+        for camera in cameras:
+            self.track_camera(camera)
+
+    def add_source(self, source: FrameSource) -> None:
+        """Start reading a camera, replacing any source it already has"""
+        self.remove_source(source.camera_id)
+        self._sources[source.camera_id] = source
+        if self.running:
+            self._start_source(source)
+
+    def remove_source(self, camera_id: int) -> None:
+        source = self._sources.pop(camera_id, None)
+        thread = self._source_threads.pop(camera_id, None)
+        if source is not None:
+            # The reader thread notices its source is gone and closes it
+            source.finished = True
+        if thread is None and source is not None:
+            source.close()
+
+    def track_camera(self, camera) -> None:
+        """Stream an IP camera, restarting only if its address changed"""
+        if (
+            camera.camera_type != "ip_camera" or camera.status == "disabled"
+            or not camera.ip_address or not camera.port or camera.id % self.shard_count != self.shard_index
+        ):
+            self.remove_source(camera.id)
+            return
+        url = camera_stream_url(camera)
+        current = self._sources.get(camera.id)
+        if getattr(current, "url", None) != url:
+            self.add_source(VideoCaptureSource(camera.id, camera.user_id, url))
+
+    def _start_source(self, source: FrameSource):
+        thread = threading.Thread(
+            target=self._read_loop, args=(source,), name=f"recognition-camera-{source.camera_id}", daemon=True
+        )
+        self._source_threads[source.camera_id] = thread
+        thread.start()
+
+    def _forward(self, stage: str, frame: Frame):
+        if self._queues[stage].put(frame) is not None:
+            self.stats_by_stage[stage].drop()
+
+    def _stale(self, frame: Frame) -> bool:
+        return time.monotonic() - frame.captured_at > self.max_frame_age
+
+    def _read_loop(self, source: FrameSource):
+        stats = self.stats_by_stage["source"]
+        min_gap = 1.0 / self.sample_fps if self.sample_fps > 0 else 0.0
+        next_at = 0.0
+        try:
+            while not self._stopping.is_set() and not source.finished:
+                try:
+                    data = source.read()
+                except Exception:
+                    logger.exception("Reading camera %s failed", source.camera_id)
+                    data = None
+                if data is None:
+                    if not source.finished and not self._stopping.wait(REOPEN_SECONDS):
+                        source.reopen()
+                    continue
+
+                now = time.monotonic()
+                if now < next_at:
+                    # Frame skipping: only sample_fps frames per camera go downstream
+                    stats.drop()
+                    continue
+                next_at = now + min_gap
+                stats.record(0.0)
+                source.frames_sampled += 1
+                self._forward("decode", Frame(
+                    camera_id=source.camera_id,
+                    user_id=source.user_id,
+                    captured_at=now,
+                    timestamp=datetime.utcnow(),
+                    data=data
+                ))
+        finally:
+            source.close()
+
+    def _stage_loop(self, name: str, fn: Callable[[Frame], Optional[str]]):
+        q = self._queues[name]
+        stats = self.stats_by_stage[name]
+        while not self._stopping.is_set():
+            frame = q.get(timeout=0.5)
+            if frame is None:
+                continue
+            if self._stale(frame):
+                stats.drop()
+                continue
+            started = time.monotonic()
+            try:
+                next_stage = fn(frame)
+            except Exception:
+                logger.exception("Recognition stage %s failed for camera %s", name, frame.camera_id)
+                continue
+            stats.record(time.monotonic() - started)
+            if next_stage:
+                self._forward(next_stage, frame)
+
+    def _decode(self, frame: Frame) -> Optional[str]:
+        frame.image = decode_image(frame.data) if isinstance(frame.data, bytes) else np.asarray(frame.data)
+        frame.data = None
+        return "detect"
+
+    def _detect(self, frame: Frame) -> Optional[str]:
+        frame.boxes = self._detector.detect(frame.image)
+        if not frame.boxes:
+            self.frames_without_faces += 1
+            return None
+        source = self._sources.get(frame.camera_id)
+        if source is not None:
+            source.faces_found += len(frame.boxes)
+        return "embed"
+
+    def _embed_loop(self):
+        q = self._queues["embed"]
+        stats = self.stats_by_stage["embed"]
+        while not self._stopping.is_set():
+            frames = q.get_batch(self.embed_batch_size, self.embed_max_wait, timeout=0.5)
+            fresh = [frame for frame in frames if not self._stale(frame)]
+            if len(fresh) < len(frames):
+                stats.drop(len(frames) - len(fresh))
+            if not fresh:
+                continue
+
+            # One model call for the faces of every frame in the batch,
+            # whichever cameras they came from
+            faces = [(frame.image, box) for frame in fresh for box in frame.boxes]
+            started = time.monotonic()
+            try:
+                embeddings = self._model.embed_faces(faces)
+            except Exception:
+                logger.exception("Embedding %d faces failed", len(faces))
+                continue
+            stats.record(time.monotonic() - started, len(fresh))
+
+            offset = 0
+            for frame in fresh:
+                frame.embeddings = embeddings[offset:offset + len(frame.boxes)]
+                offset += len(frame.boxes)
+                frame.image = None
+                self._forward("match", frame)
+
+    def _index(self, user_id: int) -> FaceIndex:
+        index = face_indexes.loaded(user_id)
+        if index is None:
+            future = asyncio.run_coroutine_threadsafe(_load_index(user_id), self._loop)
+            index = future.result(timeout=30)
+        return index
+
+    def _match(self, frame: Frame) -> Optional[str]:
+        events = []
+        unknown = []
+        matches = self._index(frame.user_id).match(frame.embeddings, tolerance=self.tolerance)
+        for match, embedding in zip(matches, frame.embeddings):
+            if match is None:
+                self.faces_unknown += 1
+                if not self.emit_unknown:
+                    continue
+                face_id, confidence = None, None
+            else:
+                self.faces_matched += 1
+                face_id, confidence = match.face_id, round(max(0.0, 1.0 - match.distance), 4)
+            event = DetectionCreate(
+                camera_id=frame.camera_id,
+                registered_face_id=face_id,
+                detection_confidence=confidence,
+                detected_at=frame.timestamp
+            )
+            events.append(event)
+            if match is None and self.cluster_unknown:
+                unknown.append((event, embedding))
+        frame.embeddings = None
+        frame.events = events
+        frame.unknown = unknown
+        return "emit" if events else None
+
+    def _emit_loop(self):
+        q = self._queues["emit"]
+        stats = self.stats_by_stage["emit"]
+        while not self._stopping.is_set():
+            frames = q.get_batch(EMIT_BATCH_SIZE, EMIT_MAX_WAIT, timeout=0.5)
+            if not frames:
+                continue
+            by_user: Dict[int, list] = {}
+            unknown_by_user: Dict[int, list] = {}
+            for frame in frames:
+                by_user.setdefault(frame.user_id, []).extend(frame.events)
+                unknown_by_user.setdefault(frame.user_id, []).extend(frame.unknown)
+
+            started = time.monotonic()
+            for user_id, events in by_user.items():
+                future = asyncio.run_coroutine_threadsafe(
+                    self._cluster_and_emit(user_id, events, unknown_by_user[user_id]), self._loop
+                )
+                try:
+                    # Waiting here is the backpressure on database writes
+                    future.result(timeout=30)
+                except Exception:
+                    logger.exception("Writing %d detections for user %s failed", len(events), user_id)
+            now = time.monotonic()
+            stats.record(now - started, len(frames))
+            for frame in frames:
+                self.stats_by_stage["end_to_end"].record(now - frame.captured_at)
+
+    async def _cluster_and_emit(self, user_id: int, events: list, unknown: list):
+        if unknown:
+            try:
+                cluster_ids = await visitor_clusters.assign(
+                    user_id, [embedding for _, embedding in unknown], [event.detected_at for event, _ in unknown]
+                )
+            except Exception:
+                # The detections are still worth writing without their cluster
+                logger.exception("Clustering %d unknown faces for user %s failed", len(unknown), user_id)
+            else:
+                for (event, _), cluster_id in zip(unknown, cluster_ids):
+                    event.visitor_cluster_id = cluster_id
+        return await self._emit(user_id, events)
+
+    def user_stats(self, user_id: int) -> dict:
+        """What this worker streams of one user's cameras
+
+        Stage and queue counters cover every tenant and are only exported
+        through /metrics.
+        """
+        sources = sorted(
+            (source for source in self._sources.values() if source.user_id == user_id),
+            key=lambda source: source.camera_id
+        )
+        return {
+            "running": self.running,
+            "cameras": [
+                {
+                    "camera_id": source.camera_id,
+                    "frames_sampled": source.frames_sampled,
+                    "faces_found": source.faces_found,
+                }
+                for source in sources
+            ],
+        }
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "running": self.running,
+            "cameras": len(self._sources),
+            "queues": {name: len(q) for name, q in self._queues.items()},
+            "stages": {name: stats.snapshot(elapsed) for name, stats in self.stats_by_stage.items()},
+            "frames_without_faces": self.frames_without_faces,
+            "faces_matched": self.faces_matched,
+            "faces_unknown": self.faces_unknown,
+        }
+
+
+async def _load_index(user_id: int) -> FaceIndex:
+    async with SessionLocal() as db:
+        return await face_indexes.get(db, user_id)
+
+
+async def _ingest(user_id: int, events: list):
+    async with SessionLocal() as db:
+        return await ingest_detections(db, user_id, events)
+
+
+recognition_pipeline = RecognitionPipeline()
@@ -0,0 +1,300 @@
+"""Detection log partition maintenance and per-package data retention
+
+On PostgreSQL, detection_logs is range partitioned by month on detected_at
+(see migrations/0003_partition_detection_logs.sql). The job keeps
+partitions created ahead of time, drops whole partitions once every
+tenant's retention has passed them, and deletes rows that outlive a
+shorter package retention in small batches. Packages without a
+data_retention_days keep their history forever.
+Snapshot images of removed rows are deleted from uploads/detections.
+
+Runs inside the API on a timer, or once from cron:
+
+    python -m retention
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database import SessionLocal, engine, IS_SQLITE
+from models import DetectionLog, Package, User
+from uploads import remove_detection_images
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() in ("1", "true", "yes")
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+# Applies to users without a package
+DEFAULT_RETENTION_DAYS = int(os.getenv("DEFAULT_RETENTION_DAYS", "90"))
+RETENTION_DELETE_BATCH_SIZE = int(os.getenv("RETENTION_DELETE_BATCH_SIZE", "5000"))
+# Detach expired partitions instead of dropping them, e.g. to archive them
+RETENTION_DETACH_ONLY = os.getenv("RETENTION_DETACH_ONLY", "false").lower() in ("1", "true", "yes")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+
+PARTITION_PREFIX = "detection_logs_p"
+# Only one API worker runs the job at a time
+ADVISORY_LOCK_KEY = 0x64657465  # "dete"
+
+
+@dataclass
+class RetentionReport:
+    partitions_created: List[str] = field(default_factory=list)
+    partitions_removed: List[str] = field(default_factory=list)
+    rows_deleted: int = 0
+    files_deleted: int = 0
+    skipped: bool = False
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    if IS_SQLITE:
+        return False
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'detection_logs')"
+    )))
+
+
+async def list_partitions(conn: AsyncConnection) -> List[str]:
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'detection_logs' AND c.relname LIKE :prefix"
+    ), {"prefix": PARTITION_PREFIX + "%"})
+    return sorted(result.scalars().all())
+
+
+async def ensure_partitions(conn: AsyncConnection, today: date, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create monthly partitions from this month to months_ahead
+
+    Created ahead of time so rows never land in the default partition,
+    which would block creating the matching partition later.
+    """
+    existing = set(await list_partitions(conn))
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(month_start(today), offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF detection_logs "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+async def longest_retention_days(conn: AsyncConnection) -> Optional[int]:
+    """Longest retention any user is entitled to, None if some keep history forever"""
+    in_use = Package.id.in_(select(User.package_id).where(User.package_id.isnot(None)))
+    if await conn.scalar(select(func.count()).where(in_use, Package.data_retention_days.is_(None))):
+        return None
+    package_days = await conn.scalar(select(func.max(Package.data_retention_days)).where(in_use))
+    return max(package_days or 0, DEFAULT_RETENTION_DAYS)
+
+
+async def expired_partitions(conn: AsyncConnection, today: date) -> List[str]:
+    """Monthly partitions older than every tenant's retention"""
+    days = await longest_retention_days(conn)
+    if days is None:
+        return []
+    cutoff = today - timedelta(days=days)
+    expired = []
+    for name in await list_partitions(conn):
+        try:
+            month = datetime.strptime(name[len(PARTITION_PREFIX):], "%Y_%m").date()
+        except ValueError:
+            continue
+        if add_months(month, 1) <= cutoff:
+            expired.append(name)
+    return expired
+
+
+async def partition_snapshot_paths(name: str, batch_size: int = RETENTION_DELETE_BATCH_SIZE):
+    """Yield the snapshot paths of an expired partition's rows in batches
+
+    Read outside the transaction that removes the partition, so its lock
+    is held only briefly and memory does not grow with the partition.
+    """
+    async with engine.connect() as conn:
+        result = await conn.stream(text(
+            f"SELECT detection_image_path FROM {name} WHERE detection_image_path IS NOT NULL"
+        ))
+        async for paths in result.scalars().partitions(batch_size):
+            yield paths
+
+
+async def remove_partition(conn: AsyncConnection, name: str, detach_only: bool = RETENTION_DETACH_ONLY):
+    """Detach an expired partition and, unless detach_only, drop it"""
+    await conn.execute(text(f"ALTER TABLE detection_logs DETACH PARTITION {name}"))
+    if not detach_only:
+        await conn.execute(text(f"DROP TABLE {name}"))
+
+
+async def delete_expired_rows(
+    retention_days: int,
+    users,
+    today: date,
+    batch_size: int = RETENTION_DELETE_BATCH_SIZE
+):
+    """Delete a group of users' detections older than retention_days in batches
+
+    ``users`` is a select of user ids. Each batch is its own short
+    transaction, found through the (user_id, detected_at) index. Yields
+    (rows deleted, snapshot paths) per batch.
+    """
+    cutoff = datetime.combine(today - timedelta(days=retention_days), datetime.min.time())
+    while True:
+        batch = select(DetectionLog.id).where(
+            DetectionLog.user_id.in_(users),
+            DetectionLog.detected_at < cutoff
+        ).limit(batch_size)
+        async with SessionLocal() as db:
+            result = await db.execute(
+                delete(DetectionLog).where(
+                    DetectionLog.id.in_(batch.scalar_subquery()),
+                    # Lets PostgreSQL prune partitions newer than the cutoff
+                    DetectionLog.detected_at < cutoff
+                ).returning(DetectionLog.detection_image_path).execution_options(synchronize_session=False)
+            )
+            paths = result.scalars().all()
+            await db.commit()
+        if not paths:
+            return
+        yield len(paths), paths
+        if len(paths) < batch_size:
+            return
+        # Give other work a turn between batches
+        await asyncio.sleep(0)
+
+
+async def retention_groups(conn: AsyncConnection):
+    """(retention_days, select of user ids) for every retention in use
+
+    Users of packages without a retention are in no group.
+    """
+    result = await conn.execute(
+        select(Package.id, Package.data_retention_days).where(Package.data_retention_days.isnot(None))
+    )
+    by_days = {}
+    for package_id, days in result.all():
+        by_days.setdefault(days, []).append(package_id)
+
+    groups = []
+    for days, package_ids in sorted(by_days.items()):
+        condition = User.package_id.in_(package_ids)
+        if days == DEFAULT_RETENTION_DAYS:
+            condition = or_(condition, User.package_id.is_(None))
+        groups.append((days, select(User.id).where(condition)))
+    if DEFAULT_RETENTION_DAYS not in by_days:
+        groups.append((DEFAULT_RETENTION_DAYS, select(User.id).where(User.package_id.is_(None))))
+    return groups
+
+
+async def run_retention(today: Optional[date] = None) -> RetentionReport:
+    """Run partition maintenance and retention deletes once"""
+    # detected_at is stored as naive UTC
+    today = today or datetime.utcnow().date()
+    report = RetentionReport()
+
+    async with engine.connect() as lock_conn:
+        if not IS_SQLITE:
+            if not await lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}):
+                report.skipped = True
+                return report
+        try:
+            async with engine.begin() as conn:
+                partitioned = await is_partitioned(conn)
+                groups = await retention_groups(conn)
+                expired = []
+                if partitioned:
+                    report.partitions_created = await ensure_partitions(conn, today)
+                    expired = await expired_partitions(conn, today)
+
+            for name in expired:
+                async for paths in partition_snapshot_paths(name):
+                    report.files_deleted += await asyncio.to_thread(remove_detection_images, paths)
+                async with engine.begin() as conn:
+                    await remove_partition(conn, name)
+                report.partitions_removed.append(name)
+
+            for days, users in groups:
+                async for deleted, batch_paths in delete_expired_rows(days, users, today):
+                    report.rows_deleted += deleted
+                    report.files_deleted += await asyncio.to_thread(remove_detection_images, batch_paths)
+        finally:
+            if not IS_SQLITE:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                await lock_conn.commit()
+    return report
+
+
+class RetentionJob:
+    """Runs run_retention every RETENTION_INTERVAL_SECONDS in the background"""
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Optional[RetentionReport] = None
+        self.last_run_at: Optional[datetime] = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.last_report = await run_retention()
+                self.last_run_at = datetime.utcnow()
+                if self.last_report.partitions_removed or self.last_report.rows_deleted:
+                    logger.info("Retention: %s", self.last_report)
+            except Exception:
+                logger.exception("Detection log retention failed")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        report = self.last_report
+        return {
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "partitions_created": len(report.partitions_created) if report else 0,
+            "partitions_removed": len(report.partitions_removed) if report else 0,
+            "rows_deleted": report.rows_deleted if report else 0,
+            "files_deleted": report.files_deleted if report else 0,
+        }
+
+
+retention_job = RetentionJob()
+
+
+if __name__ == "__main__":
+    print(asyncio.run(run_retention()))
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr, validator
+from pydantic import BaseModel, EmailStr, Field, validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from decimal import Decimal
 
+from storage_keys import DETECTIONS_PREFIX, key_for_path
+
 # Package schemas
 class PackageResponse(BaseModel):
     id: int
@@ -13,6 +15,7 @@ class PackageResponse(BaseModel):
     features: Optional[List[str]]
     camera_limit: Optional[int]
     max_registered_faces: Optional[int]
+    data_retention_days: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -122,6 +125,8 @@ class FaceResponse(BaseModel):
     id: int
     face_name: str
     face_image_path: Optional[str]
+    thumbnail_path: Optional[str] = None
+    encoding_status: Optional[str] = None
     is_active: bool
     created_at: datetime
     updated_at: datetime
@@ -129,6 +134,18 @@ class FaceResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class FaceBulkItem(BaseModel):
+    filename: str
+    face_name: str
+    status: str  # "created" or "rejected"
+    detail: Optional[str] = None
+    face: Optional[FaceResponse] = None
+
+class FaceBulkResponse(BaseModel):
+    created: int
+    rejected: int
+    results: List[FaceBulkItem]
+
 # Detection log schemas
 class DetectionLogResponse(BaseModel):
     id: int
@@ -137,6 +154,8 @@ class DetectionLogResponse(BaseModel):
     detection_confidence: Optional[Decimal]
     detection_image_path: Optional[str]
     detected_at: datetime
+    last_seen_at: Optional[datetime] = None
+    hit_count: int = 1
     created_at: datetime
     
     # Nested objects
@@ -144,4 +163,28 @@ class DetectionLogResponse(BaseModel):
     registered_face: Optional[Dict[str, Any]]
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class DetectionCreate(BaseModel):
+    camera_id: int
+    registered_face_id: Optional[int] = None
+    detection_confidence: Optional[Decimal] = Field(None, ge=0, le=1)
+    detection_image_path: Optional[str] = None
+    detected_at: Optional[datetime] = None
+    # Recurring unknown visitor, set by the recognition pipeline
+    visitor_cluster_id: Optional[int] = None
+
+    @validator('detection_image_path')
+    def validate_detection_image_path(cls, v):
+        # Retention deletes this file with the detection, so it must be a snapshot
+        key = key_for_path(v) if v is not None else None
+        if v is not None and (key is None or not key.startswith(DETECTIONS_PREFIX + "/")):
+            raise ValueError('detection_image_path must be an uploads/detections/ path')
+        return v
+
+class DetectionBatchCreate(BaseModel):
+    detections: List[DetectionCreate]
+
+class DetectionBatchResponse(BaseModel):
+    accepted: int
+    merged: int = 0  # accepted events folded into an existing detection
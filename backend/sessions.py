@@ -0,0 +1,253 @@
+"""Login sessions: revocation and expiry
+
+Every issued JWT has a user_sessions row keyed by its jti claim. Logging
+out sets revoked_at on the row. Each API worker keeps the jtis of revoked,
+unexpired sessions in memory, so authenticate_token checks revocation
+with a dict lookup. The set is refreshed by polling only the rows revoked
+since the last poll. The same background task deletes expired rows in
+small batches.
+
+The event stream is opened with a single-use stream ticket rather than
+the access token, because EventSource puts it in the URL, where access
+logs, proxies and browser history keep it.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal
+from models import StreamTicket, UserSession
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAINTENANCE_ENABLED = os.getenv("SESSION_MAINTENANCE_ENABLED", "true").lower() in ("1", "true", "yes")
+# How quickly a logout on another worker takes effect here
+SESSION_REVOCATION_REFRESH_SECONDS = float(os.getenv("SESSION_REVOCATION_REFRESH_SECONDS", "5"))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "600"))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "5000"))
+# Revocations committed this long after their revoked_at timestamp are
+# still picked up by the incremental refresh
+REVOCATION_OVERLAP = timedelta(seconds=60)
+# A stream ticket must be redeemed this soon after it is issued
+STREAM_TICKET_SECONDS = 30
+
+
+def _ticket_hash(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+def new_session(user_id: int, expires_delta: timedelta) -> UserSession:
+    """A session row for a token about to be issued"""
+    return UserSession(
+        user_id=user_id,
+        jti=uuid.uuid4().hex,
+        expires_at=datetime.utcnow() + expires_delta
+    )
+
+
+class SessionStore:
+    """In-memory revocation set plus the refresh and expiry sweep loop"""
+
+    def __init__(
+        self,
+        refresh_seconds: float = SESSION_REVOCATION_REFRESH_SECONDS,
+        sweep_seconds: float = SESSION_SWEEP_INTERVAL_SECONDS,
+        sweep_batch_size: int = SESSION_SWEEP_BATCH_SIZE
+    ):
+        self.refresh_seconds = refresh_seconds
+        self.sweep_seconds = sweep_seconds
+        self.sweep_batch_size = sweep_batch_size
+        # jti -> expires_at; expired entries are pruned by sweep()
+        self._revoked: Dict[str, datetime] = {}
+        self._watermark: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.swept = 0
+        self.last_sweep_at: Optional[datetime] = None
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def _add(self, rows: List[Tuple[str, datetime]]):
+        with self._lock:
+            for jti, expires_at in rows:
+                self._revoked[jti] = expires_at
+
+    async def refresh(self):
+        """Load sessions revoked since the last refresh, all of them the first time"""
+        now = datetime.utcnow()
+        query = select(UserSession.jti, UserSession.expires_at, UserSession.revoked_at).where(
+            UserSession.revoked_at.isnot(None),
+            UserSession.expires_at > now
+        )
+        if self._watermark is not None:
+            query = query.where(UserSession.revoked_at > self._watermark - REVOCATION_OVERLAP)
+        async with SessionLocal() as db:
+            rows = (await db.execute(query)).all()
+
+        self._add([(row.jti, row.expires_at) for row in rows])
+        latest = max((row.revoked_at for row in rows), default=None)
+        if latest is not None and (self._watermark is None or latest > self._watermark):
+            self._watermark = latest
+        elif self._watermark is None:
+            self._watermark = now
+        self.refreshes += 1
+
+    async def revoke(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        jti: str,
+        expires_at: Optional[datetime] = None
+    ) -> int:
+        """Revoke one of the user's sessions by its jti
+
+        ``expires_at`` (the token's exp) lets a token without a session
+        row, issued before sessions were keyed by jti, be revoked too.
+        """
+        if not jti:
+            raise ValueError("jti is required; use revoke_all to end every session")
+        now = datetime.utcnow()
+        rows = await self._revoke_where(db, now, UserSession.user_id == user_id, UserSession.jti == jti)
+        if not rows and expires_at is not None and expires_at > now:
+            exists = await db.scalar(select(UserSession.id).where(UserSession.jti == jti))
+            if exists is None:
+                db.add(UserSession(user_id=user_id, jti=jti, expires_at=expires_at, revoked_at=now))
+                rows = [(jti, expires_at)]
+        return await self._commit(db, rows)
+
+    async def revoke_all(self, db: AsyncSession, user_id: int) -> int:
+        """Revoke every unexpired session of the user"""
+        rows = await self._revoke_where(db, datetime.utcnow(), UserSession.user_id == user_id)
+        return await self._commit(db, rows)
+
+    async def _revoke_where(self, db: AsyncSession, now: datetime, *conditions) -> List[Tuple[str, datetime]]:
+        result = await db.execute(
+            update(UserSession).where(
+                *conditions,
+                UserSession.revoked_at.is_(None),
+                UserSession.expires_at > now
+            ).values(revoked_at=now).returning(
+                UserSession.jti, UserSession.expires_at
+            ).execution_options(synchronize_session=False)
+        )
+        return [tuple(row) for row in result.all()]
+
+    async def _commit(self, db: AsyncSession, rows: List[Tuple[str, datetime]]) -> int:
+        await db.commit()
+        # Takes effect here immediately, on other workers at their next refresh
+        self._add(rows)
+        return len(rows)
+
+    async def issue_stream_ticket(self, db: AsyncSession, user_id: int, session_jti: Optional[str]) -> str:
+        """A ticket that opens one event stream for the user within STREAM_TICKET_SECONDS"""
+        ticket = secrets.token_urlsafe(32)
+        db.add(StreamTicket(
+            user_id=user_id,
+            ticket_hash=_ticket_hash(ticket),
+            session_jti=session_jti,
+            expires_at=datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS)
+        ))
+        await db.commit()
+        return ticket
+
+    async def redeem_stream_ticket(self, db: AsyncSession, ticket: str) -> Optional[int]:
+        """Consume a stream ticket, returning its user id if it is still valid
+
+        The ticket row is deleted as it is read, so each ticket opens one
+        stream even across workers.
+        """
+        row = (await db.execute(
+            delete(StreamTicket).where(StreamTicket.ticket_hash == _ticket_hash(ticket)).returning(
+                StreamTicket.user_id, StreamTicket.session_jti, StreamTicket.expires_at
+            ).execution_options(synchronize_session=False)
+        )).first()
+        await db.commit()
+        if row is None or row.expires_at <= datetime.utcnow() or self.is_revoked(row.session_jti):
+            return None
+        return row.user_id
+
+    async def sweep(self) -> int:
+        """Delete expired sessions in batches and forget expired revocations"""
+        deleted = 0
+        now = datetime.utcnow()
+        # Unredeemed stream tickets; only ever a handful
+        async with SessionLocal() as db:
+            await db.execute(
+                delete(StreamTicket).where(StreamTicket.expires_at <= now).execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        while True:
+            batch = select(UserSession.id).where(UserSession.expires_at <= now).limit(self.sweep_batch_size)
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    delete(UserSession).where(
+                        UserSession.id.in_(batch.scalar_subquery())
+                    ).execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            deleted += result.rowcount
+            if result.rowcount < self.sweep_batch_size:
+                break
+            # Give other work a turn between batches
+            await asyncio.sleep(0)
+        with self._lock:
+            # Expired tokens are rejected by their exp claim anyway
+            for jti in [jti for jti, expires_at in self._revoked.items() if expires_at <= now]:
+                del self._revoked[jti]
+        self.swept += deleted
+        self.last_sweep_at = datetime.utcnow()
+        return deleted
+
+    async def _run(self):
+        next_sweep = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self.refresh()
+                if loop.time() >= next_sweep:
+                    next_sweep = loop.time() + self.sweep_seconds
+                    deleted = await self.sweep()
+                    if deleted:
+                        logger.info("Deleted %d expired sessions", deleted)
+            except Exception:
+                logger.exception("Session maintenance failed")
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def start(self):
+        """Load the revocation set, then keep it fresh in the background"""
+        if self._task is not None and not self._task.done():
+            return
+        await self.refresh()
+        if SESSION_MAINTENANCE_ENABLED:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "revoked": len(self._revoked),
+            "refreshes": self.refreshes,
+            "swept": self.swept,
+            "last_sweep_at": self.last_sweep_at.isoformat() if self.last_sweep_at else None,
+        }
+
+
+session_store = SessionStore()
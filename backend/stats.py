@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import extract, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import RegisteredFace, DetectionLog
+
+# How long in-memory counters are trusted before being reconciled against
+# the source tables (covers detections ingested by other workers)
+RECONCILE_SECONDS = 300
+
+
+@dataclass
+class UserStats:
+    active_faces: int = 0
+    # UTC day the buckets count, as detected_at is stored in UTC
+    day: Optional[date] = None
+    # (camera_id, hour) -> alert count
+    buckets: Dict[Tuple[int, int], int] = field(default_factory=lambda: defaultdict(int))
+    reconciled_at: float = 0.0
+    # Wall clock (UTC) of the last reconcile; earlier hours are not recounted
+    reconciled_through: Optional[datetime] = None
+
+    def add_alert(self, camera_id: int, detected_at: datetime, count: int = 1):
+        if detected_at.date() == self.day:
+            self.buckets[(camera_id, detected_at.hour)] += count
+
+    def snapshot(self) -> dict:
+        by_camera = defaultdict(int)
+        by_hour = [0] * 24
+        for (camera_id, hour), count in self.buckets.items():
+            by_camera[camera_id] += count
+            by_hour[hour] += count
+        return {
+            "alerts": sum(by_hour),
+            "active_faces": self.active_faces,
+            "alerts_by_camera": [
+                {"camera_id": camera_id, "count": count}
+                for camera_id, count in sorted(by_camera.items())
+            ],
+            "alerts_by_hour": by_hour,
+        }
+
+
+class DashboardStats:
+    """Per-user dashboard counters maintained incrementally
+
+    Detections and face changes update the counters as they happen, so the
+    dashboard is served from memory. Today's (UTC) counters are counted
+    from detection_logs on first use; every RECONCILE_SECONDS after that
+    only the hours since the previous reconcile are recounted, which bounds
+    drift across workers without rescanning the day.
+    """
+
+    def __init__(self, reconcile_seconds: float = RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._users: Dict[int, UserStats] = {}
+        self._lock = threading.Lock()
+
+    async def reconcile(self, db: AsyncSession, user_id: int) -> UserStats:
+        """Recount a user's counters from the source tables"""
+        now = datetime.utcnow()
+        with self._lock:
+            stats = self._users.get(user_id)
+        if stats is None or stats.day != now.date() or stats.reconciled_through is None:
+            stats = UserStats(day=now.date())
+            since = datetime.combine(stats.day, datetime.min.time())
+        else:
+            since = stats.reconciled_through.replace(minute=0, second=0, microsecond=0)
+
+        active_faces = await db.scalar(
+            select(func.count(RegisteredFace.id)).where(
+                RegisteredFace.user_id == user_id,
+                RegisteredFace.is_active == True
+            )
+        )
+        hour = extract("hour", DetectionLog.detected_at)
+        rows = (await db.execute(
+            select(DetectionLog.camera_id, hour, func.count(DetectionLog.id)).where(
+                DetectionLog.user_id == user_id,
+                DetectionLog.detected_at >= since,
+                DetectionLog.detected_at < datetime.combine(stats.day + timedelta(days=1), datetime.min.time())
+            ).group_by(DetectionLog.camera_id, hour)
+        )).all()
+
+        with self._lock:
+            stats.active_faces = active_faces
+            for key in [key for key in stats.buckets if key[1] >= since.hour]:
+                del stats.buckets[key]
+            for camera_id, row_hour, count in rows:
+                stats.buckets[(camera_id, int(row_hour))] += count
+            stats.reconciled_at = time.monotonic()
+            stats.reconciled_through = now
+            self._users[user_id] = stats
+        return stats
+
+    async def get(self, db: AsyncSession, user_id: int) -> dict:
+        """Return today's (UTC) stats for a user, reconciling if stale"""
+        with self._lock:
+            stats = self._users.get(user_id)
+        if (
+            stats is None
+            or stats.day != datetime.utcnow().date()
+            or time.monotonic() - stats.reconciled_at >= self.reconcile_seconds
+        ):
+            stats = await self.reconcile(db, user_id)
+
+        with self._lock:
+            return stats.snapshot()
+
+    def record_detections(self, user_id: int, detections: Iterable[dict]) -> None:
+        """Count newly ingested detection rows"""
+        with self._lock:
+            stats = self._users.get(user_id)
+            if stats is None:
+                return
+            for detection in detections:
+                stats.add_alert(detection["camera_id"], detection["detected_at"])
+
+    def adjust_active_faces(self, user_id: int, delta: int) -> None:
+        """Apply a change in the number of active registered faces"""
+        with self._lock:
+            stats = self._users.get(user_id)
+            if stats is not None:
+                stats.active_faces = max(0, stats.active_faces + delta)
+
+    def invalidate(self, user_id: int) -> None:
+        """Force a reconcile on next read, e.g. after deleting a camera"""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+dashboard_stats = DashboardStats()
@@ -0,0 +1,437 @@
+"""Content-addressed image storage behind /uploads
+
+Objects are addressed by keys such as ``faces/ab/cd/<sha256>.jpg``: the
+content hash names the file and its first two byte pairs shard the
+directory so no single directory grows unbounded. Rows store the public
+path ``uploads/<key>``. Files saved before sharding (``faces/<sha256>.jpg``)
+or before content addressing (``faces/<user>_<face name>_<file name>``,
+often with spaces) keep working as plain keys.
+
+Two backends: the local filesystem (default) and S3 or any S3-compatible
+server such as MinIO, selected with STORAGE_BACKEND. serve_object answers
+GET/HEAD /uploads/<key> with strong ETags, immutable caching for
+content-addressed keys, single byte ranges and zero-copy sends where the
+server supports them.
+
+Copy an existing local uploads directory into the configured backend with:
+
+    python -m storage upload-local uploads
+"""
+import hashlib
+import mimetypes
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from dotenv import load_dotenv
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from storage_keys import is_valid_key, is_content_addressed, key_for_path
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "filesystem")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "uploads")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+# Hand filesystem downloads to nginx (X-Accel-Redirect) under this internal location
+STORAGE_ACCEL_REDIRECT = os.getenv("STORAGE_ACCEL_REDIRECT", "")
+
+READ_CHUNK_SIZE = 256 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, max-age=3600"
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    etag: str
+    content_type: str
+    modified: float
+
+    @property
+    def immutable(self) -> bool:
+        return is_content_addressed(self.key)
+
+
+def _object_etag(key: str, size: int, modified: float) -> str:
+    # A content-addressed key always names the same bytes, so the key
+    # itself is a strong validator
+    if is_content_addressed(key):
+        return '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+    return '"%x-%x"' % (size, int(modified * 1_000_000))
+
+
+def _content_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+class StorageBackend:
+    """Blocking object store interface; call from the threadpool"""
+    name = ""
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def put_file(self, local_path: str, key: str, content_type: Optional[str] = None) -> None:
+        """Store a local file under key, consuming local_path"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def read_chunks(self, key: str, start: int, end: int, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield bytes start..end (inclusive) of an object"""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of the object on local disk, when the backend has one"""
+        return None
+
+    def staging_dir(self) -> str:
+        """Where uploads are spooled before put_file"""
+        return tempfile.gettempdir()
+
+    @contextmanager
+    def local_copy(self, key: str) -> Iterator[str]:
+        """A local file with the object's contents for libraries that need a path"""
+        path = self.local_path(key)
+        if path is not None:
+            yield path
+            return
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        try:
+            with os.fdopen(fd, "wb") as out:
+                obj = self.stat(key)
+                if obj is not None and obj.size:
+                    for chunk in self.read_chunks(key, 0, obj.size - 1):
+                        out.write(chunk)
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+
+class FilesystemStorage(StorageBackend):
+    """Objects as files under root, one directory level per key segment"""
+    name = "filesystem"
+
+    def __init__(self, root: str = STORAGE_ROOT):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, *key.split("/")))
+        # is_valid_key already refuses traversal; this also covers unchecked callers
+        if os.path.commonpath([self.root, path]) != self.root or path == self.root:
+            raise ValueError(f"Storage key {key!r} resolves outside {self.root}")
+        return path
+
+    def stat(self, key):
+        try:
+            result = os.stat(self._path(key))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat.S_ISREG(result.st_mode):
+            return None
+        return StoredObject(
+            key=key,
+            size=result.st_size,
+            etag=_object_etag(key, result.st_size, result.st_mtime),
+            content_type=_content_type(key),
+            modified=result.st_mtime,
+        )
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def put_file(self, local_path, key, content_type=None):
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Same filesystem as staging_dir, so this is an atomic rename
+        os.replace(local_path, destination)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def read_chunks(self, key, start, end, chunk_size=READ_CHUNK_SIZE):
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def staging_dir(self):
+        path = os.path.join(self.root, ".staging")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3 bucket or an S3-compatible server (MinIO, LocalStack)
+
+    Needs boto3. Credentials come from the usual AWS_* variables or profile.
+    """
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+        region: Optional[str] = S3_REGION,
+        prefix: str = S3_PREFIX
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.prefix = prefix
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use so worker processes each build their own
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        modified = head["LastModified"].timestamp()
+        return StoredObject(
+            key=key,
+            size=head["ContentLength"],
+            etag=_object_etag(key, head["ContentLength"], modified) if is_content_addressed(key) else head["ETag"],
+            content_type=head.get("ContentType") or _content_type(key),
+            modified=modified,
+        )
+
+    def put_file(self, local_path, key, content_type=None):
+        cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(key) else MUTABLE_CACHE_CONTROL
+        try:
+            self.client.upload_file(
+                local_path, self.bucket, self._object_key(key),
+                ExtraArgs={"ContentType": content_type or _content_type(key), "CacheControl": cache_control}
+            )
+        finally:
+            os.remove(local_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def read_chunks(self, key, start, end, chunk_size=READ_CHUNK_SIZE):
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._object_key(key), Range=f"bytes={start}-{end}"
+        )
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+
+BACKENDS = {
+    FilesystemStorage.name: FilesystemStorage,
+    S3Storage.name: S3Storage,
+}
+
+
+def get_storage(name: str = STORAGE_BACKEND) -> StorageBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {name!r}. Choose from {sorted(BACKENDS)}")
+
+
+storage = get_storage()
+
+
+@contextmanager
+def local_files(paths: Sequence[Optional[str]]) -> Iterator[List[Optional[str]]]:
+    """Local files for stored ``uploads/<key>`` paths, in order
+
+    Other paths are passed through unchanged, as are missing objects so the
+    caller's open() fails for that item alone.
+    """
+    copies, managers = [], []
+    try:
+        for path in paths:
+            key = key_for_path(path)
+            if key is None or not storage.exists(key):
+                copies.append((storage.local_path(key) if key else None) or path)
+                continue
+            manager = storage.local_copy(key)
+            copies.append(manager.__enter__())
+            managers.append(manager)
+        yield copies
+    finally:
+        for manager in reversed(managers):
+            manager.__exit__(None, None, None)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of a single ``bytes=`` range, None to send the whole object
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        # Multiple ranges are allowed to be answered with the full body
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+class ObjectResponse(Response):
+    """Streams a byte range of a stored object
+
+    Local files go out with the ASGI zero-copy send extension when the
+    server offers it; otherwise chunks are read in the threadpool.
+    """
+
+    def __init__(self, obj: StoredObject, start: int, end: int, status_code: int, headers: dict, head_only: bool):
+        super().__init__(status_code=status_code, headers=headers, media_type=obj.content_type)
+        self.obj = obj
+        self.start = start
+        self.end = end
+        self.head_only = head_only
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        length = self.end - self.start + 1
+        if self.head_only or length <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        local_path = storage.local_path(self.obj.key)
+        if local_path is not None and "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(local_path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": self.start,
+                    "count": length,
+                    "more_body": False,
+                })
+            return
+
+        async for chunk in iterate_in_threadpool(storage.read_chunks(self.obj.key, self.start, self.end)):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+async def serve_object(key: str, request: Request) -> Response:
+    """Answer GET/HEAD for a stored object with validators, caching and ranges"""
+    obj = await run_in_threadpool(storage.stat, key) if is_valid_key(key) else None
+    if obj is None:
+        return Response(status_code=404)
+
+    headers = {
+        "ETag": obj.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if obj.immutable else MUTABLE_CACHE_CONTROL,
+        "Last-Modified": formatdate(obj.modified, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, obj.etag):
+        return Response(status_code=304, headers=headers)
+
+    if STORAGE_ACCEL_REDIRECT and storage.local_path(key) is not None:
+        # nginx serves the file itself, including ranges and sendfile
+        # Legacy keys may contain spaces or non-ASCII characters
+        headers["X-Accel-Redirect"] = STORAGE_ACCEL_REDIRECT.rstrip("/") + "/" + quote(key)
+        headers["Content-Type"] = obj.content_type
+        return Response(headers=headers)
+
+    start, end, status_code = 0, obj.size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and request.method == "GET" and (not if_range or if_range == obj.etag):
+        try:
+            byte_range = parse_range(range_header, obj.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{obj.size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{obj.size}"
+
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+    return ObjectResponse(obj, start, end, status_code, headers, head_only=request.method == "HEAD")
+
+
+def upload_local(root: str) -> int:
+    """Copy every file under a local uploads directory into the configured backend"""
+    copied = 0
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            key = os.path.relpath(path, root).replace(os.sep, "/")
+            if key.startswith(".") or not is_valid_key(key) or storage.exists(key):
+                continue
+            fd, temp_path = tempfile.mkstemp(dir=storage.staging_dir())
+            os.close(fd)
+            shutil.copyfile(path, temp_path)
+            storage.put_file(temp_path, key)
+            copied += 1
+    return copied
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "upload-local":
+        sys.exit("usage: python -m storage upload-local <uploads directory>")
+    print(f"copied {upload_local(sys.argv[2])} files to {storage.name}")
@@ -0,0 +1,76 @@
+"""Storage keys and the public paths rows store for them
+
+Pure string helpers shared by the storage layer, the upload handlers and
+the models, which must not depend on a storage backend. See storage.py.
+"""
+import os
+import re
+from typing import Optional
+
+PUBLIC_PREFIX = "uploads/"
+
+# Key prefixes
+FACES_PREFIX = "faces"
+THUMBNAILS_PREFIX = "faces/thumbnails"
+DETECTIONS_PREFIX = "detections"
+
+_PREFIX_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+$")
+# Names saved before content addressing (<user>_<face name>_<file name>)
+# may contain spaces and other characters; only these are refused
+_UNSAFE_CHARACTERS = re.compile(r"[\x00-\x1f\x7f\\]")
+_HASH_STEM = re.compile(r"^[0-9a-f]{64}$")
+
+
+def content_key(prefix: str, sha256: str, extension: str) -> str:
+    """Sharded key of a content-hashed object"""
+    return f"{prefix}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def is_valid_key(key: str) -> bool:
+    """Whether a key is safe to hand to a backend
+
+    A plain prefix followed by segments that are not empty, "." or "..",
+    without control characters or backslashes.
+    """
+    prefix, _, rest = key.partition("/")
+    return (
+        bool(_PREFIX_PATTERN.match(prefix)) and bool(rest)
+        and all(segment not in ("", ".", "..") for segment in rest.split("/"))
+        and not _UNSAFE_CHARACTERS.search(key)
+    )
+
+
+def key_for_path(path: Optional[str]) -> Optional[str]:
+    """Storage key of a stored ``uploads/<key>`` path, None for anything else"""
+    if not path or not path.startswith(PUBLIC_PREFIX):
+        return None
+    key = path[len(PUBLIC_PREFIX):]
+    return key if is_valid_key(key) else None
+
+
+def path_for_key(key: str) -> str:
+    return PUBLIC_PREFIX + key
+
+
+def is_content_addressed(key: str) -> bool:
+    """Whether the key's file name is a content hash, so its bytes never change"""
+    stem = os.path.splitext(key.rsplit("/", 1)[-1])[0]
+    return bool(_HASH_STEM.match(stem))
+
+
+def thumbnail_key_for(image_key: str) -> str:
+    """Key of the thumbnail generated for a face image key
+
+    Sharded images get sharded thumbnails; images stored before sharding
+    keep their flat thumbnails/<stem>.jpg location.
+    """
+    parts = image_key.split("/")
+    stem = os.path.splitext(parts[-1])[0]
+    shards = parts[1:-1] if len(parts) == 4 else []
+    return "/".join([THUMBNAILS_PREFIX, *shards, f"{stem}.jpg"])
+
+
+def thumbnail_path_for(image_path: str) -> Optional[str]:
+    """Path of the thumbnail generated for a content-hashed face image"""
+    key = key_for_path(image_path)
+    return path_for_key(thumbnail_key_for(key)) if key else None
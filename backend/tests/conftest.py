@@ -0,0 +1,48 @@
+"""Shared test setup
+
+The backend reads its configuration when modules are imported, so the
+throwaway SQLite database and storage root are set here, before any test
+module imports them. Run from the backend directory:
+
+    python -m pytest
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_scratch, "test.db")
+os.environ["STORAGE_ROOT"] = os.path.join(_scratch, "uploads")
+
+
+def _run(coro):
+    """Run a coroutine on a fresh event loop
+
+    Pooled connections belong to the loop that opened them, so they are
+    released before it closes.
+    """
+    from database import engine
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from migrate import migrate
+    _run(migrate())
+    yield
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+@pytest.fixture
+def run():
+    return _run
@@ -0,0 +1,41 @@
+import uuid
+from datetime import datetime
+
+import httpx
+
+from auth import get_password_hash
+from database import SessionLocal
+from models import Camera, DetectionLog, User
+
+PASSWORD = "correct horse"
+SETTLED_RANGE = {"start": "2025-01-01T00:00:00", "end": "2025-02-01T00:00:00"}
+
+
+def test_renamed_camera_shows_up_in_cached_analytics(run):
+    from main import app
+
+    async def scenario():
+        email = f"{uuid.uuid4().hex}@example.com"
+        async with SessionLocal() as db:
+            user = User(email=email, full_name="Analytics test", password_hash=get_password_hash(PASSWORD))
+            db.add(user)
+            await db.flush()
+            camera = Camera(user_id=user.id, camera_name="Old name", camera_type="webcam")
+            db.add(camera)
+            await db.flush()
+            db.add(DetectionLog(user_id=user.id, camera_id=camera.id, detected_at=datetime(2025, 1, 15)))
+            await db.commit()
+            camera_id = camera.id
+
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            token = (await client.post("/auth/login", json={"email": email, "password": PASSWORD})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            names = []
+            for new_name in ("New name", None):
+                analytics = (await client.get("/analytics/cameras", params=SETTLED_RANGE, headers=headers)).json()
+                names.append([row["camera_name"] for row in analytics["cameras"]])
+                if new_name:
+                    await client.put(f"/cameras/{camera_id}", json={"camera_name": new_name}, headers=headers)
+            return names
+
+    assert run(scenario()) == [["Old name"], ["New name"]]
@@ -0,0 +1,193 @@
+import asyncio
+import socket
+import time
+import uuid
+
+import pytest
+from sqlalchemy import delete, event, select
+
+import camera_health
+from camera_health import (
+    CameraHealthMonitor, FAILURES_BEFORE_INACTIVE, ProbeRateLimited, address_allowed, parse_networks, probe
+)
+from database import SessionLocal, engine
+from models import User, Camera
+
+
+def closed_port() -> int:
+    """A loopback port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stalled_listener():
+    """A loopback listener whose accept queue is full, so new connects hang"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(0)
+    port = server.getsockname()[1]
+    clients = []
+    # SYNs beyond the accept queue are dropped, leaving the connect pending
+    while len(clients) < 16:
+        client = socket.socket()
+        client.settimeout(0.2)
+        clients.append(client)
+        try:
+            client.connect(("127.0.0.1", port))
+        except socket.timeout:
+            break
+    else:
+        pytest.skip("loopback connects never stalled")
+    yield port
+    for client in clients:
+        client.close()
+    server.close()
+
+
+def test_probe_reachable(run):
+    async def scenario():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        async with server:
+            return await probe("127.0.0.1", server.sockets[0].getsockname()[1], timeout=2)
+
+    result = run(scenario())
+
+    assert result.reachable
+    assert result.latency_ms is not None and result.error is None
+
+
+def test_probe_refused(run):
+    result = run(probe("127.0.0.1", closed_port(), timeout=2))
+
+    assert not result.reachable
+    assert result.latency_ms is None and result.error
+
+
+def test_probe_times_out(run, stalled_listener):
+    started = time.monotonic()
+    result = run(probe("127.0.0.1", stalled_listener, timeout=0.3))
+
+    assert not result.reachable
+    assert result.error == "Timed out after 0.3s"
+    assert time.monotonic() - started < 2
+
+
+def test_failures_back_off_exponentially_up_to_the_cap(run, monkeypatch):
+    monkeypatch.setattr(camera_health, "JITTER", 0.0)
+    monitor = CameraHealthMonitor(interval=10, timeout=1, max_backoff=60)
+    target = camera_health._Target(camera_id=1, user_id=1, host="127.0.0.1", port=closed_port(), status="active")
+    down = run(probe(target.host, target.port, timeout=1))
+
+    delays, statuses = [], []
+    for _ in range(5):
+        monitor._record(target, down)
+        delays.append(monitor._delay(target))
+        statuses.append(target.status)
+
+    assert delays == [10, 20, 40, 60, 60]
+    assert statuses.index("inactive") == FAILURES_BEFORE_INACTIVE - 1
+    assert monitor.probes_failed == 5
+
+    up = camera_health.ProbeResult(True, 1.0, None, down.checked_at)
+    monitor._record(target, up)
+    assert (target.failures, target.status, monitor._delay(target)) == (0, "active", 10)
+
+
+def test_status_changes_are_written_in_one_batch(run, monkeypatch):
+    # Leave the only flush to stop()
+    monkeypatch.setattr(camera_health, "FLUSH_SECONDS", 3600)
+    updates = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE cameras"):
+            updates.append((executemany, len(parameters) if executemany else 1))
+
+    async def scenario():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        live_port = server.sockets[0].getsockname()[1]
+        async with SessionLocal() as db:
+            user = User(email=f"{uuid.uuid4().hex}@example.com", full_name="Health test", password_hash="-")
+            db.add(user)
+            await db.flush()
+            cameras = [
+                Camera(user_id=user.id, camera_name=name, camera_type="ip_camera",
+                       ip_address="127.0.0.1", port=port, status=status)
+                for name, port, status in (
+                    ("up 1", live_port, "inactive"),
+                    ("up 2", live_port, "inactive"),
+                    ("down", closed_port(), "active"),
+                    ("already up", live_port, "active"),
+                )
+            ]
+            db.add_all(cameras)
+            await db.commit()
+
+        monitor = CameraHealthMonitor(interval=0.05, timeout=1, max_backoff=0.1, blocked_networks=[])
+        event.listen(engine.sync_engine, "before_cursor_execute", capture)
+        try:
+            async with server:
+                await monitor.start()
+                deadline = time.monotonic() + 10
+                while not all(
+                    target.checked_at and (target.last_result.reachable or target.failures >= FAILURES_BEFORE_INACTIVE)
+                    for target in monitor._targets.values()
+                ):
+                    assert time.monotonic() < deadline
+                    await asyncio.sleep(0.05)
+                assert updates == []
+                await monitor.stop()
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+        async with SessionLocal() as db:
+            rows = dict((await db.execute(
+                select(Camera.camera_name, Camera.status).where(Camera.user_id == user.id)
+            )).all())
+            seen = dict((await db.execute(
+                select(Camera.camera_name, Camera.last_seen).where(Camera.user_id == user.id)
+            )).all())
+            await db.execute(delete(User).where(User.id == user.id))
+            await db.commit()
+        return monitor, rows, seen
+
+    monitor, rows, seen = run(scenario())
+
+    # One executemany: three status changes plus the first last_seen refresh of "already up"
+    assert updates == [(True, 4)]
+    assert monitor.rows_written == 4
+    assert rows == {"up 1": "active", "up 2": "active", "down": "inactive", "already up": "active"}
+    assert seen["down"] is None and all(seen[name] for name in ("up 1", "up 2", "already up"))
+
+
+def test_default_blocked_networks():
+    blocked = parse_networks(camera_health.CAMERA_BLOCKED_NETWORKS)
+
+    for address in ("127.0.0.1", "169.254.169.254", "::1", "::ffff:127.0.0.1", "fe80::1", "0.0.0.0", "not an ip"):
+        assert not address_allowed(address, blocked), address
+    for address in ("203.0.113.7", "192.168.1.20", "2001:db8::1"):
+        assert address_allowed(address, blocked), address
+
+
+def test_blocked_camera_is_neither_monitored_nor_probed(run):
+    monitor = CameraHealthMonitor()
+    camera = Camera(id=1, user_id=1, camera_type="ip_camera", ip_address="127.0.0.1", port=closed_port())
+
+    result, cached = run(monitor.check(camera))
+
+    assert (result.reachable, result.error, cached) == (False, "Address not allowed", False)
+    assert monitor._last_test == {}
+
+
+def test_on_demand_probes_are_rate_limited_per_user(run):
+    monitor = CameraHealthMonitor(blocked_networks=[], test_interval=60)
+    camera = Camera(id=1, user_id=1, camera_type="ip_camera", ip_address="127.0.0.1", port=closed_port())
+    other_user = Camera(id=2, user_id=2, camera_type="ip_camera", ip_address="127.0.0.1", port=closed_port())
+
+    run(monitor.check(camera, max_age=0))
+    with pytest.raises(ProbeRateLimited) as limited:
+        run(monitor.check(camera, max_age=0))
+    run(monitor.check(other_user, max_age=0))
+
+    assert 0 < limited.value.retry_after <= 60
@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from detection_dedup import DetectionDeduper, detection_dedup
+from ingestion import ingest_detections
+from models import Camera, DetectionLog, RegisteredFace, User
+
+NOW = datetime(2025, 3, 1, 12, 0, 0)
+
+
+def sighting(seconds: float, face_id=7, cluster_id=None, confidence=0.5):
+    return SimpleNamespace(
+        camera_id=1,
+        registered_face_id=face_id,
+        visitor_cluster_id=cluster_id,
+        detected_at=NOW + timedelta(seconds=seconds),
+        detection_confidence=confidence,
+        detection_image_path=None,
+    )
+
+
+def test_sightings_within_the_window_merge_on_either_side():
+    deduper = DetectionDeduper(window=30)
+    created = deduper.absorb(1, [sighting(0), sighting(20), sighting(-10)], NOW)
+
+    assert len(created) == 1
+    episode = created[0]
+    assert episode.hits == 3
+    assert (episode.first_seen, episode.last_seen) == (NOW - timedelta(seconds=10), NOW + timedelta(seconds=20))
+
+
+def test_backfilled_sighting_is_recorded_without_replacing_the_open_episode():
+    deduper = DetectionDeduper(window=30)
+    (live,) = deduper.absorb(1, [sighting(0)], NOW)
+
+    (backfilled,) = deduper.absorb(1, [sighting(-6 * 3600)], NOW)
+    merged = deduper.absorb(1, [sighting(10)], NOW)
+
+    assert backfilled is not live
+    assert (backfilled.hits, backfilled.first_seen) == (1, NOW - timedelta(hours=6))
+    assert merged == []
+    assert (live.hits, live.first_seen) == (2, NOW)
+
+
+def test_strangers_are_never_merged():
+    deduper = DetectionDeduper(window=30)
+    created = deduper.absorb(1, [sighting(0, face_id=None), sighting(1, face_id=None)], NOW)
+
+    assert len(created) == 2
+    assert deduper.stats()["open_episodes"] == 0
+
+
+def test_flush_writes_merged_sightings_and_earlier_first_seen(run):
+    async def scenario():
+        async with SessionLocal() as db:
+            user = User(email=f"{uuid.uuid4().hex}@example.com", full_name="Dedup test", password_hash="-")
+            db.add(user)
+            await db.flush()
+            camera = Camera(user_id=user.id, camera_name="Door", camera_type="webcam")
+            face = RegisteredFace(user_id=user.id, face_name="Alex", encoding_status="ready")
+            db.add_all([camera, face])
+            await db.commit()
+            user_id, camera_id, face_id = user.id, camera.id, face.id
+
+        def event(seconds, confidence):
+            return SimpleNamespace(**{**vars(sighting(seconds, face_id, confidence=confidence)), "camera_id": camera_id})
+
+        async with SessionLocal() as db:
+            first = await ingest_detections(db, user_id, [event(0, 0.5)])
+            later = await ingest_detections(db, user_id, [event(15, 0.9), event(-5, 0.4)])
+        await detection_dedup.flush()
+        async with SessionLocal() as db:
+            row = (await db.execute(
+                select(DetectionLog.detected_at, DetectionLog.last_seen_at, DetectionLog.hit_count,
+                       DetectionLog.detection_confidence)
+                .where(DetectionLog.id == first.rows[0]["id"])
+            )).one()
+        return later, row
+
+    later, row = run(scenario())
+
+    assert (later.accepted, later.merged) == (2, 2)
+    assert row.detected_at == NOW - timedelta(seconds=5)
+    assert row.last_seen_at == NOW + timedelta(seconds=15)
+    assert row.hit_count == 3
+    assert float(row.detection_confidence) == 0.9
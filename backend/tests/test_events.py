@@ -0,0 +1,22 @@
+import json
+from datetime import datetime, timedelta
+
+from events import EventBroker
+
+
+def test_stats_delta_only_counts_todays_detections():
+    broker = EventBroker()
+    subscription = broker.subscribe(1)
+    now = datetime.utcnow()
+
+    broker.publish_detections(1, [
+        {"camera_id": 4, "detected_at": now},
+        {"camera_id": 5, "detected_at": now - timedelta(days=3)},
+    ])
+    broker.publish_detections(1, [{"camera_id": 5, "detected_at": now - timedelta(days=3)}])
+
+    messages = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+    events = [message.split("event: ")[1].split("\n")[0] for message in messages]
+    stats = json.loads(messages[1].rsplit("data: ", 1)[1])
+    assert events == ["detections", "stats", "detections"]
+    assert stats == {"alerts": 1, "alerts_by_camera": [{"camera_id": 4, "count": 1}]}
@@ -0,0 +1,103 @@
+import asyncio
+import importlib.util
+import uuid
+
+import pytest
+from PIL import Image
+from sqlalchemy import select
+
+from database import SessionLocal
+from embedding_models import EMBEDDING_DIM, decode_embedding
+from face_encoding import FaceEncodingWorker
+from models import User, RegisteredFace
+
+
+async def add_faces(paths):
+    """A new user with one pending face per image path"""
+    async with SessionLocal() as db:
+        user = User(email=f"{uuid.uuid4().hex}@example.com", full_name="Encoding test", password_hash="-")
+        db.add(user)
+        await db.flush()
+        faces = [
+            RegisteredFace(user_id=user.id, face_name=f"face {i}", face_image_path=path, encoding_status="pending")
+            for i, path in enumerate(paths)
+        ]
+        db.add_all(faces)
+        await db.commit()
+        return [face.id for face in faces]
+
+
+async def statuses(face_ids):
+    async with SessionLocal() as db:
+        rows = (await db.execute(
+            select(RegisteredFace.id, RegisteredFace.encoding_status, RegisteredFace.face_encoding).where(
+                RegisteredFace.id.in_(face_ids)
+            )
+        )).all()
+    return {row.id: (row.encoding_status, row.face_encoding) for row in rows}
+
+
+async def encode(worker, face_ids, timeout=60.0):
+    """Run the worker until none of the faces is pending or processing"""
+    await worker.start()
+    try:
+        worker.notify()
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            result = await statuses(face_ids)
+            if all(status not in ("pending", "processing") for status, _ in result.values()):
+                return result
+            assert asyncio.get_running_loop().time() < deadline, result
+            await asyncio.sleep(0.1)
+    finally:
+        await worker.stop()
+
+
+def write_image(path, color):
+    Image.new("RGB", (32, 32), color).save(path)
+    return str(path)
+
+
+def test_stub_model_encodes_pending_faces(run, tmp_path):
+    red = write_image(tmp_path / "red.png", (255, 0, 0))
+    blue = write_image(tmp_path / "blue.png", (0, 0, 255))
+    missing = str(tmp_path / "missing.png")
+    face_ids = run(add_faces([red, blue, missing]))
+    worker = FaceEncodingWorker(model_name="stub", workers=1, batch_size=2, poll_seconds=0.1)
+
+    result = run(encode(worker, face_ids))
+
+    assert [result[face_id][0] for face_id in face_ids] == ["ready", "ready", "failed"]
+    red_vector, blue_vector = (decode_embedding(result[face_id][1]) for face_id in face_ids[:2])
+    assert red_vector.shape == (EMBEDDING_DIM,)
+    assert not (red_vector == blue_vector).all()
+    assert worker.unavailable is None
+    assert worker.faces_done == 3
+
+
+def test_unknown_model_disables_worker_and_leaves_faces_pending(run, tmp_path, caplog):
+    face_ids = run(add_faces([write_image(tmp_path / "face.png", (0, 255, 0))]))
+    worker = FaceEncodingWorker(model_name="no-such-model", workers=1, poll_seconds=0.1)
+
+    async def start_and_wait():
+        await worker.start()
+        await asyncio.sleep(0.3)
+        running = worker.running
+        await worker.stop()
+        return running
+
+    assert run(start_and_wait()) is False
+    assert "no-such-model" in worker.unavailable
+    assert worker.stats()["unavailable"] == worker.unavailable
+    assert [record.levelname for record in caplog.records if "Face encoding disabled" in record.message] == ["ERROR"]
+    assert run(statuses(face_ids))[face_ids[0]][0] == "pending"
+
+
+@pytest.mark.skipif(importlib.util.find_spec("face_recognition") is not None, reason="face_recognition is installed")
+def test_missing_face_recognition_library_disables_worker(run):
+    worker = FaceEncodingWorker(model_name="face_recognition", workers=1)
+
+    run(worker.start())
+
+    assert not worker.running
+    assert worker.unavailable.startswith("ModuleNotFoundError")
@@ -0,0 +1,60 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import func, select
+
+from database import SessionLocal
+from ingestion import OwnershipCache, UnknownReferences, ingest_detections, ownership_cache
+from models import Camera, DetectionLog, User
+
+
+async def user_with_camera():
+    async with SessionLocal() as db:
+        user = User(email=f"{uuid.uuid4().hex}@example.com", full_name="Ingestion test", password_hash="-")
+        db.add(user)
+        await db.flush()
+        camera = Camera(user_id=user.id, camera_name="Lobby", camera_type="webcam")
+        db.add(camera)
+        await db.commit()
+        return user.id, camera.id
+
+
+def event(camera_id: int):
+    return SimpleNamespace(
+        camera_id=camera_id, registered_face_id=None, visitor_cluster_id=None,
+        detected_at=None, detection_confidence=0.8, detection_image_path=None
+    )
+
+
+def test_forced_reload_runs_once_per_ttl(run):
+    async def scenario():
+        user_id, _ = await user_with_camera()
+        cache = OwnershipCache(ttl=60)
+        async with SessionLocal() as db:
+            first = await cache.get(db, user_id, refresh=True)
+            second = await cache.get(db, user_id, refresh=True)
+        return first, second
+
+    first, second = run(scenario())
+
+    assert second is first
+
+
+def test_batch_with_an_unknown_camera_is_rejected_whole(run):
+    async def scenario():
+        user_id, camera_id = await user_with_camera()
+        async with SessionLocal() as db:
+            with pytest.raises(UnknownReferences) as raised:
+                await ingest_detections(db, user_id, [event(camera_id), event(camera_id + 1000)], dedup=False)
+            reloaded_at = ownership_cache._entries[user_id].loaded_at
+            with pytest.raises(UnknownReferences):
+                await ingest_detections(db, user_id, [event(camera_id + 1000)], dedup=False)
+            written = await db.scalar(select(func.count()).where(DetectionLog.user_id == user_id))
+        return raised.value.errors, reloaded_at, written, user_id, camera_id
+
+    errors, reloaded_at, written, user_id, camera_id = run(scenario())
+
+    assert errors == [{"index": 1, "detail": f"Unknown camera_id {camera_id + 1000}"}]
+    assert ownership_cache._entries[user_id].loaded_at == reloaded_at
+    assert written == 0
@@ -0,0 +1,23 @@
+import logging
+
+import metrics
+
+
+def test_token_must_match_exactly(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+
+    assert metrics.token_matches("Bearer s3cret")
+    assert not metrics.token_matches("Bearer s3cre")
+    assert not metrics.token_matches("s3cret")
+    assert not metrics.token_matches(None)
+
+
+def test_unprotected_metrics_log_a_warning(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+
+    with caplog.at_level(logging.WARNING, logger="metrics"):
+        metrics.warn_if_unprotected()
+
+    assert "without METRICS_TOKEN" in caplog.text
+    assert metrics.token_matches(None)
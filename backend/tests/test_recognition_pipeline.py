@@ -0,0 +1,31 @@
+from models import Camera
+from recognition_pipeline import FrameSource, RecognitionPipeline
+
+
+def ip_camera(camera_id: int, user_id: int) -> Camera:
+    return Camera(
+        id=camera_id, user_id=user_id, camera_type="ip_camera", status="active",
+        ip_address="203.0.113.7", port=554
+    )
+
+
+def test_only_the_shards_cameras_are_streamed():
+    pipeline = RecognitionPipeline(detector_name="stub", model_name="stub", shard_index=1, shard_count=2)
+
+    for camera_id in range(1, 5):
+        pipeline.track_camera(ip_camera(camera_id, user_id=1))
+
+    assert sorted(pipeline._sources) == [1, 3]
+
+
+def test_user_stats_only_cover_the_users_cameras():
+    pipeline = RecognitionPipeline(detector_name="stub", model_name="stub")
+    mine, theirs = FrameSource(camera_id=2, user_id=1), FrameSource(camera_id=3, user_id=2)
+    mine.frames_sampled, theirs.frames_sampled = 5, 7
+    pipeline.add_source(mine)
+    pipeline.add_source(theirs)
+
+    assert pipeline.user_stats(1) == {
+        "running": False,
+        "cameras": [{"camera_id": 2, "frames_sampled": 5, "faces_found": 0}],
+    }
@@ -0,0 +1,51 @@
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import Camera, DetectionLog, Package, User
+from retention import run_retention
+
+
+async def user_with_old_detection(retention_days) -> int:
+    """A user with one detection from 400 days ago, on a package keeping retention_days"""
+    async with SessionLocal() as db:
+        package = Package(
+            name=f"Retention {uuid.uuid4().hex[:8]}", price=0,
+            camera_limit=-1, max_registered_faces=-1, data_retention_days=retention_days
+        )
+        db.add(package)
+        await db.flush()
+        user = User(
+            email=f"{uuid.uuid4().hex}@example.com", full_name="Retention test",
+            password_hash="-", package_id=package.id
+        )
+        db.add(user)
+        await db.flush()
+        camera = Camera(user_id=user.id, camera_name="Gate", camera_type="webcam")
+        db.add(camera)
+        await db.flush()
+        db.add(DetectionLog(
+            user_id=user.id, camera_id=camera.id,
+            detected_at=datetime.utcnow() - timedelta(days=400)
+        ))
+        await db.commit()
+        return user.id
+
+
+def test_packages_without_retention_keep_their_history(run):
+    async def scenario():
+        kept = await user_with_old_detection(None)
+        expired = await user_with_old_detection(30)
+        report = await run_retention()
+        async with SessionLocal() as db:
+            remaining = (await db.scalars(
+                select(DetectionLog.user_id).where(DetectionLog.user_id.in_([kept, expired]))
+            )).all()
+        return kept, report, remaining
+
+    kept, report, remaining = run(scenario())
+
+    assert report.rows_deleted >= 1
+    assert remaining == [kept]
@@ -0,0 +1,84 @@
+import uuid
+
+from datetime import datetime, timedelta
+
+import httpx
+from jose import jwt
+from sqlalchemy import select
+
+from auth import ALGORITHM, SECRET_KEY, get_password_hash
+from database import SessionLocal
+from models import User
+
+PASSWORD = "correct horse"
+
+
+async def new_user() -> str:
+    email = f"{uuid.uuid4().hex}@example.com"
+    async with SessionLocal() as db:
+        db.add(User(email=email, full_name="Session test", password_hash=get_password_hash(PASSWORD)))
+        await db.commit()
+    return email
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_logout_revokes_only_the_presented_session(run):
+    from main import app
+
+    async def scenario():
+        email = await new_user()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            tokens = [
+                (await client.post("/auth/login", json={"email": email, "password": PASSWORD})).json()["access_token"]
+                for _ in range(2)
+            ]
+            logout = await client.post("/auth/logout", headers=bearer(tokens[0]))
+            return logout.status_code, [
+                (await client.get("/auth/me", headers=bearer(token))).status_code for token in tokens
+            ]
+
+    assert run(scenario()) == (200, [401, 200])
+
+
+def test_logout_without_jti_is_rejected_and_revokes_nothing(run):
+    from main import app
+
+    async def scenario():
+        email = await new_user()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            session_token = (await client.post("/auth/login", json={"email": email, "password": PASSWORD})).json()["access_token"]
+            # As issued before tokens carried a jti
+            legacy_token = jwt.encode(
+                {"sub": email, "exp": datetime.utcnow() + timedelta(minutes=5)}, SECRET_KEY, algorithm=ALGORITHM
+            )
+            logout = await client.post("/auth/logout", headers=bearer(legacy_token))
+            me = await client.get("/auth/me", headers=bearer(session_token))
+            return logout.status_code, me.status_code
+
+    assert run(scenario()) == (400, 200)
+
+
+def test_stream_tickets_are_single_use_and_die_with_their_session(run):
+    from main import app
+    from sessions import session_store
+
+    async def scenario():
+        email = await new_user()
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            token = (await client.post("/auth/login", json={"email": email, "password": PASSWORD})).json()["access_token"]
+            used, unused = [(await client.post("/events/ticket", headers=bearer(token))).json()["ticket"] for _ in range(2)]
+            async with SessionLocal() as db:
+                redeemed = [await session_store.redeem_stream_ticket(db, used) for _ in range(2)]
+            await client.post("/auth/logout", headers=bearer(token))
+            async with SessionLocal() as db:
+                after_logout = await session_store.redeem_stream_ticket(db, unused)
+                user_id = await db.scalar(select(User.id).where(User.email == email))
+            return user_id, redeemed, after_logout
+
+    user_id, redeemed, after_logout = run(scenario())
+
+    assert redeemed == [user_id, None]
+    assert after_logout is None
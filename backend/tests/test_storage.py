@@ -0,0 +1,77 @@
+import os
+
+import httpx
+import pytest
+
+from storage import FilesystemStorage, storage
+from storage_keys import is_valid_key, key_for_path, thumbnail_key_for
+from uploads import remove_face_image
+
+LEGACY_PATH = "uploads/faces/4_Test Face_test.png"
+
+
+@pytest.fixture
+def legacy_face():
+    """A face image and thumbnail stored under a pre-content-addressing name"""
+    key = key_for_path(LEGACY_PATH)
+    files = [storage._path(key), storage._path(thumbnail_key_for(key))]
+    for path in files:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"legacy image")
+    yield files
+    for path in files:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.mark.parametrize("key", [
+    "faces/4_Test Face_test.png",
+    "faces/7_Zoë O'Brien_photo (1).jpg",
+    "faces/ab/cd/" + "a" * 64 + ".png",
+    "faces/thumbnails/ab/cd/" + "a" * 64 + ".jpg",
+])
+def test_valid_keys(key):
+    assert is_valid_key(key)
+
+
+@pytest.mark.parametrize("key", [
+    "", "faces", "faces/", "../faces/x.png", "faces/../users.db", "faces/./x.png",
+    "faces//x.png", "faces/x.png/", "/faces/x.png", "faces/a\\..\\b.png", "faces/x\x00.png", ".staging/x",
+])
+def test_invalid_keys(key):
+    assert not is_valid_key(key)
+
+
+def test_key_for_path_accepts_legacy_names():
+    assert key_for_path(LEGACY_PATH) == "faces/4_Test Face_test.png"
+    assert key_for_path("faces/4_Test Face_test.png") is None
+    assert key_for_path("uploads/faces/../../main.py") is None
+
+
+def test_filesystem_paths_stay_under_root(tmp_path):
+    backend = FilesystemStorage(str(tmp_path))
+
+    assert backend._path("faces/4_Test Face_test.png") == os.path.join(str(tmp_path), "faces", "4_Test Face_test.png")
+    with pytest.raises(ValueError):
+        backend.stat("faces/../../etc/passwd")
+
+
+def test_legacy_image_is_served(run, legacy_face):
+    from main import app
+
+    async def fetch():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return await client.get("/uploads/faces/4_Test%20Face_test.png")
+
+    response = run(fetch())
+
+    assert response.status_code == 200
+    assert response.content == b"legacy image"
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_legacy_image_and_thumbnail_are_removed(legacy_face):
+    remove_face_image(LEGACY_PATH)
+
+    assert not any(os.path.exists(path) for path in legacy_face)
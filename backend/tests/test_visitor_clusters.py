@@ -0,0 +1,49 @@
+import uuid
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+from database import SessionLocal
+from embedding_models import EMBEDDING_DIM
+from models import User, VisitorCluster
+from visitor_clusters import VisitorClusterer
+
+
+async def new_user() -> int:
+    async with SessionLocal() as db:
+        user = User(email=f"{uuid.uuid4().hex}@example.com", full_name="Visitor test", password_hash="-")
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+def face(seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_least_recently_active_users_are_dropped_and_reloaded(run):
+    clusterer = VisitorClusterer(max_users=2, model="stub")
+
+    async def scenario():
+        user_ids = [await new_user() for _ in range(3)]
+        now = datetime.utcnow()
+        first = {}
+        for user_id in user_ids:
+            first[user_id] = (await clusterer.assign(user_id, [face(user_id)], [now]))[0]
+            await clusterer.assign(user_id, [face(user_id)], [now])
+        dropped_stats = clusterer.stats()
+        # The first user was dropped with an unflushed sighting and comes back
+        again = (await clusterer.assign(user_ids[0], [face(user_ids[0])], [now]))[0]
+        await clusterer.flush()
+        async with SessionLocal() as db:
+            count = await db.scalar(select(VisitorCluster.sighting_count).where(VisitorCluster.id == again))
+        return user_ids, first, dropped_stats, again, count
+
+    user_ids, first, dropped_stats, again, count = run(scenario())
+
+    assert (dropped_stats["users"], dropped_stats["users_evicted"]) == (2, 1)
+    assert again == first[user_ids[0]]
+    assert count == 3
+    assert list(clusterer._users) == [user_ids[2], user_ids[0]]
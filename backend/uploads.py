@@ -0,0 +1,227 @@
+import hashlib
+import os
+import uuid
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+
+from storage import storage, local_files
+from storage_keys import (
+    FACES_PREFIX, DETECTIONS_PREFIX, content_key, key_for_path, path_for_key, thumbnail_key_for
+)
+
+load_dotenv()
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_FACE_IMAGE_BYTES = int(os.getenv("MAX_FACE_IMAGE_MB", "10")) * 1024 * 1024
+THUMBNAIL_SIZE = (256, 256)
+MAX_BULK_FACES = int(os.getenv("MAX_BULK_FACES", "1000"))
+
+# Leading bytes of the image formats accepted for face registration
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+    (b"BM", "image/bmp", ".bmp"),
+)
+
+
+@dataclass
+class SavedUpload:
+    path: str
+    sha256: str
+    size: int
+    content_type: str
+    created: bool
+
+
+def sniff_image_type(head: bytes) -> Optional[Tuple[str, str]]:
+    """Return (content_type, extension) for an image's leading bytes"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    return None
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Image too large. Maximum size is {max_bytes // (1024 * 1024)} MB."
+    )
+
+
+def save_fileobj(
+    fileobj: BinaryIO,
+    prefix: str = FACES_PREFIX,
+    max_bytes: int = MAX_FACE_IMAGE_BYTES
+) -> SavedUpload:
+    """Stream an image from a file object into storage under its content hash
+
+    The data is copied in UPLOAD_CHUNK_SIZE pieces to a staging file while
+    being hashed, then stored as ``<prefix>/<ab>/<cd>/<sha256><ext>``. If an
+    object with that hash already exists the staged copy is discarded, so
+    identical uploads share one object. Blocking; see save_upload.
+    """
+    temp_path = os.path.join(storage.staging_dir(), f".upload-{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    detected = None
+
+    try:
+        with open(temp_path, "wb") as out:
+            while True:
+                chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if detected is None:
+                    detected = sniff_image_type(chunk)
+                    if detected is None:
+                        raise HTTPException(
+                            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Unsupported image type. Upload a JPEG, PNG, GIF, BMP or WebP image."
+                        )
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+
+        if detected is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Uploaded file is empty"
+            )
+
+        content_type, extension = detected
+        sha256 = digest.hexdigest()
+        key = content_key(prefix, sha256, extension)
+        created = not storage.exists(key)
+        if created:
+            storage.put_file(temp_path, key, content_type)
+        else:
+            os.remove(temp_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return SavedUpload(
+        path=path_for_key(key),
+        sha256=sha256,
+        size=size,
+        content_type=content_type,
+        created=created
+    )
+
+
+async def save_upload(
+    file: UploadFile,
+    prefix: str = FACES_PREFIX,
+    max_bytes: int = MAX_FACE_IMAGE_BYTES
+) -> SavedUpload:
+    """Save an UploadFile with save_fileobj without blocking the event loop"""
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+    await file.seek(0)
+    return await run_in_threadpool(save_fileobj, file.file, prefix, max_bytes)
+
+
+def face_name_from_path(path: str) -> str:
+    """Derive a face name from an uploaded or archived file name
+
+    ``Alice/01.jpg`` registers as "Alice" so several photos can be grouped
+    per person; ``Bob Smith.png`` registers as "Bob Smith".
+    """
+    parts = [p for p in path.replace("\\", "/").split("/") if p]
+    if len(parts) > 1:
+        return parts[-2]
+    return os.path.splitext(parts[-1])[0] if parts else path
+
+
+def open_archive(fileobj: BinaryIO) -> Tuple[zipfile.ZipFile, List[zipfile.ZipInfo]]:
+    """Open a ZIP archive of face images and list its image entries
+
+    Only the central directory is read here; entries are decompressed one
+    at a time by save_archive_entry.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Archive is not a valid ZIP file"
+        )
+    entries = [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+    ]
+    return archive, entries
+
+
+def save_archive_entry(
+    archive: zipfile.ZipFile,
+    info: zipfile.ZipInfo,
+    prefix: str = FACES_PREFIX,
+    max_bytes: int = MAX_FACE_IMAGE_BYTES
+) -> SavedUpload:
+    """Decompress one archive entry straight into the content-hashed store"""
+    if info.file_size > max_bytes:
+        raise _too_large(max_bytes)
+    with archive.open(info) as entry:
+        return save_fileobj(entry, prefix, max_bytes)
+
+
+def generate_thumbnail(image_path: str, size: Tuple[int, int] = THUMBNAIL_SIZE) -> Optional[str]:
+    """Write a downscaled JPEG copy of a face image for the dashboard
+
+    Meant to run as a background task; FastAPI executes it in the threadpool.
+    """
+    from PIL import Image, ImageOps
+
+    image_key = key_for_path(image_path)
+    if image_key is None:
+        return None
+    thumbnail_key = thumbnail_key_for(image_key)
+    if storage.exists(thumbnail_key):
+        return path_for_key(thumbnail_key)
+
+    temp_path = os.path.join(storage.staging_dir(), f".thumbnail-{uuid.uuid4().hex}.part")
+    try:
+        with local_files([image_path]) as (source,), Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(size)
+            image.convert("RGB").save(temp_path, "JPEG", quality=85, optimize=True)
+        storage.put_file(temp_path, thumbnail_key, "image/jpeg")
+    except (OSError, ValueError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+    return path_for_key(thumbnail_key)
+
+
+def remove_face_image(image_path: str) -> None:
+    """Delete a face image and its thumbnail"""
+    image_key = key_for_path(image_path)
+    if image_key is not None:
+        storage.delete(image_key)
+        storage.delete(thumbnail_key_for(image_key))
+
+
+def remove_detection_images(paths: Iterable[Optional[str]]) -> int:
+    """Delete detection snapshot images, ignoring anything outside detections/"""
+    removed = 0
+    for path in paths:
+        key = key_for_path(path)
+        if key is not None and key.startswith(DETECTIONS_PREFIX + "/"):
+            storage.delete(key)
+            removed += 1
+    return removed
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from models import User, Package
+
+load_dotenv()
+
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+
+@dataclass(frozen=True)
+class PackageSnapshot:
+    id: int
+    name: str
+    price: Decimal
+    period: str
+    description: Optional[str]
+    features: Optional[List[Any]]
+    camera_limit: Optional[int]
+    max_registered_faces: Optional[int]
+    data_retention_days: Optional[int]
+
+    @classmethod
+    def from_model(cls, package: Package) -> "PackageSnapshot":
+        return cls(
+            id=package.id,
+            name=package.name,
+            price=package.price,
+            period=package.period,
+            description=package.description,
+            features=package.features,
+            camera_limit=package.camera_limit,
+            max_registered_faces=package.max_registered_faces,
+            data_retention_days=package.data_retention_days,
+        )
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, read-only view of a user and their package for request handling"""
+    id: int
+    email: str
+    full_name: str
+    phone_number: Optional[str]
+    package_id: Optional[int]
+    package: Optional[PackageSnapshot]
+    is_active: bool
+    is_verified: bool
+    created_at: datetime
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            phone_number=user.phone_number,
+            package_id=user.package_id,
+            package=PackageSnapshot.from_model(user.package) if user.package else None,
+            is_active=user.is_active,
+            is_verified=user.is_verified,
+            created_at=user.created_at,
+        )
+
+
+class UserCache:
+    """Bounded LRU cache with TTL from token subject (email) to UserSnapshot"""
+
+    def __init__(self, ttl: float = USER_CACHE_TTL_SECONDS, max_entries: int = USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email: str) -> Optional[UserSnapshot]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[email]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(email)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, snapshot: UserSnapshot) -> None:
+        with self._lock:
+            self._entries[snapshot.email] = (snapshot, time.monotonic() + self.ttl)
+            self._entries.move_to_end(snapshot.email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: Optional[int] = None, email: Optional[str] = None) -> None:
+        """Drop a user's entry by id and/or email"""
+        with self._lock:
+            if email is not None:
+                self._entries.pop(email, None)
+            if user_id is not None:
+                for key in [k for k, (s, _) in self._entries.items() if s.id == user_id]:
+                    del self._entries[key]
+
+    def invalidate_package(self, package_id: int) -> None:
+        """Drop every user on a package whose limits or details changed"""
+        with self._lock:
+            for key in [k for k, (s, _) in self._entries.items() if s.package_id == package_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+user_cache = UserCache()
+
+
+# Invalidate on ORM writes in this process; the TTL bounds staleness for
+# changes made by other workers or directly in the database
+def _columns_changed(target) -> bool:
+    # after_update also fires when only a relationship collection changed,
+    # e.g. Package.users on every registration
+    session = object_session(target)
+    return session is None or session.is_modified(target, include_collections=False)
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    if _columns_changed(target):
+        _user_changed(mapper, connection, target)
+
+
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    user_cache.invalidate_user(user_id=target.id, email=target.email)
+
+
+@event.listens_for(Package, "after_update")
+def _package_updated(mapper, connection, target):
+    if _columns_changed(target):
+        _package_changed(mapper, connection, target)
+
+
+@event.listens_for(Package, "after_delete")
+def _package_changed(mapper, connection, target):
+    user_cache.invalidate_package(target.id)
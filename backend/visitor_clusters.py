@@ -0,0 +1,321 @@
+"""Online clustering of unknown faces into recurring visitors
+
+Each unknown face the recognition pipeline sees is assigned to the nearest
+visitor cluster centroid within VISITOR_CLUSTER_TOLERANCE, or starts a new
+cluster. An assignment moves the centroid towards the new embedding as a
+running mean, so history is never re-clustered: a sighting costs one
+distance computation against the user's candidate centroids. Past
+VISITOR_CLUSTER_MAX_WEIGHT members the mean turns into a moving average
+that can still follow slow drift (lighting, glasses, ageing).
+
+The candidates are a FaceIndex per user holding the clusters seen most
+recently, at most VISITOR_CLUSTER_MAX_CANDIDATES. A visitor evicted from it
+starts a new cluster on their next visit. Candidates are kept for the
+VISITOR_CLUSTER_MAX_USERS most recently active users and reloaded from the
+database for the others. New clusters are inserted as soon
+as they are assigned, since detections reference them; centroid and count
+changes are written back in batches. Each process clusters the faces it
+recognizes.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal
+from embedding_format import decode_many
+from embedding_models import EMBEDDING_DIM, encode_embedding
+from face_index import FACE_EMBEDDING_MODEL, FaceIndex
+from models import VisitorCluster
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+VISITOR_CLUSTERING_ENABLED = os.getenv("VISITOR_CLUSTERING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Tighter than face matching: merging two strangers is worse than splitting one
+VISITOR_CLUSTER_TOLERANCE = float(os.getenv("VISITOR_CLUSTER_TOLERANCE", "0.5"))
+VISITOR_CLUSTER_MAX_CANDIDATES = int(os.getenv("VISITOR_CLUSTER_MAX_CANDIDATES", "2000"))
+# Users whose candidates are kept in memory, least recently active dropped first
+VISITOR_CLUSTER_MAX_USERS = int(os.getenv("VISITOR_CLUSTER_MAX_USERS", "1000"))
+VISITOR_CLUSTER_MAX_WEIGHT = int(os.getenv("VISITOR_CLUSTER_MAX_WEIGHT", "100"))
+# Centroids are updated many times, so they are stored at full precision
+CENTROID_DTYPE = "float32"
+# Centroid and count changes are written back this often
+FLUSH_SECONDS = 5.0
+
+_clusters = VisitorCluster.__table__
+_write_clusters = update(_clusters).where(
+    _clusters.c.id == bindparam("cluster_id")
+).values(
+    centroid=bindparam("new_centroid"),
+    sighting_count=_clusters.c.sighting_count + bindparam("added"),
+    last_seen_at=bindparam("last_seen"),
+)
+
+
+@dataclass(eq=False)
+class Cluster:
+    """In-memory state of one candidate cluster"""
+    cluster_id: int
+    centroid: np.ndarray
+    weight: int
+    first_seen: datetime
+    last_seen: datetime
+    # Sightings not yet added to sighting_count in the database
+    added: int = 0
+
+
+class _Candidates:
+    """One user's candidate clusters, least recently seen first"""
+
+    def __init__(self, dim: int, capacity: int):
+        self.index = FaceIndex(dim=dim, capacity=max(64, capacity))
+        self.clusters: "OrderedDict[int, Cluster]" = OrderedDict()
+
+    def put(self, cluster: Cluster) -> None:
+        self.index.add(cluster.cluster_id, cluster.centroid)
+        self.clusters[cluster.cluster_id] = cluster
+        self.clusters.move_to_end(cluster.cluster_id)
+
+    def pop(self, cluster_id: int) -> Optional[Cluster]:
+        self.index.remove(cluster_id)
+        return self.clusters.pop(cluster_id, None)
+
+
+class VisitorClusterer:
+    """Assigns unknown face embeddings to per-user visitor clusters
+
+    Used from the event loop only; assignments are serialized by a lock,
+    which is held across the insert of new clusters.
+    """
+
+    def __init__(
+        self,
+        tolerance: float = VISITOR_CLUSTER_TOLERANCE,
+        max_candidates: int = VISITOR_CLUSTER_MAX_CANDIDATES,
+        max_users: int = VISITOR_CLUSTER_MAX_USERS,
+        max_weight: int = VISITOR_CLUSTER_MAX_WEIGHT,
+        dim: int = EMBEDDING_DIM,
+        model: Optional[str] = FACE_EMBEDDING_MODEL,
+        enabled: bool = VISITOR_CLUSTERING_ENABLED
+    ):
+        self.tolerance = tolerance
+        self.max_candidates = max_candidates
+        self.max_users = max(1, max_users)
+        self.max_weight = max_weight
+        self.dim = dim
+        self.model = model
+        self.enabled = enabled
+        # Least recently active user first
+        self._users: "OrderedDict[int, _Candidates]" = OrderedDict()
+        # Clusters with changes to write back, including evicted ones
+        self._dirty: Dict[int, Cluster] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self.assigned = 0
+        self.created = 0
+        self.evicted = 0
+        self.users_evicted = 0
+        self.updates_written = 0
+
+    async def _load(self, db: AsyncSession, user_id: int) -> _Candidates:
+        """The user's most recently seen unpromoted clusters"""
+        rows = (await db.execute(
+            select(
+                VisitorCluster.id, VisitorCluster.centroid, VisitorCluster.sighting_count,
+                VisitorCluster.first_seen_at, VisitorCluster.last_seen_at
+            ).where(
+                VisitorCluster.user_id == user_id,
+                VisitorCluster.promoted_face_id.is_(None)
+            ).order_by(VisitorCluster.last_seen_at.desc()).limit(self.max_candidates)
+        )).all()
+        candidates = _Candidates(self.dim, len(rows))
+        used, vectors = decode_many([row.centroid for row in rows], self.dim, model=self.model)
+        # Oldest first, so the LRU order matches last_seen_at
+        for position, vector in reversed(list(zip(used, vectors))):
+            row = rows[position]
+            # Changes not yet written back are newer than the row
+            cluster = self._dirty.get(row.id) or Cluster(
+                cluster_id=row.id,
+                centroid=vector.copy(),
+                weight=row.sighting_count,
+                first_seen=row.first_seen_at,
+                last_seen=row.last_seen_at,
+            )
+            candidates.put(cluster)
+        return candidates
+
+    def _fold(self, candidates: _Candidates, cluster: Cluster, embedding: np.ndarray, seen_at: datetime):
+        weight = min(cluster.weight, self.max_weight)
+        cluster.centroid += (embedding - cluster.centroid) / (weight + 1)
+        cluster.weight += 1
+        cluster.last_seen = max(cluster.last_seen, seen_at)
+        candidates.put(cluster)
+        if cluster.cluster_id > 0:
+            cluster.added += 1
+            self._dirty[cluster.cluster_id] = cluster
+
+    async def assign(self, user_id: int, embeddings, seen_at: Sequence[datetime]) -> List[int]:
+        """Cluster ids for a batch of one user's unknown face embeddings
+
+        Embeddings are matched against the candidates in one matrix product.
+        Those without a match are compared again one by one, so that several
+        sightings of a new visitor in the same batch share one new cluster.
+        """
+        probes = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if probes.shape[0] == 0:
+            return []
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            candidates = self._users.get(user_id)
+            if candidates is None:
+                async with SessionLocal() as db:
+                    candidates = await self._load(db, user_id)
+                self._users[user_id] = candidates
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self.users_evicted += 1
+            self._users.move_to_end(user_id)
+
+            assigned: List[Cluster] = []
+            # Clusters started in this batch carry negative ids until inserted
+            new: List[Cluster] = []
+            for probe, match, when in zip(probes, candidates.index.match(probes, self.tolerance), seen_at):
+                if match is None and new:
+                    match = candidates.index.match(probe, self.tolerance)[0]
+                cluster = candidates.clusters.get(match.face_id) if match is not None else None
+                if cluster is None:
+                    cluster = Cluster(
+                        cluster_id=-(len(new) + 1), centroid=probe.copy(), weight=1,
+                        first_seen=when, last_seen=when
+                    )
+                    new.append(cluster)
+                    candidates.put(cluster)
+                else:
+                    self._fold(candidates, cluster, probe, when)
+                assigned.append(cluster)
+
+            if new:
+                await self._insert(user_id, candidates, new)
+            while len(candidates.clusters) > self.max_candidates:
+                _, evicted = candidates.clusters.popitem(last=False)
+                candidates.index.remove(evicted.cluster_id)
+                self.evicted += 1
+            self.assigned += len(assigned)
+            return [cluster.cluster_id for cluster in assigned]
+
+    async def _insert(self, user_id: int, candidates: _Candidates, new: List[Cluster]):
+        now = datetime.utcnow()
+        # Every row carries the same keys so the driver can batch them
+        rows = [
+            {
+                "user_id": user_id,
+                "centroid": encode_embedding(cluster.centroid, model=self.model, dtype=CENTROID_DTYPE),
+                "sighting_count": cluster.weight,
+                "first_seen_at": cluster.first_seen,
+                "last_seen_at": cluster.last_seen,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for cluster in new
+        ]
+        try:
+            async with SessionLocal() as db:
+                inserted = await db.execute(
+                    insert(VisitorCluster).returning(VisitorCluster.id, sort_by_parameter_order=True), rows
+                )
+                cluster_ids = inserted.scalars().all()
+                await db.commit()
+        except BaseException:
+            for cluster in new:
+                candidates.pop(cluster.cluster_id)
+            raise
+        for cluster, cluster_id in zip(new, cluster_ids):
+            candidates.pop(cluster.cluster_id)
+            cluster.cluster_id = cluster_id
+            candidates.put(cluster)
+        self.created += len(new)
+
+    def centroid(self, user_id: int, cluster_id: int) -> Optional[np.ndarray]:
+        """The in-memory centroid, newer than the stored one until the next flush"""
+        candidates = self._users.get(user_id)
+        cluster = candidates.clusters.get(cluster_id) if candidates is not None else None
+        return cluster.centroid.copy() if cluster is not None else None
+
+    def release(self, user_id: int, cluster_id: int) -> None:
+        """Stop assigning faces to a cluster once it has been promoted"""
+        candidates = self._users.get(user_id)
+        if candidates is not None:
+            candidates.pop(cluster_id)
+
+    async def flush(self):
+        """Write back centroid and sighting count changes"""
+        if not self._dirty:
+            return
+        pending = list(self._dirty.values())
+        self._dirty.clear()
+        params = [
+            {
+                "cluster_id": cluster.cluster_id,
+                "new_centroid": encode_embedding(cluster.centroid, model=self.model, dtype=CENTROID_DTYPE),
+                "added": cluster.added,
+                "last_seen": cluster.last_seen,
+            }
+            for cluster in pending
+        ]
+        for cluster in pending:
+            cluster.added = 0
+        try:
+            async with SessionLocal() as db:
+                await db.execute(_write_clusters, params)
+                await db.commit()
+        except Exception:
+            for cluster, sent in zip(pending, params):
+                cluster.added += sent["added"]
+                self._dirty[cluster.cluster_id] = cluster
+            raise
+        self.updates_written += len(params)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Writing visitor clusters failed")
+
+    async def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._users),
+            "candidates": sum(len(candidates.clusters) for candidates in self._users.values()),
+            "assigned": self.assigned,
+            "created": self.created,
+            "evicted": self.evicted,
+            "users_evicted": self.users_evicted,
+            "pending_updates": len(self._dirty),
+            "updates_written": self.updates_written,
+        }
+
+
+visitor_clusters = VisitorClusterer()
@@ -24,6 +24,8 @@ export function useAuth() {
   }, [router]);
 
   const logout = () => {
+    // Revoke the session server-side; the local token is dropped either way
+    api.logout().catch(() => {});
     removeAuthToken();
     setUser(null);
     router.push('/login');
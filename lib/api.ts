@@ -22,6 +22,7 @@ export interface Package {
   features?: string[];
   camera_limit?: number;
   max_registered_faces?: number;
+  data_retention_days?: number;
 }
 
 export interface Camera {
@@ -42,6 +43,7 @@ export interface RegisteredFace {
   id: number;
   face_name: string;
   face_image_path?: string;
+  thumbnail_path?: string;
   is_active: boolean;
   created_at: string;
   updated_at: string;
@@ -54,6 +56,8 @@ export interface DetectionLog {
   detection_confidence: number;
   detection_image_path?: string;
   detected_at: string;
+  last_seen_at?: string;
+  hit_count: number;
   created_at: string;
   camera?: Camera;
   registered_face?: RegisteredFace;
@@ -84,6 +88,96 @@ export const getAuthHeaders = () => {
   return token ? { Authorization: `Bearer ${token}` } : {};
 };
 
+export interface StatsDelta {
+  alerts?: number;
+  alerts_by_camera?: { camera_id: number; count: number }[];
+  active_faces?: number;
+}
+
+export interface EventHandlers {
+  onDetections?: (detections: DetectionLog[]) => void;
+  onStats?: (delta: StatsDelta) => void;
+  onCamera?: (change: { camera_id: number; status: string; last_seen?: string }) => void;
+  // Events were dropped because the client fell behind; refetch state
+  onResync?: () => void;
+}
+
+// Server-Sent Events stream of new detections and stats deltas.
+// EventSource cannot send headers, so each connection is opened with a
+// single-use ticket instead of the access token; after an error the stream
+// reconnects with a new ticket. Returns a function that closes the stream.
+export const subscribeEvents = (handlers: EventHandlers) => {
+  if (!getAuthToken() || typeof window === 'undefined') {
+    return () => {};
+  }
+  let source: EventSource | null = null;
+  let retry: ReturnType<typeof setTimeout> | undefined;
+  let closed = false;
+
+  const reconnect = () => {
+    if (!closed) {
+      retry = setTimeout(() => connect(true), 5000);
+    }
+  };
+
+  const connect = async (reconnecting: boolean) => {
+    const response = await fetch(`${API_BASE_URL}/events/ticket`, {
+      method: 'POST',
+      headers: {
+        ...getAuthHeaders(),
+      },
+    }).catch(() => null);
+    if (closed) {
+      return;
+    }
+    if (!response || !response.ok) {
+      // Signed out: stop; anything else is retried
+      if (response?.status !== 401) {
+        reconnect();
+      }
+      return;
+    }
+    const { ticket } = await response.json();
+    if (closed) {
+      return;
+    }
+    source = new EventSource(
+      `${API_BASE_URL}/events/stream?ticket=${encodeURIComponent(ticket)}`
+    );
+    source.addEventListener('open', () => {
+      // Events sent while disconnected were missed
+      if (reconnecting) {
+        handlers.onResync?.();
+      }
+    });
+    source.addEventListener('detections', (event) => {
+      handlers.onDetections?.(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('stats', (event) => {
+      handlers.onStats?.(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('camera', (event) => {
+      handlers.onCamera?.(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('resync', () => {
+      handlers.onResync?.();
+    });
+    source.addEventListener('error', () => {
+      // The ticket is spent, so EventSource's own retry would be refused
+      source?.close();
+      source = null;
+      reconnect();
+    });
+  };
+
+  connect(false);
+  return () => {
+    closed = true;
+    clearTimeout(retry);
+    source?.close();
+  };
+};
+
 // API functions
 export const api = {
   // Auth
@@ -120,6 +214,28 @@ export const api = {
     return result;
   },
 
+  async logout() {
+    const response = await fetch(`${API_BASE_URL}/auth/logout`, {
+      method: 'POST',
+      headers: {
+        ...getAuthHeaders(),
+      },
+    });
+    removeAuthToken();
+    return response.json();
+  },
+
+  async logoutAllSessions() {
+    const response = await fetch(`${API_BASE_URL}/auth/logout-all`, {
+      method: 'POST',
+      headers: {
+        ...getAuthHeaders(),
+      },
+    });
+    removeAuthToken();
+    return response.json();
+  },
+
   async getCurrentUser(): Promise<User> {
     const response = await fetch(`${API_BASE_URL}/auth/me`, {
       headers: {
@@ -245,6 +361,25 @@ export const api = {
     return response.json();
   },
 
+  async getDetectionsPage(
+    limit = 50,
+    cursor?: string
+  ): Promise<{ items: DetectionLog[]; nextCursor: string | null }> {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_BASE_URL}/detections?${params}`, {
+      headers: {
+        ...getAuthHeaders(),
+      },
+    });
+    return {
+      items: await response.json(),
+      nextCursor: response.headers.get('X-Next-Cursor'),
+    };
+  },
+
   async getDetectionLogs(limit = 50, offset = 0): Promise<DetectionLog[]> {
     const response = await fetch(
       `${API_BASE_URL}/detections?limit=${limit}&offset=${offset}`,
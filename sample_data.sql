@@ -0,0 +1,30 @@
+-- Sample data for development
+-- Run after the schema exists: cd backend && python -m migrate
+
+INSERT INTO users (email, full_name, phone_number, password_hash, package_id) VALUES 
+('arafat.adi@sysnova.com', 'Arafat Hossain Adi', '+1234567890', '$2b$12$LQv3c1yqBWVHxkd0LHAkCOYz6TtxMQJqyNjdt.3E4b9DAo47E7DPy', 2);
+
+INSERT INTO cameras (user_id, camera_name, camera_brand, camera_type, ip_address, port, username, password_hash, status) VALUES 
+(1, 'Living Room Camera', 'Hikvision', 'ip_camera', '192.168.1.100', 554, 'admin', '$2b$12$password_hash_here', 'active'),
+(1, 'Office Entrance', 'Dahua', 'ip_camera', '192.168.1.101', 554, 'admin', '$2b$12$password_hash_here', 'inactive'),
+(1, 'Kitchen Monitor', 'TP-Link', 'webcam', NULL, NULL, NULL, NULL, 'active');
+
+INSERT INTO registered_faces (user_id, face_name, face_image_path) VALUES 
+(1, 'Alif', '/uploads/faces/alif.jpg'),
+(1, 'Arafat', '/uploads/faces/arafat.jpg'),
+(1, 'Sanchita', '/uploads/faces/sanchita.jpg'),
+(1, 'Riyad', '/uploads/faces/riyad.jpg'),
+(1, 'Anika', '/uploads/faces/anika.jpg'),
+(1, 'Shushmita', '/uploads/faces/shushmita.jpg'),
+(1, 'Rahman', '/uploads/faces/rahman.jpg'),
+(1, 'Faiza', '/uploads/faces/faiza.jpg');
+
+INSERT INTO detection_logs (user_id, camera_id, registered_face_id, detection_confidence, detected_at) VALUES 
+(1, 1, 1, 0.9834, '2025-01-08 14:32:15'),
+(1, 1, 2, 0.9721, '2025-01-08 13:45:22'),
+(1, 3, 3, 0.9643, '2025-01-08 12:18:07'),
+(1, 2, 4, 0.9512, '2025-01-07 16:22:41'),
+(1, 1, 5, 0.9387, '2025-01-07 15:07:33'),
+(1, 3, 6, 0.9456, '2025-01-07 11:55:18'),
+(1, 1, 7, 0.9234, '2025-01-06 17:40:29'),
+(1, 2, 8, 0.9567, '2025-01-06 09:15:52');
\ No newline at end of file